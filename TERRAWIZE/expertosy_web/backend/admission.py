@@ -0,0 +1,252 @@
+"""
+Admission control for outbound LLM calls.
+
+Every upstream call passes through a process-wide scheduler that caps the number
+of concurrent calls, keeps a sliding tokens-per-minute budget and admits
+waiters by priority: interactive endpoints (/rank-products) first, then normal
+requests, then background and speculative work. When the expected wait exceeds
+a priority's budget the call is rejected immediately with AdmissionRejected,
+which the app turns into a 503 with a Retry-After header instead of letting the
+request sit until the worker times out.
+"""
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BACKGROUND: "background"}
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# 0 disables the tokens-per-minute budget
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_QUEUE_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("LLM_MAX_QUEUE_WAIT_INTERACTIVE", "20")),
+    PRIORITY_NORMAL: float(os.getenv("LLM_MAX_QUEUE_WAIT_NORMAL", "10")),
+    PRIORITY_BACKGROUND: float(os.getenv("LLM_MAX_QUEUE_WAIT_BACKGROUND", "2")),
+}
+
+# Priority of the request being served; set per endpoint and inherited by tasks it spawns
+current_priority: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=PRIORITY_NORMAL)
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """Run a block with a given LLM priority"""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class PriorityMiddleware:
+    """ASGI middleware setting the LLM priority of each request from its path prefix"""
+
+    def __init__(self, app, priorities: dict):
+        self.app = app
+        # Longest prefix first so more specific paths win
+        self.priorities = sorted(priorities.items(), key=lambda item: -len(item[0]))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for prefix, priority in self.priorities:
+                if scope["path"].startswith(prefix):
+                    with priority_scope(priority):
+                        return await self.app(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+class UpstreamUnavailable(Exception):
+    """An LLM call that was given up on; the client should retry after retry_after seconds"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionRejected(UpstreamUnavailable):
+    """Raised when an LLM call is shed instead of queued"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"LLM capacity exceeded: {reason}", retry_after)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Priority scheduler with a concurrency cap and a sliding tokens-per-minute budget"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 max_queue: int = LLM_MAX_QUEUE, max_wait: dict = None):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.max_wait = dict(max_wait or LLM_MAX_QUEUE_WAIT)
+        self.active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._token_window = deque()
+        self._window_tokens = 0
+        self._wakeup = None
+        # Running estimate of upstream call duration, used to predict queue wait
+        self.average_latency = 5.0
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rejected = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.queued = 0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0, priority: int = None):
+        """Hold an upstream slot for the duration of the block; yields the token reservation"""
+        priority = current_priority.get() if priority is None else priority
+        reservation = await self.acquire(priority, estimated_tokens)
+        started = time.monotonic()
+        try:
+            yield reservation
+        finally:
+            self.release(reservation, time.monotonic() - started)
+
+    async def acquire(self, priority: int, estimated_tokens: int = 0) -> list:
+        """Wait for a slot and token budget, or raise AdmissionRejected"""
+        name = PRIORITY_NAMES.get(priority, "normal")
+        if not self._waiters and self._can_admit(estimated_tokens):
+            return self._admit(name, estimated_tokens)
+
+        expected_wait = self._expected_wait(priority, estimated_tokens)
+        if expected_wait > self.max_wait.get(priority, self.max_wait[PRIORITY_NORMAL]):
+            self.rejected[name] += 1
+            raise AdmissionRejected("queue wait too long", expected_wait)
+        if len(self._waiters) >= self.max_queue:
+            self._shed_lowest(priority, name, expected_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), estimated_tokens, future]
+        heapq.heappush(self._waiters, entry)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait.get(priority, self.max_wait[PRIORITY_NORMAL]))
+        except asyncio.TimeoutError:
+            if future.done() and future.exception() is None:
+                return future.result()
+            self._remove_waiter(entry)
+            self.rejected[name] += 1
+            raise AdmissionRejected("timed out waiting for capacity", self.average_latency)
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Admitted just as we were cancelled: give the slot back
+                self.release(future.result(), 0.0)
+            else:
+                self._remove_waiter(entry)
+            raise
+        return future.result()
+
+    def release(self, reservation: list, duration: float):
+        self.active -= 1
+        if duration > 0:
+            self.average_latency = 0.8 * self.average_latency + 0.2 * duration
+        self._dispatch()
+
+    def record_usage(self, reservation: list, actual_tokens: int):
+        """Replace a reservation's estimated tokens with the usage reported upstream"""
+        if self.tokens_per_minute and reservation and actual_tokens:
+            self._window_tokens += actual_tokens - reservation[1]
+            reservation[1] = actual_tokens
+
+    def _can_admit(self, tokens: int) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        if not self.tokens_per_minute:
+            return True
+        self._expire_tokens()
+        # Always admit when idle so a single oversized request cannot deadlock
+        return self._window_tokens + tokens <= self.tokens_per_minute or not self._window_tokens
+
+    def _admit(self, name: str, tokens: int) -> list:
+        self.active += 1
+        self.admitted[name] += 1
+        reservation = [time.monotonic(), tokens]
+        if self.tokens_per_minute:
+            self._token_window.append(reservation)
+            self._window_tokens += tokens
+        return reservation
+
+    def _dispatch(self):
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(tokens):
+                self._schedule_budget_wakeup()
+                return
+            heapq.heappop(self._waiters)
+            future.set_result(self._admit(PRIORITY_NAMES.get(priority, "normal"), tokens))
+
+    def _expected_wait(self, priority: int, tokens: int) -> float:
+        ahead = sum(1 for entry in self._waiters if entry[0] <= priority)
+        wait = self.average_latency * (ahead + 1) / max(self.max_concurrency, 1)
+        if self.tokens_per_minute and self._token_window:
+            self._expire_tokens()
+            if self._window_tokens + tokens > self.tokens_per_minute:
+                wait = max(wait, self._token_window[0][0] + 60 - time.monotonic())
+        return wait
+
+    def _shed_lowest(self, priority: int, name: str, expected_wait: float):
+        """Reject the lowest-priority, newest waiter to make room, or the caller if it is lowest"""
+        worst = max(self._waiters, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            self.rejected[name] += 1
+            raise AdmissionRejected("queue full", expected_wait)
+        self._remove_waiter(worst)
+        self.rejected[PRIORITY_NAMES.get(worst[0], "normal")] += 1
+        worst[3].set_exception(AdmissionRejected("displaced by higher priority work", expected_wait))
+
+    def _remove_waiter(self, entry: list):
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+
+    def _expire_tokens(self):
+        cutoff = time.monotonic() - 60
+        while self._token_window and self._token_window[0][0] < cutoff:
+            self._window_tokens -= self._token_window.popleft()[1]
+
+    def _schedule_budget_wakeup(self):
+        if self._wakeup is not None or not self._token_window or self.active >= self.max_concurrency:
+            return
+        delay = max(self._token_window[0][0] + 60 - time.monotonic(), 0.01)
+
+        def wake():
+            self._wakeup = None
+            self._dispatch()
+
+        self._wakeup = asyncio.get_running_loop().call_later(delay, wake)
+
+    def stats(self) -> dict:
+        if self.tokens_per_minute:
+            self._expire_tokens()
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "tokens_in_window": self._window_tokens,
+            "average_latency": round(self.average_latency, 3),
+            "queued": self.queued,
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+        }
+
+
+# Process-wide scheduler shared by every engine
+admission = AdmissionController()
@@ -1,20 +1,58 @@
 import os
 import re
-import json
 import logging
+import time
 import asyncio
-import openpyxl
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_file
-from flask_cors import CORS
-from openai import OpenAI
 import traceback
-import httpx
-from asgiref.wsgi import WsgiToAsgi
+from openai.types import CompletionUsage
 from fastapi import FastAPI, Request
-from starlette.responses import JSONResponse, Response
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import List
+from typing import Dict, List, AsyncIterator, Tuple, Union
+
+from llm_client import close_llm_client, pool_stats
+from router import llm_router, LLMRouter
+from query_cache import query_cache, normalize_query
+from response_store import response_store, completion_key
+from speculation import speculations
+from fixtures import fixtures_from_env, CompletionFixtures
+from hedging import hedger, DeadlineMiddleware, deadline_scope, remaining_budget, current_endpoint
+from metrics import (
+    registry as metrics_registry, MetricsMiddleware, timed_to_thread, llm_duration, llm_tokens, llm_errors,
+    llm_profile_duration, ranking_failures, ranking_repairs, question_dedup, cache_lookups, admission_calls, admission_slots,
+    hedged_calls, client_disconnects, llm_cancelled, llm_tokens_saved, llm_backend_calls, llm_backend_open,
+    tournament_merges, tournament_chunks
+)
+from admission import (
+    admission, UpstreamUnavailable, PriorityMiddleware, priority_scope, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+)
+from prompts import (
+    prompt_cache_usage, prompt_cache_stats, FACTORS_PROMPT, QUESTIONNAIRE_PROMPT, BOOTSTRAP_PROMPT,
+    RECOMMENDATION_PROMPT, RANKING_QUESTIONNAIRE_PROMPT, RANKING_QUESTIONNAIRE_TOP_UP, RANK_PRODUCTS_PROMPT, MERGE_PROMPT,
+    RERANK_PROMPT
+)
+from profiles import GenerationProfile, GENERATION_PROFILES, get_profile
+from local_ranker import LocalRanker
+from records import Product, parse_products, product_lines, parse_questions, product_id
+from rerank import ranking_memory, preference_diff, parse_delta, apply_delta, RERANK_MAX_CHANGED_RATIO
+from tournament import (
+    TOURNAMENT_CHUNK_SIZE, TOURNAMENT_CONCURRENCY, TOURNAMENT_THRESHOLD,
+    chunk, run_listing, parse_merge_order, merge_runs, merge_max_tokens, tournament_deadline
+)
+from singleflight import completion_flight, query_flight
+from streaming import (
+    QuestionnaireStreamParser, RankedProductStreamParser, parse_questionnaire, salvage_ranked_products,
+    sse_event, SSE_HEADERS
+)
+from sessions import session_store, SessionNotFound, InvalidAnswers, question_id
+from jobs import jobs, Job, JobNotFound
+from disconnect import DisconnectMiddleware, cancellations
+from question_index import (
+    QuestionIndex, question_indexes, format_question, format_questionnaire, QUESTION_DEDUP_ENABLED,
+    QUESTION_DEDUP_MIN_QUESTIONS
+)
 
 load_dotenv()
 
@@ -29,297 +67,515 @@ ALLOWED_ORIGINS = [
     "http://localhost:3000"
 ]
 
-def get_allowed_origin(request_origin):
-    if not request_origin:
-        return ALLOWED_ORIGINS[0]  # Default to main domain
-    return request_origin if request_origin in ALLOWED_ORIGINS else ALLOWED_ORIGINS[0]
+# Deadline budget per endpoint path, matched exactly and shared by every LLM call the request makes.
+# Other paths, such as the streaming variants, get DEADLINE_DEFAULT; tournaments size their own.
+ENDPOINT_DEADLINES = {
+    "/generate-factors": float(os.getenv("DEADLINE_GENERATE_FACTORS", "20")),
+    "/create-questionnaire": float(os.getenv("DEADLINE_CREATE_QUESTIONNAIRE", "30")),
+    "/bootstrap": float(os.getenv("DEADLINE_BOOTSTRAP", "40")),
+    "/generate-recommendation": float(os.getenv("DEADLINE_GENERATE_RECOMMENDATION", "30")),
+    "/generate-ranking-questionnaire": float(os.getenv("DEADLINE_GENERATE_RANKING_QUESTIONNAIRE", "30")),
+    "/rank-products": float(os.getenv("DEADLINE_RANK_PRODUCTS", "45")),
+}
+
+# Record/replay of upstream completions for benchmarks, configured by LLM_FIXTURES_MODE
+default_fixtures = fixtures_from_env()
+
+# Only the top of a locally ranked list gets LLM-written explanations
+EXPLAIN_TOP_K = int(os.getenv("EXPLAIN_TOP_K", "10"))
 
 @asynccontextmanager
 async def lifespan(app):
     """Lifespan context for the application"""
     logger.info("Starting up application...")
+    metrics_flusher = asyncio.create_task(metrics_registry.flush_periodically())
     yield
     logger.info("Shutting down application...")
+    metrics_flusher.cancel()
+    speculations.cancel_all()
+    jobs.close()
+    await close_llm_client()
+    metrics_registry.flush()
 
-# Create Flask app
-flask_app = Flask(__name__)
+# Create FastAPI app with lifespan support
+fastapi_app = FastAPI(lifespan=lifespan)
 
 # Configure CORS properly
-CORS(flask_app, resources={
-    r"/*": {
-        "origins": ALLOWED_ORIGINS,
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "supports_credentials": True,
-        "expose_headers": ["Content-Type", "Authorization"]
-    }
-})
+fastapi_app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "Accept"],
+    allow_credentials=True,
+    expose_headers=["Content-Type", "Authorization"],
+    max_age=86400
+)
 
-# Create FastAPI app with lifespan support
-fastapi_app = FastAPI(lifespan=lifespan)
+# Ranking is what users sit and wait for; it goes ahead of everything else queued for the LLM
+fastapi_app.add_middleware(PriorityMiddleware, priorities={"/rank-products": PRIORITY_INTERACTIVE})
+fastapi_app.add_middleware(DeadlineMiddleware, deadlines=ENDPOINT_DEADLINES)
+# Durations and sizes include every other middleware
+fastapi_app.add_middleware(MetricsMiddleware, routes=lambda: [route.path for route in fastapi_app.routes])
+# Outermost, so a client leaving cancels everything below, and metrics record the request as a 499
+fastapi_app.add_middleware(DisconnectMiddleware)
 
-# Convert Flask app to ASGI
-wsgi_app = WsgiToAsgi(flask_app)
+@fastapi_app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    """Shed load and missed deadlines answer fast with a retryable 503/504 instead of a 500"""
+    return JSONResponse(
+        {"error": str(exc), "retry_after": exc.retry_after},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
-# Mount Flask app under FastAPI
-@fastapi_app.middleware("http")
-async def dispatch_flask(request: Request, call_next):
-    path = request.url.path
-    if path.startswith("/docs") or path.startswith("/openapi"):
-        return await call_next(request)
-    
-    try:
-        request_origin = request.headers.get("origin")
-        allowed_origin = get_allowed_origin(request_origin)
-        
-        # Add CORS headers to all responses
-        if request.method == "OPTIONS":
-            return JSONResponse(
-                content={},
-                headers={
-                    "Access-Control-Allow-Origin": allowed_origin,
-                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                    "Access-Control-Allow-Headers": "Content-Type, Authorization, Accept",
-                    "Access-Control-Allow-Credentials": "true",
-                    "Access-Control-Max-Age": "86400",
-                }
-            )
-        
-        # Handle health check endpoint directly in FastAPI
-        if path == "/health":
-            return JSONResponse(
-                content={
-                    "status": "healthy",
-                    "service": "expertosy-backend",
-                    "version": "1.0.0"
-                },
-                headers={
-                    "Access-Control-Allow-Origin": allowed_origin,
-                    "Access-Control-Allow-Credentials": "true"
-                }
-            )
-        
-        # For all other routes, use the Flask app
-        scope = request.scope
-        scope["type"] = "http"
-        
-        # Create a response buffer
-        response_body = []
-        response_headers = []
-        response_status = [200]
-        response_started = [False]
-        
-        async def receive():
-            body = await request.body()
-            return {
-                "type": "http.request",
-                "body": body,
-                "more_body": False
-            }
-        
-        async def send(message):
-            nonlocal response_started
-            if message["type"] == "http.response.start":
-                response_started[0] = True
-                response_status[0] = message["status"]
-                response_headers.extend(message.get("headers", []))
-            elif message["type"] == "http.response.body":
-                if not response_started[0]:
-                    response_status[0] = 200
-                body = message.get("body", b"")
-                if isinstance(body, str):
-                    body = body.encode('utf-8')
-                elif isinstance(body, dict):
-                    body = json.dumps(body).encode('utf-8')
-                elif isinstance(body, bytes):
-                    pass
-                else:
-                    body = str(body).encode('utf-8')
-                response_body.append(body)
-        
-        await wsgi_app(scope, receive, send)
-        
-        # Combine all response parts
-        body = b"".join(response_body)
-        
-        # Try to decode JSON responses
-        content_type = None
-        for key, value in response_headers:
-            if key.lower() == b'content-type':
-                content_type = value.decode('utf-8')
-                break
-        
-        if content_type and 'application/json' in content_type:
-            try:
-                decoded_body = body.decode('utf-8')
-                if decoded_body:
-                    body = json.loads(decoded_body)
-                    return JSONResponse(
-                        content=body,
-                        status_code=response_status[0],
-                        headers={
-                            "Access-Control-Allow-Origin": allowed_origin,
-                            "Access-Control-Allow-Credentials": "true"
-                        }
-                    )
-            except Exception as e:
-                logger.error(f"Error decoding JSON response: {e}")
-                pass
-        
-        # Add CORS headers to the response headers
-        response_headers.extend([
-            (b"Access-Control-Allow-Origin", allowed_origin.encode('utf-8')),
-            (b"Access-Control-Allow-Credentials", b"true")
-        ])
-        
-        return Response(
-            content=body,
-            status_code=response_status[0],
-            headers=dict(response_headers),
-            media_type=content_type
-        )
-        
-    except Exception as e:
-        logger.error(f"Error in dispatch_flask: {e}")
-        logger.error(traceback.format_exc())
-        return JSONResponse(
-            status_code=500,
-            content={"error": str(e)},
-            headers={
-                "Access-Control-Allow-Origin": allowed_origin,
-                "Access-Control-Allow-Credentials": "true"
-            }
-        )
+@fastapi_app.exception_handler(SessionNotFound)
+async def session_not_found_handler(request: Request, exc: SessionNotFound):
+    """The client should start a new ranking session"""
+    return JSONResponse({"error": "Ranking session not found or expired"}, status_code=404)
+
+@fastapi_app.exception_handler(InvalidAnswers)
+async def invalid_answers_handler(request: Request, exc: InvalidAnswers):
+    """Answers sent to a ranking session in the wrong shape are the client's error"""
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+@fastapi_app.exception_handler(JobNotFound)
+async def job_not_found_handler(request: Request, exc: JobNotFound):
+    """Unknown job ids and jobs whose result was already evicted answer with a 404"""
+    return JSONResponse({"error": "Job not found or its result has expired"}, status_code=404)
 
 # Use the FastAPI app as our main ASGI application
 asgi_app = fastapi_app
 
-@flask_app.route('/')
-def root():
+@fastapi_app.get('/')
+async def root():
     """Root endpoint for health checks"""
-    return jsonify({
+    return {
         "status": "healthy",
         "service": "expertosy-backend",
         "version": "1.0.0"
-    })
+    }
 
-@flask_app.route('/health')
-def health_check():
+@fastapi_app.get('/health')
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return {
         "status": "healthy",
         "service": "expertosy-backend",
         "version": "1.0.0"
-    })
-
-# Create an OpenAI client with a custom HTTP client to avoid proxy issues
-client = OpenAI(
-    api_key=os.getenv("DEEPSEEK_API_KEY", ""),
-    base_url="https://api.deepseek.com",
-    timeout=60.0,
-    max_retries=2
-)
+    }
+
+async def read_json(request: Request) -> dict:
+    """Parse the request body as a JSON object, returning an empty dict if it is missing or malformed"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+@fastapi_app.get('/cache-stats')
+async def cache_stats():
+    """Hit/miss statistics for the factor and questionnaire cache"""
+    return query_cache.stats()
+
+@fastapi_app.get('/response-store-stats')
+async def response_store_stats():
+    """Size and hit statistics for the persistent response store"""
+    return response_store.stats()
+
+@fastapi_app.get('/singleflight-stats')
+async def singleflight_stats():
+    """How many identical LLM calls were collapsed into a single upstream request"""
+    return {
+        "completion": completion_flight.stats(),
+        "query": query_flight.stats()
+    }
+
+@fastapi_app.get('/speculation-stats')
+async def speculation_stats():
+    """Budget usage and claim rate of speculative questionnaire generation"""
+    return speculations.stats()
+
+@fastapi_app.get('/rerank-stats')
+async def rerank_stats():
+    """How often /rank-products was served incrementally instead of from scratch"""
+    return ranking_memory.stats()
+
+@fastapi_app.get('/admission-stats')
+async def admission_stats():
+    """Outbound LLM scheduler statistics: slots in use, queue depth, token budget, shed calls"""
+    return admission.stats()
+
+@fastapi_app.get('/prompt-cache-stats')
+async def prompt_cache_stats_route():
+    """Per-endpoint upstream prompt cache hit tokens, estimated savings and hit vs miss latency"""
+    return prompt_cache_stats.stats()
+
+@fastapi_app.get('/generation-profiles')
+async def generation_profiles():
+    """Model and sampling parameters used by each engine method"""
+    return {name: profile.describe() for name, profile in GENERATION_PROFILES.items()}
+
+@fastapi_app.get('/session-stats')
+async def session_stats():
+    """Ranking session backend, live sessions and lookups of unknown or expired ids"""
+    return session_store.stats()
+
+@fastapi_app.get('/question-index-stats')
+async def question_index_stats():
+    """Cached per-session question indexes used to drop reworded repeat questions, with their hit rate"""
+    return question_indexes.stats()
+
+@fastapi_app.get('/job-stats')
+async def job_stats():
+    """Queued, running and finished jobs of this worker"""
+    return jobs.stats()
+
+@fastapi_app.get('/hedge-stats')
+async def hedge_stats():
+    """Per-endpoint upstream latency percentiles, hedge delays and deadline misses"""
+    return hedger.stats()
+
+@fastapi_app.get('/router-stats')
+async def router_stats():
+    """Latency and error estimates and circuit breaker state of each LLM backend"""
+    return llm_router.stats()
+
+@fastapi_app.get('/cancellation-stats')
+async def cancellation_stats():
+    """Client disconnects, cancelled upstream calls and the completion tokens that saved"""
+    return cancellations.stats()
+
+def collect_process_metrics():
+    """Mirror the counters other modules keep for their /…-stats endpoints into the metrics registry"""
+    for result, value in (("hit", query_cache.hits), ("near_hit", query_cache.near_hits), ("miss", query_cache.misses)):
+        cache_lookups.set(value, cache="query", result=result)
+    cache_lookups.set(response_store.hits, cache="response_store", result="hit")
+    cache_lookups.set(response_store.misses, cache="response_store", result="miss")
+    for priority, value in admission.admitted.items():
+        admission_calls.set(value, priority=priority, result="admitted")
+    for priority, value in admission.rejected.items():
+        admission_calls.set(value, priority=priority, result="rejected")
+    scheduler = admission.stats()
+    admission_slots.set(scheduler["active"], state="active")
+    admission_slots.set(scheduler["waiting"], state="waiting")
+    hedged_calls.set(hedger.hedged, result="fired")
+    hedged_calls.set(hedger.hedge_wins, result="won")
+    for backend in llm_router.backends:
+        llm_backend_calls.set(backend.calls - backend.failures, backend=backend.name, result="success")
+        llm_backend_calls.set(backend.failures, backend=backend.name, result="failure")
+        llm_backend_open.set(int(backend.state == "open"), backend=backend.name)
+    client_disconnects.set(cancellations.disconnects)
+    for reason, value in cancellations.cancelled.items():
+        llm_cancelled.set(value, reason=reason)
+    for reason, value in cancellations.tokens_saved.items():
+        llm_tokens_saved.set(value, reason=reason)
+
+metrics_registry.add_collector(collect_process_metrics)
+
+@fastapi_app.get('/metrics')
+async def prometheus_metrics():
+    """Prometheus metrics aggregated over every worker of this server"""
+    return PlainTextResponse(
+        await asyncio.to_thread(metrics_registry.render),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@fastapi_app.get('/llm-pool-stats')
+async def llm_pool_stats():
+    """Connection reuse statistics for the shared LLM client"""
+    return pool_stats()
 
 class ExpertosyRecommendationEngine:
     """
     Web-based recommendation engine with similar functionality to the CLI version
     """
-    def __init__(self, search_query: str = None):
+    def __init__(self, search_query: str = None, openai_client=None, use_cache: bool = True,
+                 fixtures: CompletionFixtures = None):
         """Initialize the recommendation engine."""
         self.search_query = search_query
         self.results = {}
-        self.openai_client = OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY", ""),
-            base_url="https://api.deepseek.com"
-        )
+        self.fixtures = fixtures if fixtures is not None else default_fixtures
+        # While recording, every completion has to reach the API to be captured
+        self.use_cache = use_cache and not (self.fixtures is not None and self.fixtures.recording)
+        # Engines are created per request; they all share the process-wide router and its pooled clients
+        self.router = llm_router if openai_client is None else LLMRouter.for_client(openai_client)
         
-    async def _get_completion(self, messages: List[dict]) -> str:
-        """Get completion from OpenAI API."""
+    async def _get_completion(self, messages: List[dict], profile: Union[str, GenerationProfile] = "default") -> str:
+        """Get completion from OpenAI API using the named generation profile."""
+        profile = get_profile(profile)
+        key = completion_key(profile.model, messages, **profile.params())
+        if self.fixtures is not None and self.fixtures.replaying:
+            return await self.fixtures.replay(key)
+        if not self.use_cache:
+            return await completion_flight.do(key, lambda: self._fetch_completion(key, messages, profile))
+
+        stored = await timed_to_thread("response_store_get", response_store.get, key)
+        if stored is not None:
+            return stored
+        # Identical in-flight calls, in this worker or another one, share a single upstream request
+        return await completion_flight.do(
+            key,
+            lambda: self._fetch_completion(key, messages, profile),
+            shared_result=lambda: response_store.get(key)
+        )
+
+    @staticmethod
+    def _estimate_tokens(messages: List[dict], profile: GenerationProfile) -> int:
+        """Rough upper bound of the tokens a call will use, reserved against the per-minute budget"""
+        return sum(len(message.get("content", "")) for message in messages) // 4 + profile.max_tokens
+
+    async def _create_completion(self, messages: List[dict], profile: GenerationProfile, timeout: float = None,
+                                 on_sent=None):
+        """One upstream attempt, admitted by the scheduler and bounded by the deadline; on_sent() marks admission"""
+        sent = None
         try:
-            response = await asyncio.to_thread(
-                self.openai_client.chat.completions.create,
-                model="deepseek-chat",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000
+            async with admission.slot(self._estimate_tokens(messages, profile)) as reservation:
+                sent = time.monotonic()
+                if on_sent is not None:
+                    on_sent()
+                # The fastest healthy backend answers; the router falls back to the others if it fails
+                _, response = await self.router.create(profile, messages, timeout, **profile.params())
+                if response.usage:
+                    admission.record_usage(reservation, response.usage.total_tokens)
+                    cancellations.record_completion(profile, response.usage.completion_tokens, time.monotonic() - sent)
+        except asyncio.CancelledError:
+            # Cancelling the SDK call closes its connection, so upstream stops generating
+            cancellations.record_cancelled(profile, None if sent is None else time.monotonic() - sent)
+            raise
+        return response
+
+    @staticmethod
+    def _record_usage(endpoint: str, usage, elapsed: float):
+        """Count a completion's tokens, splitting its prompt into cached and uncached prefix tokens"""
+        cached, uncached = prompt_cache_usage(usage)
+        llm_tokens.inc(usage.prompt_tokens, endpoint=endpoint, kind="prompt")
+        llm_tokens.inc(cached, endpoint=endpoint, kind="prompt_cached")
+        llm_tokens.inc(usage.completion_tokens, endpoint=endpoint, kind="completion")
+        prompt_cache_stats.record(endpoint, cached, uncached, elapsed)
+
+    async def _fetch_completion(self, key: str, messages: List[dict], profile: GenerationProfile) -> str:
+        started = time.monotonic()
+        endpoint = current_endpoint.get()
+        try:
+            # Slow calls get a duplicate request past the endpoint's hedge delay; the first answer wins
+            response = await hedger.call(
+                lambda timeout, sent: self._create_completion(messages, profile, timeout, sent)
             )
-            return response.choices[0].message.content.strip()
+            content = response.choices[0].message.content.strip()
+        except UpstreamUnavailable:
+            llm_errors.inc(endpoint=endpoint)
+            raise
         except Exception as e:
+            llm_errors.inc(endpoint=endpoint)
             logging.error(f"Error getting completion: {str(e)}")
             raise
 
+        elapsed = time.monotonic() - started
+        llm_duration.observe(elapsed, endpoint=endpoint, mode="complete")
+        llm_profile_duration.observe(elapsed, profile=profile.name, model=profile.model)
+        if response.usage:
+            self._record_usage(endpoint, response.usage, elapsed)
+
+        if self.fixtures is not None and self.fixtures.recording:
+            await timed_to_thread("fixtures_record", self.fixtures.record, key, content, time.monotonic() - started)
+        await timed_to_thread("response_store_put", response_store.put, key, content)
+        return content
+
+    async def _stream_completion(self, messages: List[dict],
+                                 profile: Union[str, GenerationProfile] = "default") -> AsyncIterator[str]:
+        """Stream completion deltas from OpenAI API as they are generated."""
+        profile = get_profile(profile)
+        key = completion_key(profile.model, messages, **profile.params())
+        if self.fixtures is not None and self.fixtures.replaying:
+            yield await self.fixtures.replay(key)
+            return
+        if self.use_cache:
+            stored = await timed_to_thread("response_store_get", response_store.get, key)
+            if stored is not None:
+                yield stored
+                return
+
+        chunks = []
+        usage = None
+        sent = stream = backend = None
+        started = time.monotonic()
+        try:
+            async with admission.slot(self._estimate_tokens(messages, profile)) as reservation:
+                sent = time.monotonic()
+                backend, stream = await self.router.create(profile, messages, remaining_budget(), stream=True,
+                                                           **profile.params())
+                async for chunk in stream:
+                    # Usage, when the API reports it for streams, arrives on the final chunk
+                    chunk_usage = getattr(chunk, "usage", None)
+                    if chunk_usage:
+                        usage = CompletionUsage.construct(**chunk_usage) if isinstance(chunk_usage, dict) else chunk_usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                self.router.record_stream(backend, profile, time.monotonic() - sent)
+                if usage:
+                    admission.record_usage(reservation, usage.total_tokens)
+                    cancellations.record_completion(profile, usage.completion_tokens, time.monotonic() - sent)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The reader is gone: close the upstream response instead of letting it generate on
+            if stream is not None:
+                await stream.response.aclose()
+            cancellations.record_cancelled(profile, None if sent is None else time.monotonic() - sent,
+                                           None if stream is None else len("".join(chunks)) // 4)
+            raise
+        except UpstreamUnavailable:
+            llm_errors.inc(endpoint=current_endpoint.get())
+            raise
+        except Exception as e:
+            llm_errors.inc(endpoint=current_endpoint.get())
+            logging.error(f"Error streaming completion: {str(e)}")
+            if stream is not None:
+                # The backend failed part way through; only failures before the stream started were retried
+                self.router.record_stream(backend, profile)
+            raise
+
+        elapsed = time.monotonic() - started
+        llm_duration.observe(elapsed, endpoint=current_endpoint.get(), mode="stream")
+        llm_profile_duration.observe(elapsed, profile=profile.name, model=profile.model)
+        if usage:
+            self._record_usage(current_endpoint.get(), usage, elapsed)
+        content = "".join(chunks).strip()
+        if self.fixtures is not None and self.fixtures.recording:
+            await timed_to_thread("fixtures_record", self.fixtures.record, key, content, time.monotonic() - started)
+        await timed_to_thread("response_store_put", response_store.put, key, content)
+
+    async def _stream_questions(self, messages: List[dict], profile: str) -> AsyncIterator[tuple]:
+        """Stream a questionnaire as token events plus a question event per completed question."""
+        parser = QuestionnaireStreamParser()
+        chunks = []
+        async for delta in self._stream_completion(messages, profile):
+            chunks.append(delta)
+            yield "token", delta
+            for question in parser.feed(delta):
+                yield "question", question
+        for question in parser.close():
+            yield "question", question
+        questionnaire = "".join(chunks).strip()
+        logger.info(f"Streamed questionnaire with {parser.emitted} questions")
+        yield "done", {"questionnaire": questionnaire}
+
+    def _factors_messages(self, number_of_factors: int) -> List[dict]:
+        """Build the prompt for generate_factors"""
+        return FACTORS_PROMPT.render(number_of_factors=number_of_factors, search_query=self.search_query)
+
     async def generate_factors(self, number_of_factors: int = 10) -> list:
         """Generate comprehensive factors for evaluating the item"""
-        messages = [
-            {
-                "role": "system",
-                "content": f"You are an expert at analyzing {self.search_query}."
-            },
-            {
-                "role": "user",
-                "content": f"List {number_of_factors} unique and comprehensive factors for evaluating for what is most important to the user when choosing a {self.search_query}."
-                "Focus on the key differences between the different {self.search_query} and create factors that will help determine the best match for the user."
-                "Its basically the facotrs that you would think about when choosing a {self.search_query}."
-                "The factors should be in the form of a question that the user would ask themselves when choosing a {self.search_query}."
-                "When considering the factors, think about the trade-offs between the different {self.search_query} and create factors that will help determine the best match for the user."
-            },  
-            {
-                "role": "assistant",
-                "content": "Provide factors separated by '*', without numbering or additional text."
-            }
-        ]
-        response = await self._get_completion(messages)
-        self.results["factors"] = response.split('*')
+        if self.use_cache:
+            cached = query_cache.get("factors", self.search_query, number_of_factors)
+            if cached is not None:
+                self.results["factors"] = list(cached)
+                return self.results["factors"]
+
+        # Concurrent requests for the same normalized query share one completion
+        factors = await query_flight.do(
+            ("factors", normalize_query(self.search_query), number_of_factors),
+            lambda: self._fetch_factors(number_of_factors)
+        )
+        self.results["factors"] = list(factors)
         return self.results["factors"]
 
+    async def _fetch_factors(self, number_of_factors: int) -> tuple:
+        response = await self._get_completion(self._factors_messages(number_of_factors), "generate_factors")
+        factors = tuple(response.split('*'))
+        query_cache.set("factors", self.search_query, factors, number_of_factors)
+        return factors
+
+    def _questionnaire_messages(self, factors: list) -> List[dict]:
+        """Build the prompt for create_questionnaire"""
+        return QUESTIONNAIRE_PROMPT.render(search_query=self.search_query, factors=", ".join(factors))
+
+    @staticmethod
+    def _factors_cache_key(factors: list) -> tuple:
+        return tuple(" ".join(str(factor).lower().split()) for factor in factors)
+
     async def create_questionnaire(self, factors: list) -> str:
         """Create a structured questionnaire based on given factors"""
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    f"You are an expert at creating questionnaires for {self.search_query}. "
-                    "Generate many questions for a questionnaire with multiple-choice questions. "
-                    "Format each question with a clear text and 4 lettered options (A, B, C, D). "
-                    "Include cost ranges or relevant details for each option when applicable.\n\n"
-                    "Format requirements:\n"
-                    "1. Number each question as '1.', '2.'\n"
-                    "2. Each question should be clear and direct\n"
-                    "3. Format options exactly as 'A)', 'B)', 'C)', 'D)'\n"
-                    "4. Each option should be on a new line\n"
-                    "5. Do not include any additional text or formatting\n\n"
-                    "Example format:\n"
-                    "1. What is your preferred price range?\n"
-                    "A) $0-$500\n"
-                    "B) $501-$1000\n"
-                    "C) $1001-$1500\n"
-                    "D) $1501 or more\n\n"
-                    "2. What is your primary use case?\n"
-                    "A) Personal use\n"
-                    "B) Professional work\n"
-                    "C) Gaming\n"
-                    "D) Content creation"
-                )
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"Create a questionnaire for {self.search_query} using these factors: {', '.join(factors)}. "
-                    "Follow the exact format shown in the example. "
-                    "Ensure each question has 4 options labeled A), B), C), D). "
-                    "Include cost ranges or specific details for each option. "
-                    "The questionnaire should help determine the user's precise preferences."
-                )
-            }
-        ]
-        
-        response = await self._get_completion(messages)
+        if self.use_cache:
+            cached = query_cache.get("questionnaire", self.search_query, self._factors_cache_key(factors))
+            if cached is not None:
+                return cached
+
+        cache_key = self._factors_cache_key(factors)
+        return await query_flight.do(
+            ("questionnaire", normalize_query(self.search_query), cache_key),
+            lambda: self._fetch_questionnaire(factors, cache_key)
+        )
+
+    async def _fetch_questionnaire(self, factors: list, cache_key: tuple) -> str:
+        response = await self._get_completion(self._questionnaire_messages(factors), "create_questionnaire")
         
         # Log the response for debugging
         logger.info(f"Generated questionnaire: {response}")
         
+        query_cache.set("questionnaire", self.search_query, response, cache_key)
         return response
 
+    @staticmethod
+    async def replay_questionnaire(questionnaire: str) -> AsyncIterator[tuple]:
+        """Emit an already generated questionnaire as whole question events without token events"""
+        for question in parse_questionnaire(questionnaire):
+            yield "question", question
+        yield "done", {"questionnaire": questionnaire}
+
+    async def stream_questionnaire(self, factors: list) -> AsyncIterator[tuple]:
+        """Stream create_questionnaire, emitting each question once its options are parsed"""
+        cache_key = self._factors_cache_key(factors)
+        cached = query_cache.get("questionnaire", self.search_query, cache_key) if self.use_cache else None
+        if cached is not None:
+            async for event in self.replay_questionnaire(cached):
+                yield event
+            return
+
+        async for event, data in self._stream_questions(self._questionnaire_messages(factors), "create_questionnaire"):
+            if event == "done":
+                query_cache.set("questionnaire", self.search_query, data["questionnaire"], cache_key)
+            yield event, data
+
+    def _bootstrap_messages(self, number_of_factors: int) -> List[dict]:
+        """Build the single prompt that returns both the factors and the questionnaire"""
+        return BOOTSTRAP_PROMPT.render(number_of_factors=number_of_factors, search_query=self.search_query)
+
+    @staticmethod
+    def _parse_bootstrap(response: str) -> tuple:
+        """Split a bootstrap completion into its factor list and questionnaire text"""
+        match = re.search(r'#+\s*FACTORS\s*(.*?)#+\s*QUESTIONNAIRE\s*(.*)', response, re.DOTALL | re.IGNORECASE)
+        if not match:
+            raise ValueError("Bootstrap response is missing the FACTORS or QUESTIONNAIRE section")
+        factors = [factor.strip() for factor in match.group(1).split('*') if factor.strip()]
+        questionnaire = match.group(2).strip()
+        if not factors or not questionnaire:
+            raise ValueError("Bootstrap response has an empty section")
+        return tuple(factors), questionnaire
+
+    async def bootstrap(self, number_of_factors: int = 10) -> dict:
+        """Generate the factors and their questionnaire in a single completion"""
+        if self.use_cache:
+            factors = query_cache.get("factors", self.search_query, number_of_factors)
+            if factors is not None:
+                questionnaire = query_cache.get("questionnaire", self.search_query, self._factors_cache_key(factors))
+                if questionnaire is not None:
+                    return {"factors": list(factors), "questionnaire": questionnaire}
+
+        factors, questionnaire = await query_flight.do(
+            ("bootstrap", normalize_query(self.search_query), number_of_factors),
+            lambda: self._fetch_bootstrap(number_of_factors)
+        )
+        self.results["factors"] = list(factors)
+        return {"factors": list(factors), "questionnaire": questionnaire}
+
+    async def _fetch_bootstrap(self, number_of_factors: int) -> tuple:
+        response = await self._get_completion(self._bootstrap_messages(number_of_factors), "bootstrap")
+        factors, questionnaire = self._parse_bootstrap(response)
+        # Seed both caches so later two-step requests for this query are served locally
+        query_cache.set("factors", self.search_query, factors, number_of_factors)
+        query_cache.set("questionnaire", self.search_query, questionnaire, self._factors_cache_key(factors))
+        return factors, questionnaire
+
     async def generate_recommendation(self, user_preferences: dict) -> str:
         """Generate 2 product names and prices based on user preferences"""
         try:
@@ -331,181 +587,457 @@ class ExpertosyRecommendationEngine:
                 ])
             )
             
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        f"Based on all the user's answers, recommend by name and price only 10 {self.search_query}s "
-                        "that would most likely fit this profile. Format each line as:\n"
-                        "1. [Product Name] - $[Price]\n"
-                        "2. [Product Name] - $[Price]\n"
-                        "... and so on until 2.\n"
-                        "ONLY include the name and price. NO descriptions or additional details."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Based on these preferences, list 20 {self.search_query}s with ONLY their names and prices:\n\n"
-                        f"{preference_text}"
-                    )
-                }
-            ]
+            messages = RECOMMENDATION_PROMPT.render(search_query=self.search_query, preference_text=preference_text)
             
             logger.info(f"Generating 10 product recommendations for {self.search_query}")
             logger.debug(f"User preferences: {preference_text}")
             
-            response = await self._get_completion(messages)
+            response = await self._get_completion(messages, "generate_recommendation")
             
             # Store the recommendation
             self.results["recommendation"] = response
             return response
             
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error generating recommendations: {str(e)}")
             logger.error(f"Search query: {self.search_query}")
             logger.error(f"User preferences: {user_preferences}")
             raise Exception(f"Failed to generate recommendations: {str(e)}")
 
-    async def generate_ranking_questionnaire(self, products: list, previous_questions: list = None) -> str:
+    @staticmethod
+    def recommended_products(recommendation: str) -> List[Product]:
+        """Product records of a recommendation, without lines that name no price or repeat a product"""
+        return [product for product in parse_products(line for line in recommendation.split('\n') if line.strip())
+                if product.price is not None]
+
+    def _ranking_questionnaire_messages(self, products: list, previous_questions: list = None) -> List[dict]:
+        """Build the prompt for generate_ranking_questionnaire"""
+        products_text = "\n".join(products)
+        previous_questions_text = ""
+        
+        if previous_questions:
+            previous_questions_text = "\n\nPreviously asked questions (DO NOT duplicate these):\n" + "\n".join(
+                [f"- {q}" for q in previous_questions]
+            )
+        
+        return RANKING_QUESTIONNAIRE_PROMPT.render(
+            products_text=products_text, previous_questions_text=previous_questions_text
+        )
+
+    async def generate_ranking_questionnaire(self, products: list, previous_questions: list = None,
+                                             question_index: QuestionIndex = None) -> str:
         """Generate a questionnaire to rank products based on trade-offs"""
         try:
-            products_text = "\n".join(products)
-            previous_questions_text = ""
-            
-            if previous_questions:
-                previous_questions_text = "\n\nPreviously asked questions (DO NOT duplicate these):\n" + "\n".join(
-                    [f"- {q}" for q in previous_questions]
-                )
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert at creating questionnaires that help rank products based on trade-offs. "
-                        "Create multiple-choice questions that help understand user preferences regarding the key differences between these products.\n\n"
-                        "Format requirements:\n"
-                        "1. Number each question as '1.', '2.', etc.\n"
-                        "2. Each question MUST end with a question mark (?)\n"
-                        "3. Format options exactly as 'A)', 'B)', 'C)', 'D)'\n"
-                        "4. Focus on comparing price vs features, performance vs portability, etc.\n"
-                        "5. Make questions that help distinguish between the products' advantages and disadvantages.\n"
-                        "6. DO NOT duplicate any questions that were previously asked.\n\n"
-                        "Example format:\n"
-                        "1. What is your primary concern when choosing between these products?\n"
-                        "A) Price and value for money\n"
-                        "B) Performance and speed\n"
-                        "C) Build quality and durability\n"
-                        "D) Brand reputation and support"
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Create a questionnaire to help rank these products based on their trade-offs:\n\n{products_text}\n"
-                        f"{previous_questions_text}\n\n"
-                        "Focus on the key differences between these specific products and create questions that will help determine the best match for the user. "
-                        "When wording the questions think about specific things that would rule out some of the products. "
-                        "IMPORTANT: Do not duplicate any of the previously asked questions or ask about the same topics in a different way."
-                    )
-                }
-            ]
-            
-            response = await self._get_completion(messages)
+            messages = self._ranking_questionnaire_messages(products, previous_questions)
+            response = await self._get_completion(messages, "generate_ranking_questionnaire")
             
             # Log the response for debugging
             logger.info(f"Generated ranking questionnaire: {response}")
             
-            return response
+            return await self._deduplicate_questionnaire(messages, response, previous_questions, question_index)
             
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error generating ranking questionnaire: {str(e)}")
             raise Exception(f"Failed to generate ranking questionnaire: {str(e)}")
 
+    def _question_index(self, previous_questions: list, question_index: QuestionIndex = None) -> QuestionIndex:
+        """The caller's index of asked questions, or a throwaway one over previous_questions"""
+        if question_index is not None:
+            return question_index
+        return QuestionIndex.from_questions(previous_questions or [], self.search_query or "")
+
+    async def _deduplicate_questionnaire(self, messages: List[dict], response: str, previous_questions: list,
+                                         question_index: QuestionIndex = None) -> str:
+        """Drop questions that repeat asked ones, topping the questionnaire up when too few are left"""
+        questions = parse_questionnaire(response)
+        if not QUESTION_DEDUP_ENABLED or not questions:
+            return response
+        index = self._question_index(previous_questions, question_index)
+        kept, repeated = index.filter(questions)
+        question_dedup.inc(len(kept), result="kept")
+        if not repeated:
+            return response
+        question_dedup.inc(len(repeated), result="dropped")
+        logger.info(f"Dropped {len(repeated)} repeated ranking questions: "
+                    + "; ".join(f"{q['question']} (repeats {q['duplicate_of']})" for q in repeated))
+
+        needed = min(QUESTION_DEDUP_MIN_QUESTIONS, len(questions)) - len(kept)
+        if needed > 0:
+            kept += await self._top_up_questions(messages, response, repeated, kept, needed, index)
+        if not kept:
+            # A repeated question still beats a round without any
+            return response
+        return format_questionnaire(kept)
+
+    async def _top_up_questions(self, messages: List[dict], response: str, repeated: List[dict], kept: List[dict],
+                                count: int, index: QuestionIndex) -> List[dict]:
+        """Ask for count replacement questions as a follow-up turn, rather than regenerating the questionnaire"""
+        follow_up = messages + [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": RANKING_QUESTIONNAIRE_TOP_UP.format(
+                repeated="; ".join(question["question"] for question in repeated), count=count)},
+        ]
+        try:
+            extra = parse_questionnaire(await self._get_completion(follow_up, "top_up_ranking_questionnaire"))
+        except Exception as e:
+            logger.warning(f"Ranking questionnaire top-up failed, keeping {len(kept)} questions: {e}")
+            return []
+        added, _ = index.filter(extra, accepted=kept, limit=count)
+        question_dedup.inc(len(added), result="topped_up")
+        return added
+
+    async def stream_ranking_questionnaire(self, products: list, previous_questions: list = None,
+                                           question_index: QuestionIndex = None) -> AsyncIterator[tuple]:
+        """Stream generate_ranking_questionnaire, emitting each question once its options are parsed.
+
+        Questions repeating asked ones are not emitted; the done event carries the deduplicated
+        questionnaire, and any top-up questions are emitted just before it.
+        """
+        messages = self._ranking_questionnaire_messages(products, previous_questions)
+        index = self._question_index(previous_questions, question_index)
+        emitted = []
+        async for event, data in self._stream_questions(messages, "generate_ranking_questionnaire"):
+            if event == "question" and QUESTION_DEDUP_ENABLED:
+                kept, _ = index.filter([data], accepted=emitted)
+                if not kept:
+                    continue
+                emitted.append(data)
+                data = {**data, "number": len(emitted), "raw": format_question(data, len(emitted))}
+            elif event == "done":
+                questionnaire = await self._deduplicate_questionnaire(messages, data["questionnaire"],
+                                                                      previous_questions, index)
+                shown = {question_id(question["question"]) for question in emitted}
+                for question in parse_questionnaire(questionnaire)[len(emitted):]:
+                    if question_id(question["question"]) not in shown:
+                        yield "question", question
+                data = {**data, "questionnaire": questionnaire}
+            yield event, data
+
+    def _rank_products_messages(self, products: List[str], ranking_preferences: dict) -> List[dict]:
+        """Build the prompt for rank_products"""
+        # Format the products and preferences for the prompt
+        products_text = "\n".join(products)
+        preferences_text = "\n".join([f"{k}: {v}" for k, v in ranking_preferences.items()])
+        
+        return RANK_PRODUCTS_PROMPT.render(products_text=products_text, preferences_text=preferences_text)
+
+    @staticmethod
+    def _validate_ranked_product(product: dict, position: int, first_name: str = None) -> dict:
+        """Validate the structure of a single ranked product, filling in what can be derived locally"""
+        if not product.get('name') or 'price' not in product:
+            raise ValueError(f"Missing name or price in product: {product}")
+        product['id'] = product_id(product['name'])
+        for field in ('advantages', 'product_caveats'):
+            # A lone string is a one-item array the model forgot to wrap
+            if isinstance(product.get(field), str):
+                product[field] = [product[field]]
+        required_fields = ['explanation', 'advantages', 'product_caveats']
+        if not all(field in product for field in required_fields):
+            raise ValueError(f"Missing required fields in product: {product}")
+        if not isinstance(product['advantages'], list):
+            raise ValueError(f"Advantages must be an array for product: {product}")
+        if not isinstance(product['product_caveats'], list):
+            raise ValueError(f"Product caveats must be an array for product: {product}")
+        # Add empty why_not_first for first product
+        if position == 0:
+            product['why_not_first'] = ""
+        elif not product.get('why_not_first'):
+            if first_name is None:
+                raise ValueError(f"Missing why_not_first for non-first product: {product}")
+            product['why_not_first'] = f"Ranked below {first_name} when compared against your preferences"
+        return product
+
+    @staticmethod
+    def _salvage_ranking(response: str) -> Tuple[List[dict], bool]:
+        """Every identifiable product in a ranking response in order, and whether the response was complete"""
+        ranked_products, complete = salvage_ranked_products(response)
+        ranked_products = [product for product in ranked_products if product.get('name')]
+        if not ranked_products:
+            ranking_failures.inc(kind="parse")
+            logging.error(f"Failed to parse ranking response: {response}")
+            raise ValueError("Failed to parse ranking response")
+        if not complete:
+            ranking_failures.inc(kind="truncated")
+            logging.warning(f"Salvaged {len(ranked_products)} products from a truncated ranking response")
+        return ranked_products, complete
+
+    def _parse_ranked_products(self, response: str) -> List[dict]:
+        """Parse and validate the JSON ranking returned by the model, dropping products that cannot be used"""
+        valid = []
+        for product in self._salvage_ranking(response)[0]:
+            try:
+                valid.append(self._validate_ranked_product(product, len(valid), valid[0]['name'] if valid else None))
+            except ValueError as e:
+                ranking_failures.inc(kind="validation")
+                logging.warning(f"Dropping invalid ranked product: {str(e)}")
+        if not valid:
+            raise ValueError("Ranking response has no valid products")
+        return valid
+
+    async def _complete_ranking(self, products: List[str], ranking_preferences: dict, response: str) -> List[dict]:
+        """
+        Turn a ranking response into a full ranking without ranking everything again.
+
+        Products the model left incomplete keep their place, products missing from a truncated
+        response are ordered locally after the rest, and only those get their text from one
+        small follow-up call, falling back to the local ranker's text if that fails too.
+        """
+        ranked_products, complete = self._salvage_ranking(response)
+        incomplete = []
+        for position, product in enumerate(ranked_products):
+            try:
+                self._validate_ranked_product(product, position, ranked_products[0]['name'])
+            except ValueError:
+                incomplete.append(product)
+
+        missing = []
+        if not complete:
+            ranked_ids = {product_id(product['name']) for product in ranked_products}
+            missing = [product for product in parse_products(products) if product.id not in ranked_ids]
+        if not incomplete and not missing:
+            return ranked_products
+
+        appended = self.rank_products_locally(missing, ranking_preferences) if missing else []
+        for product in appended:
+            product.pop('score', None)
+            product.pop('source_line', None)
+        for product in incomplete:
+            product['id'] = product_id(product['name'])
+            product['explanation'] = product.get('explanation') or "Ranked by overall fit with your answers"
+            product.setdefault('why_not_first', "")
+            for field in ('advantages', 'product_caveats'):
+                if not isinstance(product.get(field), list):
+                    product[field] = []
+        ranked_products += appended
+
+        repair = incomplete + appended
+        try:
+            explanations = await self._explanations(repair, ranking_preferences)
+            matched = 0
+            for product in repair:
+                explanation = explanations.get(product['id'])
+                if explanation is not None:
+                    matched += 1
+                    for field in ('explanation', 'advantages', 'why_not_first', 'product_caveats'):
+                        product[field] = explanation[field]
+            ranking_repairs.inc(matched, result="llm")
+            # Products the follow-up answer skipped keep the local text
+            ranking_repairs.inc(len(repair) - matched, result="local")
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            ranking_repairs.inc(len(repair), result="local")
+            logging.warning(f"Could not complete {len(repair)} ranked products, keeping local text: {str(e)}")
+        logging.info(f"Completed ranking: {len(incomplete)} incomplete and {len(missing)} missing products repaired")
+
+        for position, product in enumerate(ranked_products):
+            if position == 0:
+                product['why_not_first'] = ""
+            elif not product.get('why_not_first'):
+                product['why_not_first'] = f"Ranked below {ranked_products[0]['name']} when compared against your preferences"
+        return ranked_products
+
     async def rank_products(self, products: List[str], ranking_preferences: dict) -> List[dict]:
         """Rank the products based on user preferences."""
         try:
             logging.info("Ranking products based on preferences")
             
-            # Format the products and preferences for the prompt
-            products_text = "\n".join(products)
-            preferences_text = "\n".join([f"{k}: {v}" for k, v in ranking_preferences.items()])
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a product ranking expert. Analyze the given products and user preferences, "
-                        "then return a JSON array of ranked products. Each product should include: name, price, "
-                        "explanation (why it's ranked here), advantages (array of key benefits), "
-                        "why_not_first (for products not ranked first, explain why they didn't get the top spot), "
-                        "and product_caveats (array of potential drawbacks or things to consider). "
-                        "Format the response as valid JSON. Do not include any markdown formatting or additional text."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Products to rank:\n{products_text}\n\n"
-                        f"User Preferences:\n{preferences_text}\n\n"
-                        "Please rank these products and provide a JSON response in this exact format:\n"
-                        '{"ranked_products": [\n'
-                        '  {\n'
-                        '    "name": "Product Name",\n'
-                        '    "price": "$1234",\n'
-                        '    "explanation": "Why this product is ranked here",\n'
-                        '    "advantages": ["benefit 1", "benefit 2"],\n'
-                        '    "why_not_first": "Only for non-first ranked products, explain why not #1",\n'
-                        '    "product_caveats": ["caveat 1", "caveat 2"]\n'
-                        '  }\n'
-                        ']}'
-                    )
-                }
-            ]
-            
-            response = await self._get_completion(messages)
-            
-            response_text = response.replace('```json', '').replace('```', '').strip()
-            
-            # Clean and parse the response
-            try:
-                # Remove any markdown formatting
-                clean_response = response_text.replace('```json', '').replace('```', '').strip()
-                
-                # Parse the JSON response
-                result = json.loads(clean_response)
-                
-                if not isinstance(result, dict) or 'ranked_products' not in result:
-                    raise ValueError("Invalid response format")
-                    
-                ranked_products = result['ranked_products']
-                
-                # Validate the structure of each product
-                for product in ranked_products:
-                    required_fields = ['name', 'price', 'explanation', 'advantages', 'product_caveats']
-                    if not all(field in product for field in required_fields):
-                        raise ValueError(f"Missing required fields in product: {product}")
-                    if not isinstance(product['advantages'], list):
-                        raise ValueError(f"Advantages must be an array for product: {product}")
-                    if not isinstance(product['product_caveats'], list):
-                        raise ValueError(f"Product caveats must be an array for product: {product}")
-                    # Add empty why_not_first for first product
-                    if ranked_products.index(product) == 0:
-                        product['why_not_first'] = ""
-                    elif 'why_not_first' not in product:
-                        raise ValueError(f"Missing why_not_first for non-first product: {product}")
-                
-                return ranked_products
-                
-            except json.JSONDecodeError as e:
-                logging.error(f"Failed to parse JSON response: {str(e)}")
-                logging.error(f"Response was: {response_text}")
-                raise ValueError("Failed to parse ranking response")
+            messages = self._rank_products_messages(products, ranking_preferences)
+            response = await self._get_completion(messages, "rank_products")
+            return await self._complete_ranking(products, ranking_preferences, response)
                 
         except Exception as e:
             logging.error(f"Error in rank_products: {str(e)}")
             raise
 
+    def _merge_messages(self, left: List[dict], right: List[dict], ranking_preferences: dict) -> List[dict]:
+        """Build the prompt that merges two ranked runs into one ordering of ids"""
+        preferences_text = "\n".join([f"{k}: {v}" for k, v in ranking_preferences.items()])
+        return MERGE_PROMPT.render(
+            preferences_text=preferences_text, left=run_listing('A', left), right=run_listing('B', right)
+        )
+
+    async def rank_products_tournament(self, products: List[str], ranking_preferences: dict,
+                                       chunk_size: int = TOURNAMENT_CHUNK_SIZE,
+                                       concurrency: int = TOURNAMENT_CONCURRENCY) -> List[dict]:
+        """Rank a large product list by ranking chunks concurrently and merging them in parallel rounds"""
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        fallback_scores = {product['id']: product['score']
+                           for product in self.rank_products_locally(products, ranking_preferences)}
+
+        async def rank_chunk(chunk_products: List[str]) -> List[dict]:
+            async with semaphore:
+                try:
+                    ranked = await self.rank_products(chunk_products, ranking_preferences)
+                    tournament_chunks.inc(result="llm")
+                    return ranked
+                except Exception as e:
+                    # One failed chunk should not fail the whole list; its local order still goes into the merges
+                    logging.warning(f"Chunk of {len(chunk_products)} products failed, ranking it locally: {str(e)}")
+                    tournament_chunks.inc(result="local")
+            ranked = self.rank_products_locally(chunk_products, ranking_preferences)
+            for product in ranked:
+                product.pop('score', None)
+                product.pop('source_line', None)
+            return ranked
+
+        async def merge(left: List[dict], right: List[dict]) -> List[dict]:
+            # The answer lists every id of both runs, so late rounds need room for the whole list
+            profile = get_profile("merge_rankings")
+            profile = profile.replace(max_tokens=max(profile.max_tokens, merge_max_tokens(len(left) + len(right))))
+            async with semaphore:
+                try:
+                    response = await self._get_completion(
+                        self._merge_messages(left, right, ranking_preferences), profile
+                    )
+                    order = parse_merge_order(response)
+                except Exception as e:
+                    logging.warning(f"Merge step failed, falling back to local scores: {str(e)}")
+                    order = []
+            identifiers = {f"A{i}" for i in range(1, len(left) + 1)} | {f"B{i}" for i in range(1, len(right) + 1)}
+            placed = len(identifiers.intersection(order))
+            if placed < len(identifiers):
+                logging.warning(f"Merge of {len(left)} + {len(right)} products placed {placed}; "
+                                f"ordering the rest by local scores")
+            tournament_merges.inc(result="llm" if placed == len(identifiers) else "partial" if placed else "fallback")
+            return merge_runs(left, right, order, fallback_scores)
+
+        chunks = chunk(products, max(chunk_size, 2))
+        logging.info(f"Tournament ranking {len(products)} products in {len(chunks)} chunks")
+        # The endpoint's fixed budget would cut off a large tournament that is still making progress
+        budget = max(tournament_deadline(len(chunks), concurrency), remaining_budget() or 0)
+        with deadline_scope(current_endpoint.get(), budget):
+            runs = await asyncio.gather(*[rank_chunk(chunk_products) for chunk_products in chunks])
+
+            while len(runs) > 1:
+                merges = [merge(runs[i], runs[i + 1]) for i in range(0, len(runs) - 1, 2)]
+                carry = [runs[-1]] if len(runs) % 2 else []
+                runs = list(await asyncio.gather(*merges)) + carry
+
+        ranked_products = [dict(product) for product in runs[0]] if runs else []
+        for position, product in enumerate(ranked_products):
+            if position == 0:
+                product['why_not_first'] = ""
+            elif not product.get('why_not_first'):
+                product['why_not_first'] = f"Ranked below {ranked_products[0]['name']} when compared against your preferences"
+        return ranked_products
+
+    def _rerank_messages(self, previous_ranking: List[dict], changes: dict, ranking_preferences: dict) -> List[dict]:
+        """Build the compact delta prompt used when only some answers changed"""
+        ranking_text = "\n".join(
+            f"P{position}. {product['name']} - {product['price']}" for position, product in enumerate(previous_ranking, 1)
+        )
+        preferences_text = "\n".join([f"{k}: {v}" for k, v in ranking_preferences.items()])
+        changes_text = "\n".join(
+            f"- {question}: was '{old if old is not None else 'not answered'}', now '{new if new is not None else 'not answered'}'"
+            for question, (old, new) in changes.items()
+        )
+        return RERANK_PROMPT.render(
+            ranking_text=ranking_text, preferences_text=preferences_text, changes_text=changes_text
+        )
+
+    async def rank_products_incremental(self, products: List[str], ranking_preferences: dict,
+                                        session_id: str = None, full_rank=None) -> List[dict]:
+        """Re-rank from the previous ranking of the same products when only some answers changed"""
+        full_rank = full_rank or (lambda: self.rank_products(products, ranking_preferences))
+        if not session_id:
+            # The memory is scoped by session; without one it would mix different users' rankings
+            ranking_memory.no_session += 1
+            return await full_rank()
+        key = ranking_memory.key(session_id, products)
+        previous = ranking_memory.get(key)
+        ranked_products = None
+
+        if previous is not None:
+            previous_preferences, previous_ranking = previous
+            changes = preference_diff(previous_preferences, ranking_preferences)
+            if not changes:
+                ranking_memory.unchanged += 1
+                return [dict(product) for product in previous_ranking]
+            if len(changes) <= max(1, int(len(ranking_preferences) * RERANK_MAX_CHANGED_RATIO)):
+                try:
+                    response = await self._get_completion(
+                        self._rerank_messages(previous_ranking, changes, ranking_preferences), "rerank_products"
+                    )
+                    order, updates = parse_delta(response)
+                    if order:
+                        ranked_products = apply_delta(previous_ranking, order, updates)
+                        ranking_memory.incremental += 1
+                        logging.info(f"Incrementally re-ranked {len(products)} products for {len(changes)} changed answers")
+                except Exception as e:
+                    logging.warning(f"Incremental re-rank failed, ranking from scratch: {str(e)}")
+
+        if ranked_products is None:
+            ranked_products = await full_rank()
+            ranking_memory.full += 1
+
+        ranking_memory.remember(key, ranking_preferences, ranked_products)
+        return ranked_products
+
+    def rank_products_locally(self, products: List[Union[str, Product]], ranking_preferences: dict) -> List[dict]:
+        """Instant deterministic ranking from the product lines and answers, without an LLM call"""
+        return LocalRanker(products).rank(ranking_preferences)
+
+    async def _explanations(self, ranked_products: List[dict], ranking_preferences: dict) -> Dict[str, dict]:
+        """LLM-written text for an already fixed ordering of products, keyed by product id"""
+        products_text = "\n".join(
+            f"{rank}. {product['name']} - {product['price']}" for rank, product in enumerate(ranked_products, 1)
+        )
+        messages = self._rank_products_messages([products_text], ranking_preferences)
+        messages[1]["content"] = (
+            "The products below are ALREADY RANKED best-first. Do not reorder, add or remove products; "
+            "only write the fields for each one in the same order.\n\n" + messages[1]["content"]
+        )
+        explained = self._parse_ranked_products(await self._get_completion(messages, "rank_products"))
+        # The model may still skip or reorder products, so text is matched by id rather than position
+        return {product['id']: product for product in explained}
+
+    async def explain_ranking(self, ranked_products: List[dict], ranking_preferences: dict,
+                              top_k: int = EXPLAIN_TOP_K) -> List[dict]:
+        """Ask the LLM to write explanations for the top products; products it skipped keep their text"""
+        explanations = await self._explanations(ranked_products[:top_k], ranking_preferences)
+        merged = [dict(product) for product in ranked_products]
+        for position, product in enumerate(merged):
+            explanation = explanations.get(product.get('id') or product_id(product['name']))
+            if explanation is None:
+                continue
+            for field in ('explanation', 'advantages', 'product_caveats'):
+                product[field] = explanation[field]
+            if position and explanation.get('why_not_first'):
+                product['why_not_first'] = explanation['why_not_first']
+        return merged
+
+    async def stream_fast_rank_products(self, products: List[str], ranking_preferences: dict) -> AsyncIterator[tuple]:
+        """Emit the local ordering immediately, then the same ordering with LLM explanations"""
+        ranked_products = self.rank_products_locally(products, ranking_preferences)
+        yield "ranking", {"ranked_products": ranked_products}
+        yield "done", {"ranked_products": await self.explain_ranking(ranked_products, ranking_preferences)}
+
+    async def stream_rank_products(self, products: List[str], ranking_preferences: dict) -> AsyncIterator[tuple]:
+        """Stream rank_products, emitting each ranked product as soon as its JSON object closes"""
+        logging.info("Streaming product ranking based on preferences")
+        parser = RankedProductStreamParser()
+        chunks = []
+        first_name = None
+        messages = self._rank_products_messages(products, ranking_preferences)
+        async for delta in self._stream_completion(messages, "rank_products"):
+            chunks.append(delta)
+            yield "token", delta
+            for product in parser.feed(delta):
+                position = parser.emitted - 1
+                try:
+                    yield "product", {"rank": position + 1, **self._validate_ranked_product(product, position, first_name)}
+                except ValueError as e:
+                    ranking_failures.inc(kind="validation")
+                    logging.warning(f"Skipping invalid streamed product: {str(e)}")
+                first_name = first_name or product.get('name')
+        # Products skipped above or cut off at the end are completed here rather than failing the stream
+        yield "done", {"ranked_products": await self._complete_ranking(products, ranking_preferences, "".join(chunks))}
+
 def get_affiliate_link(product_name):
     """Get affiliate link for a product if available."""
     # This is a placeholder function. You should implement your own affiliate link logic here.
@@ -516,62 +1048,57 @@ def get_affiliate_link(product_name):
     # Return None if no affiliate link is available
     return None
 
-def rank_products(products, user_preferences):
-    try:
-        # ... existing code ...
-
-        # Parse the response and add affiliate links
-        ranked_products = []
-        for product in parsed_response:
-            product_data = {
-                "name": product["name"],
-                "price": product["price"],
-                "explanation": product["explanation"],
-                "advantages": product["advantages"],
-                "situationalBenefits": product.get("situationalBenefits")
-            }
-            
-            # Try to get an affiliate link for the product
-            affiliate_link = get_affiliate_link(product["name"])
-            if affiliate_link:
-                product_data["affiliateLink"] = affiliate_link
-            
-            ranked_products.append(product_data)
-
-        return jsonify({"success": True, "ranked_products": ranked_products})
+def event_stream(events: AsyncIterator[tuple]) -> StreamingResponse:
+    """Forward (event, data) pairs from an engine stream to the client as Server-Sent Events"""
+    async def generate():
+        try:
+            async for event, data in events:
+                yield sse_event(event, data)
+        except UpstreamUnavailable as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Error while streaming: {e}")
+            yield sse_event("error", {"error": str(e)})
 
-    except Exception as e:
-        print(f"Error in rank_products: {str(e)}")
-        traceback.print_exc()
-        return jsonify({"success": False, "error": str(e)}), 500
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
 
-@flask_app.route('/generate-factors', methods=['POST', 'OPTIONS'])
-async def generate_factors_route():
+@fastapi_app.post('/generate-factors')
+async def generate_factors_route(request: Request):
     """API endpoint to generate factors for a given search query"""
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
-
-    data = request.json
+    data = await read_json(request)
     search_query = data.get('search_query')
     
     if not search_query:
-        return jsonify({"error": "Search query is required"}), 400
+        return JSONResponse({"error": "Search query is required"}, status_code=400)
     
     try:
-        engine = ExpertosyRecommendationEngine(search_query)
+        use_cache = not data.get('bypass_cache', False)
+        engine = ExpertosyRecommendationEngine(search_query, use_cache=use_cache)
         factors = await engine.generate_factors()
-        return jsonify({"factors": factors})
+
+        # The client asks for the questionnaire next; start it now so the follow-up can claim it
+        questionnaire_engine = ExpertosyRecommendationEngine(search_query, use_cache=use_cache)
+        # The task inherits this priority, so speculation is the first work shed under load
+        with priority_scope(PRIORITY_BACKGROUND), \
+                deadline_scope("speculative-questionnaire", ENDPOINT_DEADLINES["/create-questionnaire"]):
+            token = speculations.start(
+                (search_query, ExpertosyRecommendationEngine._factors_cache_key(factors)),
+                lambda: questionnaire_engine.create_questionnaire(factors)
+            )
+        response = {"factors": factors}
+        if token:
+            response["questionnaire_token"] = token
+        return response
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error generating factors: {e}")
-        return jsonify({"error": str(e)}), 500
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-@flask_app.route('/create-questionnaire', methods=['POST', 'OPTIONS'])
-async def create_questionnaire_route():
+@fastapi_app.post('/create-questionnaire')
+async def create_questionnaire_route(request: Request):
     """API endpoint to create a questionnaire based on factors"""
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
-
-    data = request.json
+    data = await read_json(request)
     logger.info(f"Received create_questionnaire request: {data}")
 
     search_query = data.get('search_query')
@@ -579,86 +1106,351 @@ async def create_questionnaire_route():
     
     if not search_query or not factors:
         logger.error("Missing search query or factors")
-        return jsonify({"error": "Search query and factors are required"}), 400
+        return JSONResponse({"error": "Search query and factors are required"}, status_code=400)
     
     try:
-        engine = ExpertosyRecommendationEngine(search_query)
-        questionnaire = await engine.create_questionnaire(factors)
+        speculation = None
+        if data.get('questionnaire_token'):
+            speculation = speculations.claim(
+                data['questionnaire_token'],
+                (search_query, ExpertosyRecommendationEngine._factors_cache_key(factors))
+            )
+        questionnaire = None
+        if speculation is not None:
+            try:
+                questionnaire = await speculation
+            except UpstreamUnavailable:
+                # Shed or timed out while running as background work; the user is waiting now, so retry on demand
+                logger.info("Speculative questionnaire was shed, generating on demand")
+        if questionnaire is None:
+            engine = ExpertosyRecommendationEngine(search_query, use_cache=not data.get('bypass_cache', False))
+            questionnaire = await engine.create_questionnaire(factors)
         logger.info(f"Generated questionnaire: {questionnaire}")
-        return jsonify({"questionnaire": questionnaire})
+        return {"questionnaire": questionnaire,
+                "questions": [question.to_dict() for question in parse_questions(questionnaire)]}
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error creating questionnaire: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
-        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+        return JSONResponse({"error": str(e), "traceback": traceback.format_exc()}, status_code=500)
 
-@flask_app.route('/generate-recommendation', methods=['POST', 'OPTIONS'])
-async def generate_recommendation_route():
-    """API endpoint to generate a recommendation based on user preferences"""
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
+@fastapi_app.post('/create-questionnaire/stream')
+async def stream_questionnaire_route(request: Request):
+    """Streaming variant of /create-questionnaire that emits each question as soon as it is parsed"""
+    data = await read_json(request)
+    search_query = data.get('search_query')
+    factors = data.get('factors')
+    
+    if not search_query or not factors:
+        return JSONResponse({"error": "Search query and factors are required"}, status_code=400)
+    
+    engine = ExpertosyRecommendationEngine(search_query, use_cache=not data.get('bypass_cache', False))
+    if data.get('questionnaire_token'):
+        speculation = speculations.claim(
+            data['questionnaire_token'],
+            (search_query, ExpertosyRecommendationEngine._factors_cache_key(factors))
+        )
+        if speculation is not None:
+            async def replay_speculation():
+                try:
+                    questionnaire = await speculation
+                except UpstreamUnavailable:
+                    # As in /create-questionnaire: the user is waiting now, so generate on demand
+                    logger.info("Speculative questionnaire was shed, generating on demand")
+                    questionnaire = None
+                events = (engine.stream_questionnaire(factors) if questionnaire is None
+                          else ExpertosyRecommendationEngine.replay_questionnaire(questionnaire))
+                async for event in events:
+                    yield event
+            return event_stream(replay_speculation())
+    
+    return event_stream(engine.stream_questionnaire(factors))
+
+@fastapi_app.post('/bootstrap')
+async def bootstrap_route(request: Request):
+    """API endpoint returning both the factors and the questionnaire from a single LLM call"""
+    data = await read_json(request)
+    search_query = data.get('search_query')
+    
+    if not search_query:
+        return JSONResponse({"error": "Search query is required"}, status_code=400)
+    
+    try:
+        engine = ExpertosyRecommendationEngine(search_query, use_cache=not data.get('bypass_cache', False))
+        result = await engine.bootstrap()
+        return {**result, "questions": [question.to_dict() for question in parse_questions(result["questionnaire"])]}
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Error bootstrapping questionnaire: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-    data = request.json
+@fastapi_app.post('/generate-recommendation')
+async def generate_recommendation_route(request: Request):
+    """API endpoint to generate a recommendation based on user preferences"""
+    data = await read_json(request)
     search_query = data.get('search_query')
     user_preferences = data.get('user_preferences')
     
     if not search_query or not user_preferences:
-        return jsonify({"error": "Search query and user preferences are required"}), 400
+        return JSONResponse({"error": "Search query and user preferences are required"}, status_code=400)
     
     try:
-        engine = ExpertosyRecommendationEngine(search_query)
-        recommendation = await engine.generate_recommendation(user_preferences)
-        return jsonify({"recommendation": recommendation})
+        return await recommendation_result(search_query, user_preferences)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error generating recommendation: {e}")
-        return jsonify({"error": str(e)}), 500
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-@flask_app.route('/generate-ranking-questionnaire', methods=['POST', 'OPTIONS'])
-async def generate_ranking_questionnaire_route():
-    """API endpoint to generate a questionnaire for ranking products"""
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
+async def recommendation_result(search_query: str, user_preferences: dict) -> dict:
+    """Response body of /generate-recommendation, shared with its job variant"""
+    engine = ExpertosyRecommendationEngine(search_query)
+    recommendation = await engine.generate_recommendation(user_preferences)
+    products = engine.recommended_products(recommendation)
+    return {"recommendation": recommendation, "products": [product.to_dict() for product in products]}
+
+def job_accepted(job: Job) -> JSONResponse:
+    return JSONResponse({**job.to_dict(), "poll": f"/jobs/{job.id}"}, status_code=202,
+                        headers={"Location": f"/jobs/{job.id}"})
+
+@fastapi_app.post('/generate-recommendation/jobs')
+async def submit_recommendation_job_route(request: Request):
+    """Queue /generate-recommendation as a job and return its id at once; poll /jobs/{job_id} for the result"""
+    data = await read_json(request)
+    search_query = data.get('search_query')
+    user_preferences = data.get('user_preferences')
+
+    if not search_query or not user_preferences:
+        return JSONResponse({"error": "Search query and user preferences are required"}, status_code=400)
+
+    return job_accepted(jobs.submit("generate-recommendation", "/generate-recommendation",
+                                    lambda: recommendation_result(search_query, user_preferences)))
+
+@fastapi_app.get('/jobs/{job_id}')
+async def get_job_route(job_id: str, wait: float = 0):
+    """A job's status and, once it succeeded, its result; wait long-polls up to that many seconds for it to finish"""
+    return (await jobs.wait(job_id, wait)).to_dict()
+
+@fastapi_app.delete('/jobs/{job_id}')
+async def cancel_job_route(job_id: str):
+    """Cancel a queued or running job, or drop a finished one"""
+    return (await jobs.cancel(job_id)).to_dict()
+
+@fastapi_app.post('/ranking-sessions')
+async def create_ranking_session_route(request: Request):
+    """Start a ranking session holding the products, so later rounds only send the session id and new answers"""
+    data = await read_json(request)
+    products = request_products(data)
+
+    if not products:
+        return JSONResponse({"error": "Products list is required"}, status_code=400)
 
-    data = request.json
+    session = await session_store.create(data.get('search_query', ''), products)
+    return {"session_id": session.id, "expires_in": session_store.ttl}
+
+@fastapi_app.get('/ranking-sessions/{session_id}')
+async def get_ranking_session_route(session_id: str):
+    """Questions asked and answers given so far in a ranking session"""
+    return (await session_store.get(session_id)).summary()
+
+@fastapi_app.delete('/ranking-sessions/{session_id}')
+async def delete_ranking_session_route(session_id: str):
+    await session_store.delete(session_id)
+    question_indexes.discard(session_id)
+    return {"deleted": session_id}
+
+async def update_session(session_id: str, update=None):
+    """Load the latest copy of a session, apply update to it and save it, one update at a time"""
+    async with session_store.lock(session_id):
+        session = await session_store.get(session_id)
+        result = update(session) if update else None
+        if update:
+            await session_store.save(session)
+    return session, result
+
+def request_products(data: dict) -> list:
+    """The request's products as lines for the prompts, given as product lines or as {"name", "price"} records"""
     products = data.get('products')
-    previous_questions = data.get('previous_questions', [])
+    return product_lines(products) if isinstance(products, list) and products else products
+
+async def ranking_questionnaire_inputs(data: dict) -> tuple:
+    """Products, previously asked questions, search query and asked-question index of a request.
+
+    Taken from its session when it names one; the index then covers every question the session asked, not just
+    the ones that fit in the prompt. Without a session the engine indexes previous_questions itself.
+    """
+    session_id = data.get('session_id')
+    if not session_id:
+        return request_products(data), data.get('previous_questions', []), data.get('search_query', ''), None
+    answers = data.get('answers')
+    session, _ = await update_session(session_id, (lambda s: s.record_answers(answers)) if answers else None)
+    index = question_indexes.get(normalize_query(session.search_query), session.id, session.questions.values())
+    return session.products, session.recent_questions(), session.search_query, index
+
+async def ranking_inputs(data: dict) -> tuple:
+    """Products and ranking preferences of a request, from its session when it names one and sends no products"""
+    session_id = data.get('session_id')
+    if data.get('products') or not session_id:
+        return request_products(data), data.get('ranking_preferences')
+    answers = data.get('answers') or data.get('ranking_preferences')
+    session, _ = await update_session(session_id, (lambda s: s.record_answers(answers)) if answers else None)
+    return session.products, session.preferences()
+
+async def record_session_questions(session_id: str, questionnaire: str) -> list:
+    """Add a generated questionnaire's questions to the session and return their ids"""
+    questions = [question["question"] for question in parse_questionnaire(questionnaire)]
+    _, ids = await update_session(session_id, lambda s: s.add_questions(questions))
+    return ids
+
+@fastapi_app.post('/generate-ranking-questionnaire')
+async def generate_ranking_questionnaire_route(request: Request):
+    """API endpoint to generate a questionnaire for ranking products"""
+    data = await read_json(request)
+    session_id = data.get('session_id')
+    products, previous_questions, search_query, question_index = await ranking_questionnaire_inputs(data)
     
     if not products:
-        return jsonify({"error": "Products list is required"}), 400
+        return JSONResponse({"error": "Products list is required"}, status_code=400)
     
     try:
-        engine = ExpertosyRecommendationEngine(data.get('search_query', ''))
-        questionnaire = await engine.generate_ranking_questionnaire(products, previous_questions)
-        return jsonify({"questionnaire": questionnaire})
+        engine = ExpertosyRecommendationEngine(search_query)
+        questionnaire = await engine.generate_ranking_questionnaire(products, previous_questions, question_index)
+        questions = [question.to_dict() for question in parse_questions(questionnaire)]
+        if session_id:
+            question_ids = await record_session_questions(session_id, questionnaire)
+            return {"questionnaire": questionnaire, "questions": questions, "session_id": session_id,
+                    "question_ids": question_ids}
+        return {"questionnaire": questionnaire, "questions": questions}
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error generating ranking questionnaire: {e}")
-        return jsonify({"error": str(e)}), 500
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-@flask_app.route('/rank-products', methods=['POST'])
-async def rank_products():
-    try:
-        data = request.get_json()
-        if not data or 'products' not in data or 'ranking_preferences' not in data:
-            return jsonify({"error": "Missing required fields"}), 400
+async def with_session_questions(session_id: str, events: AsyncIterator[tuple]) -> AsyncIterator[tuple]:
+    """Tag streamed questions with their ids and record the finished questionnaire in the session"""
+    async for event, data in events:
+        if event == "question":
+            data = {**data, "id": question_id(data["question"])}
+        elif event == "done":
+            data = {**data, "session_id": session_id,
+                    "question_ids": await record_session_questions(session_id, data["questionnaire"])}
+        yield event, data
 
-        products = data['products']
-        ranking_preferences = data['ranking_preferences']
+@fastapi_app.post('/generate-ranking-questionnaire/stream')
+async def stream_ranking_questionnaire_route(request: Request):
+    """Streaming variant of /generate-ranking-questionnaire that emits each question as soon as it is parsed"""
+    data = await read_json(request)
+    session_id = data.get('session_id')
+    products, previous_questions, search_query, question_index = await ranking_questionnaire_inputs(data)
+    
+    if not products:
+        return JSONResponse({"error": "Products list is required"}, status_code=400)
+    
+    engine = ExpertosyRecommendationEngine(search_query)
+    events = engine.stream_ranking_questionnaire(products, previous_questions, question_index)
+    return event_stream(with_session_questions(session_id, events) if session_id else events)
 
-        if not products or not ranking_preferences:
-            return jsonify({"error": "Products and ranking preferences cannot be empty"}), 400
+def ranking_inputs_error(products: list, ranking_preferences: dict):
+    """The 400 response for missing or empty ranking inputs, or None when they are usable"""
+    if products is None or ranking_preferences is None:
+        return JSONResponse({"error": "Missing required fields"}, status_code=400)
+    if not products or not ranking_preferences:
+        return JSONResponse({"error": "Products and ranking preferences cannot be empty"}, status_code=400)
+    return None
 
-        engine = ExpertosyRecommendationEngine()
-        ranked_products = await engine.rank_products(products, ranking_preferences)
-        
-        if not ranked_products:
-            return jsonify({"error": "Failed to rank products"}), 500
-            
-        return jsonify({"ranked_products": ranked_products})
+async def rank_products_result(data: dict, products: List[str], ranking_preferences: dict) -> dict:
+    """Response body of /rank-products, shared with its job variant"""
+    engine = ExpertosyRecommendationEngine()
+    mode = data.get('mode') or ('tournament' if len(products) > TOURNAMENT_THRESHOLD else 'single')
+    if mode == 'tournament':
+        full_rank = lambda: engine.rank_products_tournament(
+            products,
+            ranking_preferences,
+            chunk_size=int(data.get('chunk_size', TOURNAMENT_CHUNK_SIZE)),
+            concurrency=int(data.get('concurrency', TOURNAMENT_CONCURRENCY))
+        )
+    else:
+        full_rank = lambda: engine.rank_products(products, ranking_preferences)
+    
+    if data.get('incremental', True):
+        ranked_products = await engine.rank_products_incremental(
+            products, ranking_preferences, data.get('session_id'), full_rank
+        )
+    else:
+        ranked_products = await full_rank()
+    
+    if not ranked_products:
+        raise ValueError("Failed to rank products")
+    return {"ranked_products": ranked_products}
+
+@fastapi_app.post('/rank-products')
+async def rank_products_route(request: Request):
+    """API endpoint to rank products based on the user's ranking preferences"""
+    try:
+        data = await read_json(request)
+        products, ranking_preferences = await ranking_inputs(data)
+        error = ranking_inputs_error(products, ranking_preferences)
+        if error is not None:
+            return error
+        return await rank_products_result(data, products, ranking_preferences)
         
+    except (UpstreamUnavailable, SessionNotFound, InvalidAnswers):
+        raise
     except Exception as e:
         logging.error(f"Error in rank_products endpoint: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@fastapi_app.post('/rank-products/jobs')
+async def submit_rank_products_job_route(request: Request):
+    """Queue /rank-products as a job and return its id at once; poll /jobs/{job_id} for the ranking"""
+    data = await read_json(request)
+    products, ranking_preferences = await ranking_inputs(data)
+    error = ranking_inputs_error(products, ranking_preferences)
+    if error is not None:
+        return error
+    return job_accepted(jobs.submit("rank-products", "/rank-products",
+                                    lambda: rank_products_result(data, products, ranking_preferences)))
+
+@fastapi_app.post('/rank-products/stream')
+async def stream_rank_products_route(request: Request):
+    """Streaming variant of /rank-products that emits each ranked product as soon as it is parsed"""
+    data = await read_json(request)
+    products, ranking_preferences = await ranking_inputs(data)
+
+    if not products or not ranking_preferences:
+        return JSONResponse({"error": "Products and ranking preferences cannot be empty"}, status_code=400)
+
+    engine = ExpertosyRecommendationEngine()
+    return event_stream(engine.stream_rank_products(products, ranking_preferences))
+
+@fastapi_app.post('/rank-products/local')
+async def local_rank_products_route(request: Request):
+    """Instant deterministic ranking without an LLM call; scales to thousands of products"""
+    data = await read_json(request)
+    products, ranking_preferences = await ranking_inputs(data)
+
+    if not products or not ranking_preferences:
+        return JSONResponse({"error": "Products and ranking preferences cannot be empty"}, status_code=400)
+
+    engine = ExpertosyRecommendationEngine()
+    return {"ranked_products": engine.rank_products_locally(products, ranking_preferences)}
+
+@fastapi_app.post('/rank-products/fast')
+async def fast_rank_products_route(request: Request):
+    """Stream the local ordering at once, then the explanations written by the LLM"""
+    data = await read_json(request)
+    products, ranking_preferences = await ranking_inputs(data)
+
+    if not products or not ranking_preferences:
+        return JSONResponse({"error": "Products and ranking preferences cannot be empty"}, status_code=400)
+
+    engine = ExpertosyRecommendationEngine()
+    return event_stream(engine.stream_fast_rank_products(products, ranking_preferences))
 
-@flask_app.route('/test-ranking', methods=['GET'])
+@fastapi_app.get('/test-ranking')
 async def test_ranking_route():
     """Test endpoint to verify ranking functionality with multiple scenarios"""
     try:
@@ -733,24 +1525,27 @@ async def test_ranking_route():
         success_count = sum(1 for r in results if r["status"] == "success")
         success_rate = (success_count / len(test_cases)) * 100
 
-        return jsonify({
+        return {
             "total_tests": len(test_cases),
             "successful_tests": success_count,
             "success_rate": f"{success_rate:.2f}%",
             "detailed_results": results
-        })
+        }
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in test suite: {str(e)}")
-        return jsonify({
+        return JSONResponse({
             "error": "Test suite failed",
             "message": str(e)
-        }), 500
+        }, status_code=500)
 
 def create_app():
-    """Application factory for Flask"""
-    return flask_app
+    """Application factory for the ASGI app"""
+    return asgi_app
 
 if __name__ == '__main__':
+    import uvicorn
     port = int(os.getenv('PORT', 8080))
-    flask_app.run(host='0.0.0.0', port=port) 
\ No newline at end of file
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port)
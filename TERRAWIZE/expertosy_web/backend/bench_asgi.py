@@ -0,0 +1,186 @@
+"""
+Compare per-request overhead and memory of the native ASGI routes against the
+previous buffered Flask-in-FastAPI bridge. The LLM is stubbed out so only our
+own request handling is measured.
+
+Usage: python bench_asgi.py [requests_per_route]
+
+The Flask baseline needs the extra packages in requirements-bench.txt.
+"""
+import sys
+import json
+import logging
+import time
+import asyncio
+import statistics
+import tracemalloc
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from fastapi import FastAPI, Request
+from flask import Flask, request, jsonify
+from starlette.responses import JSONResponse, Response
+
+import app as backend
+from app import ExpertosyRecommendationEngine
+
+STUB_RANKING = json.dumps({"ranked_products": [
+    {
+        "name": f"Laptop {i}",
+        "price": f"${999 + i * 100}",
+        "explanation": "Good balance of price and performance " * 4,
+        "advantages": ["Battery life", "Build quality", "Display"],
+        "why_not_first": "" if i == 0 else "Slightly more expensive for similar specs",
+        "product_caveats": ["Limited ports", "Average speakers"]
+    }
+    for i in range(10)
+]})
+
+STUB_QUESTIONNAIRE = "\n\n".join(
+    f"{i}. What matters most for factor {i}?\nA) Option one\nB) Option two\nC) Option three\nD) Option four"
+    for i in range(1, 11)
+)
+
+PRODUCTS = [f"{i}. Laptop {i} - ${999 + i * 100}" for i in range(1, 11)]
+
+ROUTES = [
+    ("/generate-factors", {"search_query": "laptop"}),
+    ("/create-questionnaire", {"search_query": "laptop", "factors": ["Budget", "Portability"]}),
+    ("/generate-recommendation", {"search_query": "laptop", "user_preferences": {"Budget": "B) $800-$1200"}}),
+    ("/generate-ranking-questionnaire", {"products": PRODUCTS, "previous_questions": []}),
+    ("/rank-products", {"products": PRODUCTS, "ranking_preferences": {"Budget": "A) Under $1000"}}),
+]
+
+
+async def stub_completion(self, messages, profile="default"):
+    """Return a canned completion shaped like the real one for each engine method"""
+    # The prompts share a cacheable prefix, so the generation profile says which method is asking
+    if profile == "rank_products":
+        return STUB_RANKING
+    if profile in ("create_questionnaire", "generate_ranking_questionnaire", "top_up_ranking_questionnaire"):
+        return STUB_QUESTIONNAIRE
+    if profile == "generate_recommendation":
+        return "\n".join(PRODUCTS)
+    return "*".join(f"Factor {i}" for i in range(10))
+
+
+def build_bridge_app():
+    """Rebuild the previous Flask app mounted behind the buffering dispatch_flask middleware"""
+    flask_app = Flask("bridge")
+
+    @flask_app.route('/generate-factors', methods=['POST'])
+    async def generate_factors_route():
+        data = request.json
+        engine = ExpertosyRecommendationEngine(data.get('search_query'))
+        return jsonify({"factors": await engine.generate_factors()})
+
+    @flask_app.route('/create-questionnaire', methods=['POST'])
+    async def create_questionnaire_route():
+        data = request.json
+        engine = ExpertosyRecommendationEngine(data.get('search_query'))
+        return jsonify({"questionnaire": await engine.create_questionnaire(data.get('factors'))})
+
+    @flask_app.route('/generate-recommendation', methods=['POST'])
+    async def generate_recommendation_route():
+        data = request.json
+        engine = ExpertosyRecommendationEngine(data.get('search_query'))
+        return jsonify({"recommendation": await engine.generate_recommendation(data.get('user_preferences'))})
+
+    @flask_app.route('/generate-ranking-questionnaire', methods=['POST'])
+    async def generate_ranking_questionnaire_route():
+        data = request.json
+        engine = ExpertosyRecommendationEngine(data.get('search_query', ''))
+        questionnaire = await engine.generate_ranking_questionnaire(data.get('products'), data.get('previous_questions', []))
+        return jsonify({"questionnaire": questionnaire})
+
+    @flask_app.route('/rank-products', methods=['POST'])
+    async def rank_products_route():
+        data = request.get_json()
+        engine = ExpertosyRecommendationEngine()
+        return jsonify({"ranked_products": await engine.rank_products(data['products'], data['ranking_preferences'])})
+
+    bridge = FastAPI()
+    wsgi_app = WsgiToAsgi(flask_app)
+
+    @bridge.middleware("http")
+    async def dispatch_flask(request: Request, call_next):
+        response_body = []
+        response_headers = []
+        response_status = [200]
+
+        async def receive():
+            return {"type": "http.request", "body": await request.body(), "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response_status[0] = message["status"]
+                response_headers.extend(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+
+        await wsgi_app(request.scope, receive, send)
+        body = b"".join(response_body)
+
+        content_type = None
+        for key, value in response_headers:
+            if key.lower() == b'content-type':
+                content_type = value.decode('utf-8')
+                break
+
+        if content_type and 'application/json' in content_type and body:
+            return JSONResponse(content=json.loads(body.decode('utf-8')), status_code=response_status[0])
+        return Response(content=body, status_code=response_status[0], headers=dict(response_headers), media_type=content_type)
+
+    return bridge
+
+
+async def run_benchmark(asgi_app, requests_per_route: int) -> dict:
+    """Drive every route in-process and collect latency and allocation figures"""
+    transport = httpx.ASGITransport(app=asgi_app)
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        # Warm up imports, routing tables and thread pools before measuring
+        for path, payload in ROUTES:
+            response = await http.post(path, json=payload)
+            response.raise_for_status()
+
+        tracemalloc.start()
+        for _ in range(requests_per_route):
+            for path, payload in ROUTES:
+                started = time.perf_counter()
+                response = await http.post(path, json=payload)
+                latencies.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "peak_kib": peak / 1024,
+    }
+
+
+async def main(requests_per_route: int):
+    ExpertosyRecommendationEngine._get_completion = stub_completion
+
+    results = {
+        "bridge": await run_benchmark(build_bridge_app(), requests_per_route),
+        "native": await run_benchmark(backend.asgi_app, requests_per_route),
+    }
+
+    print(f"\n=== ASGI overhead benchmark ({requests_per_route} requests per route, stubbed LLM) ===\n")
+    print(f"{'app':<8}{'requests':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+    for name, r in results.items():
+        print(f"{name:<8}{r['requests']:>10}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['peak_kib']:>12.1f}")
+
+    speedup = results["bridge"]["mean_ms"] / results["native"]["mean_ms"]
+    print(f"\nNative routes are {speedup:.2f}x faster per request on average")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,92 @@
+"""
+Compare end-to-end latency and token cost of the landing -> questionnaire
+transition: two sequential calls, two calls with speculation, and /bootstrap.
+All LLM calls go to a local fake server with simulated upstream latency.
+
+Usage: python bench_bootstrap.py [iterations] [client_gap_seconds]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import statistics
+
+FAKE_PORT = 9931
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+# Measure cold LLM round-trips, not our caches
+os.environ["QUERY_CACHE_ENABLED"] = "false"
+os.environ["RESPONSE_STORE_ENABLED"] = "false"
+
+import httpx
+
+import app as backend
+from fake_llm_server import BackgroundServer
+from speculation import speculations
+
+
+async def two_call_flow(http: httpx.AsyncClient, query: str, client_gap: float, use_token: bool):
+    factors = (await http.post('/generate-factors', json={"search_query": query})).json()
+    await asyncio.sleep(client_gap)
+    payload = {"search_query": query, "factors": factors["factors"]}
+    if use_token and factors.get("questionnaire_token"):
+        payload["questionnaire_token"] = factors["questionnaire_token"]
+    response = await http.post('/create-questionnaire', json=payload)
+    response.raise_for_status()
+
+
+async def bootstrap_flow(http: httpx.AsyncClient, query: str, client_gap: float, use_token: bool):
+    response = await http.post('/bootstrap', json={"search_query": query})
+    response.raise_for_status()
+
+
+async def run_flow(name, flow, server, iterations: int, client_gap: float, use_token: bool = False) -> dict:
+    server.llm.reset()
+    latencies = []
+    transport = httpx.ASGITransport(app=backend.asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+        for i in range(iterations):
+            started = time.perf_counter()
+            await flow(http, f"{name} product {chr(97 + i % 26)}{i}", client_gap, use_token)
+            latencies.append(time.perf_counter() - started)
+    # Let any leftover speculative work finish before reading token counts
+    await asyncio.sleep(0.1)
+    stats = server.llm.stats()
+    return {
+        "mean_s": statistics.mean(latencies),
+        "p50_s": statistics.median(latencies),
+        "llm_calls": stats["requests"] / iterations,
+        "prompt_tokens": stats["prompt_tokens"] / iterations,
+        "completion_tokens": stats["completion_tokens"] / iterations,
+    }
+
+
+async def main(iterations: int, client_gap: float):
+    with BackgroundServer(FAKE_PORT) as server:
+        speculations.enabled = False
+        results = {"two-call": await run_flow("two-call", two_call_flow, server, iterations, client_gap)}
+        speculations.enabled = True
+        results["speculative"] = await run_flow("speculative", two_call_flow, server, iterations, client_gap, use_token=True)
+        results["bootstrap"] = await run_flow("bootstrap", bootstrap_flow, server, iterations, client_gap)
+
+        print(f"\n=== Landing -> questionnaire benchmark ({iterations} iterations, "
+              f"{server.llm.latency:.2f}s time-to-first-token, {server.llm.tokens_per_second:.0f} tok/s, "
+              f"{client_gap:.2f}s client gap) ===\n")
+        print(f"{'flow':<13}{'mean s':>9}{'p50 s':>9}{'LLM calls':>11}{'prompt tok':>12}{'compl. tok':>12}")
+        for name, r in results.items():
+            print(f"{name:<13}{r['mean_s']:>9.2f}{r['p50_s']:>9.2f}{r['llm_calls']:>11.1f}"
+                  f"{r['prompt_tokens']:>12.0f}{r['completion_tokens']:>12.0f}")
+
+        baseline = results["two-call"]
+        bootstrap = results["bootstrap"]
+        print(f"\n/bootstrap cuts latency by {(1 - bootstrap['mean_s'] / baseline['mean_s']) * 100:.0f}% "
+              f"and prompt tokens by {(1 - bootstrap['prompt_tokens'] / baseline['prompt_tokens']) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    ))
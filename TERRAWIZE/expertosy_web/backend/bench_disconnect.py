@@ -0,0 +1,128 @@
+"""
+Upstream tokens spent on rankings whose user navigated away, with and without cancel-on-disconnect.
+
+Starts the fake LLM server in-process and the backend under uvicorn, once with
+CANCEL_ON_DISCONNECT=false and once with it enabled. Each simulated user asks
+for a ranking, half of them through /rank-products and half through
+/rank-products/stream, and --leave-share of them close the connection
+--leave-after seconds in, well before the ranking is done. Reported per mode:
+upstream calls, calls the fake LLM saw aborted, completion tokens it actually
+generated, and the backend's own count of cancelled calls and estimated tokens
+saved.
+
+Usage: python bench_disconnect.py [--users 20] [--leave-share 0.5] [--leave-after 2] [--latency 1]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+import tempfile
+
+import httpx
+
+from fake_llm_server import BackgroundServer, FakeLLM, PRODUCTS
+from loadtest import HERE, wait_until_up, stop
+
+FAKE_PORT = 9946
+BACKEND_PORT = 9947
+PREFERENCES = {"What is your budget?": "B) $1,000 - $1,500", "What will I mainly use it for?": "C) Programming"}
+
+
+def start_backend(cancel_on_disconnect: bool, workdir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        LLM_BASE_URL=f"http://127.0.0.1:{FAKE_PORT}",
+        DEEPSEEK_API_KEY="fake",
+        RESPONSE_STORE_ENABLED="false",
+        SINGLEFLIGHT_LOCK_DIR=os.path.join(workdir, "locks"),
+        CANCEL_ON_DISCONNECT=str(cancel_on_disconnect).lower(),
+    )
+    log = open(os.path.join(workdir, f"backend-{cancel_on_disconnect}.log"), "w")
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:asgi_app", "--host", "127.0.0.1", "--port", str(BACKEND_PORT),
+         "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    wait_until_up(f"http://127.0.0.1:{BACKEND_PORT}/health")
+    return backend
+
+
+async def run_user(client: httpx.AsyncClient, number: int, leaves: bool, leave_after: float) -> bool:
+    """One ranking request, abandoned after leave_after seconds if the user leaves; True if it completed"""
+    # Distinct preferences per user so nothing is served from shared in-flight calls
+    body = {"products": PRODUCTS, "ranking_preferences": {**PREFERENCES, "User": str(number)}, "incremental": False}
+    path = "/rank-products/stream" if number % 2 else "/rank-products"
+
+    async def request():
+        async with client.stream("POST", path, json=body) as response:
+            async for _ in response.aiter_bytes():
+                pass
+
+    try:
+        await asyncio.wait_for(request(), leave_after if leaves else None)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def run_users(llm: FakeLLM, users: int, leave_share: float, leave_after: float) -> int:
+    leaving = int(users * leave_share)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{BACKEND_PORT}", timeout=120,
+                                 limits=httpx.Limits(max_connections=users)) as client:
+        # Two finished rankings give the backend the typical size and duration of a ranking call
+        await asyncio.gather(run_user(client, users, False, 0), run_user(client, users + 1, False, 0))
+        llm.reset()
+        completed = await asyncio.gather(*[run_user(client, number, number < leaving, leave_after)
+                                           for number in range(users)])
+    return sum(completed)
+
+
+def run_mode(llm: FakeLLM, cancel_on_disconnect: bool, args, workdir: str) -> dict:
+    backend = start_backend(cancel_on_disconnect, workdir)
+    try:
+        completed = asyncio.run(run_users(llm, args.users, args.leave_share, args.leave_after))
+        # Let calls the backend kept going finish upstream before counting tokens
+        time.sleep(args.settle)
+        backend_stats = httpx.get(f"http://127.0.0.1:{BACKEND_PORT}/cancellation-stats").json()
+    finally:
+        stop(backend)
+    return {
+        "completed": completed,
+        "llm_calls": llm.requests,
+        "aborted": llm.aborted,
+        "generated": llm.generated_tokens,
+        "cancelled": sum(backend_stats["cancelled_calls"].values()),
+        "saved_estimate": sum(backend_stats["tokens_saved"].values()),
+    }
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare upstream tokens spent with and without cancel-on-disconnect")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--leave-share", type=float, default=0.5, help="share of users that navigate away")
+    parser.add_argument("--leave-after", type=float, default=2.0, help="seconds before a leaving user disconnects")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--settle", type=float, default=12.0, help="seconds to let abandoned calls finish upstream")
+    args = parser.parse_args(argv)
+
+    llm = FakeLLM(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    with BackgroundServer(FAKE_PORT, llm), tempfile.TemporaryDirectory() as workdir:
+        results = {
+            "keep going": run_mode(llm, False, args, workdir),
+            "cancel": run_mode(llm, True, args, workdir),
+        }
+
+    print(f"\n=== {args.users} rankings, {args.leave_share:.0%} abandoned after {args.leave_after:g}s, "
+          f"{args.latency:g}s upstream latency ===\n")
+    print(f"{'mode':<12}{'completed':>11}{'LLM calls':>11}{'aborted':>9}{'generated tok':>15}{'cancelled':>11}"
+          f"{'saved tok (est)':>17}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['completed']:>11}{result['llm_calls']:>11}{result['aborted']:>9}"
+              f"{result['generated']:>15}{result['cancelled']:>11}{result['saved_estimate']:>17}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,125 @@
+"""
+How long ranking requests hold the server, direct versus submitted as jobs.
+
+Many clients rank at once against a slow fake LLM. Direct clients hold one
+request open for the whole ranking; job clients submit to /rank-products/jobs
+and long-poll /jobs/<id> with ?wait=<poll-wait>. Reported per mode: rankings
+that failed (shed with 503/504), time until each client has its ranking, the
+longest single request, the request-seconds spent holding connections open and
+the peak number of requests open at once.
+
+Usage: python bench_jobs.py [--clients 40] [--latency 3] [--poll-wait 2]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from typing import Optional
+
+FAKE_PORT = 9945
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+os.environ["RESPONSE_STORE_ENABLED"] = "false"
+
+import httpx
+
+from app import fastapi_app
+from fake_llm_server import BackgroundServer, FakeLLM, PRODUCTS
+
+PREFERENCES = {"What is your budget?": "B) $1,000 - $1,500", "What will I mainly use it for?": "C) Programming"}
+
+
+class RequestTracker:
+    """Duration of every request and the peak number open at once"""
+
+    def __init__(self):
+        self.open = 0
+        self.peak = 0
+        self.durations = []
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        self.open += 1
+        self.peak = max(self.peak, self.open)
+        started = time.perf_counter()
+        try:
+            return await client.request(method, url, **kwargs)
+        finally:
+            self.durations.append(time.perf_counter() - started)
+            self.open -= 1
+
+
+def body(client_number: int) -> dict:
+    # Distinct preferences per client so nothing is served from shared in-flight calls
+    return {"products": PRODUCTS, "ranking_preferences": {**PREFERENCES, "Client": str(client_number)},
+            "incremental": False}
+
+
+async def direct_client(client: httpx.AsyncClient, tracker: RequestTracker, number: int,
+                        poll_wait: float) -> Optional[float]:
+    started = time.perf_counter()
+    response = await tracker.request(client, "POST", "/rank-products", json=body(number))
+    return time.perf_counter() - started if response.status_code == 200 else None
+
+
+async def job_client(client: httpx.AsyncClient, tracker: RequestTracker, number: int,
+                     poll_wait: float) -> Optional[float]:
+    started = time.perf_counter()
+    response = await tracker.request(client, "POST", "/rank-products/jobs", json=body(number))
+    if response.status_code != 202:
+        return None
+    job = response.json()
+    while job["status"] not in ("succeeded", "failed", "cancelled"):
+        job = (await tracker.request(client, "GET", f"/jobs/{job['job_id']}", params={"wait": poll_wait})).json()
+    return time.perf_counter() - started if job["status"] == "succeeded" else None
+
+
+async def run_mode(client_fn, clients: int, poll_wait: float) -> dict:
+    tracker = RequestTracker()
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        results = await asyncio.gather(*[client_fn(client, tracker, number, poll_wait) for number in range(clients)])
+    completions = sorted(seconds for seconds in results if seconds is not None) or [float("nan")]
+    return {
+        "failed": sum(1 for seconds in results if seconds is None),
+        "p50": completions[len(completions) // 2],
+        "p95": completions[min(int(len(completions) * 0.95), len(completions) - 1)],
+        "requests": len(tracker.durations),
+        "longest_request": max(tracker.durations),
+        "held_seconds": sum(tracker.durations),
+        "peak_open": tracker.peak,
+    }
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare direct ranking requests with ranking jobs")
+    parser.add_argument("--clients", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=3.0, help="fake time to first token")
+    parser.add_argument("--poll-wait", type=float, default=2.0, help="long-poll wait of job clients")
+    args = parser.parse_args(argv)
+
+    llm = FakeLLM(latency=args.latency, tokens_per_second=2000)
+
+    async def compare() -> dict:
+        # One event loop for both runs, since the pooled LLM client is bound to the loop it was first used on
+        return {
+            "direct": await run_mode(direct_client, args.clients, args.poll_wait),
+            "jobs": await run_mode(job_client, args.clients, args.poll_wait),
+        }
+
+    with BackgroundServer(FAKE_PORT, llm):
+        results = asyncio.run(compare())
+
+    print(f"\n=== {args.clients} concurrent rankings, {args.latency:g}s upstream latency, "
+          f"{args.poll_wait:g}s long-poll ===\n")
+    print(f"{'mode':<8}{'failed':>8}{'p50 s':>8}{'p95 s':>8}{'requests':>10}{'longest req s':>15}{'held req-s':>12}"
+          f"{'peak open':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<8}{result['failed']:>8}{result['p50']:>8.2f}{result['p95']:>8.2f}{result['requests']:>10}"
+              f"{result['longest_request']:>15.2f}{result['held_seconds']:>12.1f}{result['peak_open']:>11}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
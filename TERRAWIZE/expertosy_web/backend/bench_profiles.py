@@ -0,0 +1,109 @@
+"""
+Latency of each engine method under its generation profile.
+
+Runs every profiled engine method against the fake LLM server, once with the
+single profile every call used to share (strong model, max_tokens=2000,
+temperature 0.7) and once with the per-method profiles, and reports per
+profile the model, mean/p50/p95 upstream latency and the tokens each call
+reserves against the admission scheduler's per-minute budget. The fake server
+stands in for a fast and a strong model tier with different generation speeds.
+
+Usage: python bench_profiles.py [--iterations 10] [--fast-tokens-per-second 600] [--strong-tokens-per-second 200]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+from contextlib import nullcontext
+from unittest import mock
+
+FAKE_PORT = 9937
+FAST_MODEL = "fast-chat"
+STRONG_MODEL = "deepseek-chat"
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+os.environ["LLM_MODEL_FAST"] = FAST_MODEL
+os.environ["LLM_MODEL_STRONG"] = STRONG_MODEL
+
+from app import ExpertosyRecommendationEngine
+from fake_llm_server import BackgroundServer, FakeLLM, PRODUCTS, FACTORS
+from profiles import GENERATION_PROFILES
+
+PREFERENCES = {"What is my budget?": "B) $1,000 - $1,500", "What will I mainly use it for?": "C) Programming"}
+RANKED = [{"name": f"Laptop {i}", "price": f"${999 + i * 100}"} for i in range(1, 6)]
+
+
+def cases(engine: ExpertosyRecommendationEngine) -> dict:
+    """One engine call per profile, keyed by profile name"""
+    return {
+        "generate_factors": lambda: engine.generate_factors(),
+        "create_questionnaire": lambda: engine.create_questionnaire(FACTORS),
+        "bootstrap": lambda: engine.bootstrap(),
+        "generate_ranking_questionnaire": lambda: engine.generate_ranking_questionnaire(PRODUCTS),
+        "generate_recommendation": lambda: engine.generate_recommendation(PREFERENCES),
+        "rank_products": lambda: engine.rank_products(PRODUCTS, PREFERENCES),
+        "merge_rankings": lambda: engine._get_completion(
+            engine._merge_messages(RANKED[:3], RANKED[3:], PREFERENCES), "merge_rankings"),
+    }
+
+
+async def run_profiles(iterations: int, uniform: bool) -> dict:
+    results = {}
+    with mock.patch("app.get_profile", lambda name: GENERATION_PROFILES["default"]) if uniform else nullcontext():
+        for index in range(iterations):
+            # A fresh query per iteration so every call reaches the fake server
+            engine = ExpertosyRecommendationEngine(f"laptop {index}", use_cache=False)
+            for name, call in cases(engine).items():
+                started = time.perf_counter()
+                await call()
+                results.setdefault(name, []).append(time.perf_counter() - started)
+    return results
+
+
+def summary(timings: list) -> tuple:
+    timings = sorted(timings)
+    return (statistics.mean(timings), timings[len(timings) // 2],
+            timings[min(int(len(timings) * 0.95), len(timings) - 1)])
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Benchmark upstream latency per generation profile")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake time to first token")
+    parser.add_argument("--fast-tokens-per-second", type=float, default=600)
+    parser.add_argument("--strong-tokens-per-second", type=float, default=200)
+    args = parser.parse_args(argv)
+
+    llm = FakeLLM(latency=args.latency, tokens_per_second=args.strong_tokens_per_second,
+                  model_speeds={FAST_MODEL: args.fast_tokens_per_second, STRONG_MODEL: args.strong_tokens_per_second})
+
+    async def compare() -> tuple:
+        # One event loop for both runs, since the pooled LLM client is bound to the loop it was first used on
+        return await run_profiles(args.iterations, uniform=True), await run_profiles(args.iterations, uniform=False)
+
+    with BackgroundServer(FAKE_PORT, llm):
+        uniform, profiled = asyncio.run(compare())
+
+    default = GENERATION_PROFILES["default"]
+    print(f"\n=== Generation profiles ({args.iterations} iterations, fast {args.fast_tokens_per_second:g} tok/s, "
+          f"strong {args.strong_tokens_per_second:g} tok/s) ===\n")
+    print(f"{'profile':<32}{'model':<15}{'max tok':>8}{'before s':>10}{'mean s':>9}{'p50 s':>8}{'p95 s':>8}")
+    for name, timings in profiled.items():
+        profile = GENERATION_PROFILES[name]
+        before = summary(uniform[name])[0]
+        mean, p50, p95 = summary(timings)
+        print(f"{name:<32}{profile.model:<15}{profile.max_tokens:>8}{before:>10.3f}{mean:>9.3f}{p50:>8.3f}{p95:>8.3f}")
+    total_before = sum(sum(timings) for timings in uniform.values())
+    total_after = sum(sum(timings) for timings in profiled.values())
+    reserved_before = default.max_tokens * len(profiled)
+    reserved_after = sum(GENERATION_PROFILES[name].max_tokens for name in profiled)
+    print(f"\nUpstream time {total_before:.2f}s -> {total_after:.2f}s; completion tokens reserved per round "
+          f"{reserved_before} -> {reserved_after} (uniform profile: {default.model}, max_tokens {default.max_tokens})")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+"""
+Benchmark of upstream prompt-prefix caching for the engine's prompt layout.
+
+Runs the engine's prompts for many different search queries against the fake
+LLM server, which simulates prefix caching and charges prefill time for every
+uncached prompt token, and reports per endpoint the cached share of prompt
+tokens, prompt cost and mean upstream latency. The current layout (static
+system prompt, request data last) is compared with the same prompts rendered
+variable-first, i.e. with the request data at the start of the system message
+as the prompts used to be laid out.
+
+Usage: python bench_prompt_cache.py [--queries 20] [--prefill-tokens-per-second 2000]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from unittest import mock
+
+FAKE_PORT = 9935
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+
+from app import ExpertosyRecommendationEngine
+from fake_llm_server import BackgroundServer, FakeLLM, PRODUCTS, FACTORS
+from hedging import deadline_scope
+from prompts import PromptTemplate, prompt_cache_stats
+
+QUERIES = ["laptop", "espresso machine", "running shoes", "electric bike", "mattress", "camera",
+           "smartphone", "vacuum cleaner", "office chair", "headphones", "tent", "monitor"]
+PREFERENCES = {"What is my budget?": "B) $1,000 - $1,500", "What will I mainly use it for?": "C) Programming"}
+
+render_stable_prefix = PromptTemplate.render
+
+
+def render_variable_first(template: PromptTemplate, **variables) -> list:
+    """The same prompt with the request data leading the system message"""
+    system, user = render_stable_prefix(template, **variables)
+    return [
+        {"role": "system", "content": f"{user['content']}\n\n{system['content']}"},
+        {"role": "user", "content": "Answer the request above."},
+    ]
+
+
+async def run_queries(queries: int):
+    for index in range(queries):
+        query = f"{QUERIES[index % len(QUERIES)]} {index}"
+        engine = ExpertosyRecommendationEngine(query, use_cache=False)
+        products = [f"{line} {query}" for line in PRODUCTS]
+        calls = {
+            "generate-factors": lambda: engine.generate_factors(),
+            "create-questionnaire": lambda: engine.create_questionnaire(FACTORS),
+            "generate-ranking-questionnaire": lambda: engine.generate_ranking_questionnaire(products),
+            "rank-products": lambda: engine.rank_products(products, PREFERENCES),
+        }
+        for endpoint, call in calls.items():
+            with deadline_scope(endpoint, None):
+                await call()
+
+
+async def run_layout(render, llm: FakeLLM, queries: int) -> dict:
+    llm.reset()
+    prompt_cache_stats.endpoints.clear()
+    started = time.perf_counter()
+    with mock.patch.object(PromptTemplate, "render", render):
+        await run_queries(queries)
+    stats = prompt_cache_stats.stats()
+    stats["wall_seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare prompt-prefix cache hits of prompt layouts")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake time to first token excluding prefill")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2000)
+    args = parser.parse_args(argv)
+
+    llm = FakeLLM(latency=args.latency, tokens_per_second=100000,
+                  prefill_tokens_per_second=args.prefill_tokens_per_second)
+    async def compare() -> dict:
+        # One event loop for both runs, since the pooled LLM client is bound to the loop it was first used on
+        return {
+            "variable-first": await run_layout(render_variable_first, llm, args.queries),
+            "stable-prefix": await run_layout(render_stable_prefix, llm, args.queries),
+        }
+
+    with BackgroundServer(FAKE_PORT, llm):
+        results = asyncio.run(compare())
+
+    print(f"\n=== Prompt prefix cache ({args.queries} queries, prefill {args.prefill_tokens_per_second:g} tok/s) ===\n")
+    print(f"{'layout':<16}{'endpoint':<32}{'hit ratio':>10}{'cost $':>11}{'hit s':>8}{'miss s':>8}")
+    for layout, stats in results.items():
+        for endpoint, summary in list(stats["endpoints"].items()) + [("total", stats["total"])]:
+            hit, miss = (summary[f"mean_latency_{kind}"] for kind in ("hit", "miss"))
+            print(f"{layout:<16}{endpoint:<32}{summary['hit_ratio']:>10.1%}{summary['prompt_cost_usd']:>11.6f}"
+                  f"{hit if hit is not None else float('nan'):>8.3f}{miss if miss is not None else float('nan'):>8.3f}")
+        print(f"{layout:<16}{'wall time':<32}{stats['wall_seconds']:>37.2f}\n")
+
+    before, after = results["variable-first"]["total"], results["stable-prefix"]["total"]
+    saved = 1 - after["prompt_cost_usd"] / before["prompt_cost_usd"] if before["prompt_cost_usd"] else 0.0
+    sped = 1 - results["stable-prefix"]["wall_seconds"] / results["variable-first"]["wall_seconds"]
+    print(f"Prompt cost {saved:.1%} lower, wall time {sped:.1%} lower with the stable-prefix layout")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
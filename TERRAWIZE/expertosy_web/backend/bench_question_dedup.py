@@ -0,0 +1,146 @@
+"""
+Ranking rounds needed to cover a set of trade-off topics, with and without question deduplication.
+
+The fake LLM server is patched to behave like a model that ignores part of the
+"DO NOT duplicate" instruction: each ranking questionnaire draws its questions
+from a pool of topics, each worded several ways, avoiding only questions that
+appear verbatim in the prompt. A simulated user answers every question shown
+and keeps requesting rounds through a ranking session until the answered
+questions cover --topics distinct topics. Reported per mode: rounds, questions
+shown that repeated an answered topic, and upstream LLM calls.
+
+Usage: python bench_question_dedup.py [--users 20] [--topics 8] [--questions 4]
+"""
+import os
+import sys
+import random
+import asyncio
+import argparse
+import logging
+from unittest import mock
+
+FAKE_PORT = 9941
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+os.environ["RESPONSE_STORE_ENABLED"] = "false"
+
+import httpx
+
+import fake_llm_server
+from app import fastapi_app
+from fake_llm_server import BackgroundServer, FakeLLM, PRODUCTS
+from streaming import parse_questionnaire
+
+# Topic -> wordings a model might use for it
+TOPICS = {
+    "price": ["What is your budget?", "How much are you willing to spend?",
+              "How important is keeping the cost low?"],
+    "portability": ["How portable does it need to be?", "How important is a lightweight laptop for carrying around?",
+                    "How often will you travel with it?"],
+    "battery": ["How long does the battery need to last?", "How important is battery life when working unplugged?",
+                "How often will you be away from a charger?"],
+    "screen": ["Which screen size suits you?", "What display size do you prefer?",
+               "How large should the display be?"],
+    "usage": ["What will you mainly use it for?", "What is the primary purpose of your laptop?",
+              "Which tasks will you mostly use it for?"],
+    "build": ["How important is build quality?", "How much do you care about a sturdy, durable build?",
+              "How robust does the laptop need to be?"],
+    "graphics": ["Do you need a dedicated graphics card?", "Will you be gaming on this laptop?",
+                 "How important is GPU performance?"],
+    "storage": ["How much storage do you need?", "How much SSD space do you need?",
+                "What storage capacity do you need?"],
+    "os": ["Which operating system do you prefer?", "Do you have an operating system preference?"],
+    "support": ["How important is brand support?", "How much do warranty and service matter to you?"],
+    "keyboard": ["How important is a comfortable keyboard?", "Do you type for long stretches?"],
+    "ports": ["Which ports do you need?", "Do you need HDMI or USB-A ports?"],
+}
+TOPIC_OF = {wording: topic for topic, wordings in TOPICS.items() for wording in wordings}
+OPTIONS = "A) Very important\nB) Somewhat important\nC) Not very important\nD) Not at all"
+
+_canned_response = fake_llm_server.canned_response
+
+
+def repetitive_model(seed: int, questions_per_round: int):
+    """A canned_response that avoids verbatim repeats of listed questions but not reworded ones"""
+    rng = random.Random(seed)
+
+    def respond(messages: list, custom: list = ()) -> str:
+        prompt = messages[0].get("content", "") if messages else ""
+        if "questionnaire" not in prompt or "Create a questionnaire" not in messages[1].get("content", ""):
+            return _canned_response(messages, custom)
+        conversation = "\n".join(message.get("content", "") for message in messages[1:])
+        fresh = [wording for wording in TOPIC_OF if wording not in conversation]
+        count = questions_per_round
+        if len(messages) > 2:
+            # A top-up turn asks for a number of replacement questions
+            count = int(next((word for word in messages[-1]["content"].split() if word.isdigit()), count))
+        picked = rng.sample(fresh, min(count, len(fresh)))
+        return "\n\n".join(f"{number}. {wording}\n{OPTIONS}" for number, wording in enumerate(picked, 1))
+
+    return respond
+
+
+async def run_user(client: httpx.AsyncClient, topics: int, max_rounds: int) -> dict:
+    created = await client.post("/ranking-sessions", json={"search_query": "laptop", "products": PRODUCTS})
+    session_id = created.json()["session_id"]
+    covered, rounds, repeats, answers = set(), 0, 0, {}
+    while len(covered) < topics and rounds < max_rounds:
+        response = await client.post("/generate-ranking-questionnaire",
+                                     json={"session_id": session_id, "answers": answers})
+        rounds += 1
+        answers = {}
+        for question in parse_questionnaire(response.json()["questionnaire"]):
+            topic = TOPIC_OF.get(question["question"])
+            repeats += topic in covered
+            covered.add(topic)
+            answers[question["question"]] = "A) Very important"
+    return {"rounds": rounds, "repeats": repeats}
+
+
+async def run_mode(llm: FakeLLM, users: int, topics: int, questions: int, dedup: bool) -> dict:
+    llm.reset()
+    results = []
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        with mock.patch("app.QUESTION_DEDUP_ENABLED", dedup):
+            for user in range(users):
+                fake_llm_server.canned_response = repetitive_model(user, questions)
+                results.append(await run_user(client, topics, max_rounds=20))
+    return {
+        "rounds": sum(result["rounds"] for result in results) / users,
+        "repeats": sum(result["repeats"] for result in results) / users,
+        "llm_calls": llm.requests / users,
+        "prompt_tokens": llm.prompt_tokens / users,
+    }
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare ranking rounds with and without question deduplication")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--topics", type=int, default=8, help="distinct topics each user needs answered")
+    parser.add_argument("--questions", type=int, default=4, help="questions the fake model writes per round")
+    args = parser.parse_args(argv)
+
+    llm = FakeLLM(latency=0.01, tokens_per_second=100000)
+
+    async def compare() -> dict:
+        # One event loop for both runs, since the pooled LLM client is bound to the loop it was first used on
+        return {
+            "prompt only": await run_mode(llm, args.users, args.topics, args.questions, dedup=False),
+            "dedup index": await run_mode(llm, args.users, args.topics, args.questions, dedup=True),
+        }
+
+    with BackgroundServer(FAKE_PORT, llm):
+        results = asyncio.run(compare())
+
+    print(f"\n=== Ranking rounds to cover {args.topics} topics ({args.users} users, "
+          f"{args.questions} questions per round) ===\n")
+    print(f"{'mode':<14}{'rounds':>8}{'repeats shown':>15}{'LLM calls':>11}{'prompt tok':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<14}{result['rounds']:>8.2f}{result['repeats']:>15.2f}{result['llm_calls']:>11.2f}"
+              f"{result['prompt_tokens']:>12.0f}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
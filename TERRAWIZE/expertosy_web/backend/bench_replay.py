@@ -0,0 +1,109 @@
+"""
+Deterministic benchmark of the engine's own hot paths using recorded completions.
+
+The first run records one pass of every benchmarked engine method against the
+local fake LLM server into a fixture file. Later runs replay that fixture, by
+default with zero upstream time, so the numbers measure only our parsing,
+validation and routing code (e.g. the rank_products JSON validation loop) and
+are comparable across commits. Use --time-scale 1 to replay with the recorded
+upstream timings instead.
+
+Usage: python bench_replay.py [--fixture bench_fixtures.jsonl.gz] [--iterations 200] [--time-scale 0] [--rerecord]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+FAKE_PORT = 9934
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+
+from app import ExpertosyRecommendationEngine
+from fake_llm_server import BackgroundServer, PRODUCTS, FACTORS
+from fixtures import CompletionFixtures
+
+SEARCH_QUERY = "laptop"
+PREFERENCES = {
+    "What is my budget?": "B) $1,000 - $1,500",
+    "What will I mainly use it for?": "C) Programming and light gaming",
+    "How portable does it need to be?": "A) Very portable, I travel weekly",
+}
+LARGE_PRODUCTS = [f"{i}. Laptop {i} - ${600 + i * 25}" for i in range(1, 65)]
+
+
+def cases(engine: ExpertosyRecommendationEngine) -> dict:
+    """Engine calls to benchmark, each making one or more completions"""
+
+    async def consume(events):
+        async for _ in events:
+            pass
+
+    return {
+        "generate_factors": lambda: engine.generate_factors(),
+        "create_questionnaire": lambda: engine.create_questionnaire(FACTORS),
+        "bootstrap": lambda: engine.bootstrap(),
+        "generate_recommendation": lambda: engine.generate_recommendation(PREFERENCES),
+        "generate_ranking_questionnaire": lambda: engine.generate_ranking_questionnaire(PRODUCTS),
+        "rank_products": lambda: engine.rank_products(PRODUCTS, PREFERENCES),
+        "rank_products_tournament_64": lambda: engine.rank_products_tournament(LARGE_PRODUCTS, PREFERENCES),
+        "stream_rank_products": lambda: consume(engine.stream_rank_products(PRODUCTS, PREFERENCES)),
+        "stream_fast_rank_products": lambda: consume(engine.stream_fast_rank_products(PRODUCTS, PREFERENCES)),
+    }
+
+
+async def record(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+    fixtures = CompletionFixtures(path, "record")
+    with BackgroundServer(FAKE_PORT):
+        engine = ExpertosyRecommendationEngine(SEARCH_QUERY, fixtures=fixtures)
+        for run in cases(engine).values():
+            await run()
+    print(f"Recorded {fixtures.recorded} completions to {path}")
+
+
+async def replay(path: str, iterations: int, time_scale: float) -> dict:
+    fixtures = CompletionFixtures(path, "replay", time_scale=time_scale)
+    engine = ExpertosyRecommendationEngine(SEARCH_QUERY, use_cache=False, fixtures=fixtures)
+    results = {}
+    for name, run in cases(engine).items():
+        await run()  # warm up
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await run()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            "mean_ms": statistics.mean(timings),
+            "p50_ms": timings[len(timings) // 2],
+            "p95_ms": timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+        }
+    return results
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Replay recorded completions to benchmark engine hot paths")
+    parser.add_argument("--fixture", default="bench_fixtures.jsonl.gz")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--time-scale", type=float, default=0.0, help="multiplier for recorded upstream timings")
+    parser.add_argument("--rerecord", action="store_true", help="record a fresh fixture against the fake LLM server")
+    args = parser.parse_args(argv)
+
+    if args.rerecord or not os.path.exists(args.fixture):
+        asyncio.run(record(args.fixture))
+    results = asyncio.run(replay(args.fixture, args.iterations, args.time_scale))
+
+    print(f"\n=== Engine replay benchmark ({args.iterations} iterations, time scale {args.time_scale:g}) ===\n")
+    print(f"{'method':<32}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<32}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+"""
+Request latency and errors with one LLM backend versus the latency-aware router over three.
+
+Three fake LLM servers stand in for OpenAI-compatible providers with different
+latencies: a (fast), b (medium) and c (slow). The same workload of
+/generate-factors requests runs through a sequence of phases that change
+backend a:
+  healthy    a is the fastest backend
+  a down     every call to a fails with 429/500
+  a back     a answers again; the router finds out with a probe after the breaker cooldown
+  a slow     a's latency rises above b's
+"single" routes every call to a, like the hardwired client did; "router"
+routes across a, b and c. Reported per phase: p50/p95 request latency, failed
+requests and how many calls each backend answered.
+
+Usage: python bench_router.py [--requests 60] [--concurrency 6] [--cooldown 2]
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import itertools
+import logging
+from unittest import mock
+
+PORTS = {"a": 9948, "b": 9949, "c": 9950}
+LATENCIES = {"a": 0.2, "b": 0.6, "c": 1.2}
+os.environ["LLM_BACKENDS"] = json.dumps([
+    {"name": name, "base_url": f"http://127.0.0.1:{port}", "api_key_env": "DEEPSEEK_API_KEY"}
+    for name, port in PORTS.items()
+])
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+os.environ["RESPONSE_STORE_ENABLED"] = "false"
+os.environ["QUERY_CACHE_ENABLED"] = "false"
+
+import httpx
+
+from app import fastapi_app
+from fake_llm_server import BackgroundServer, FakeLLM
+from router import LLMRouter, LLMBackend
+
+queries = itertools.count()
+
+
+def set_phase(llms: dict, phase: str):
+    a = llms["a"]
+    a.error_rate = 1.0 if phase == "a down" else 0.0
+    a.latency_model.latency = 2.0 if phase == "a slow" else LATENCIES["a"]
+    for llm in llms.values():
+        llm.reset()
+
+
+async def run_phase(requests: int, concurrency: int) -> dict:
+    latencies, failed = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+
+        async def one():
+            nonlocal failed
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/generate-factors", json={"search_query": f"laptop {next(queries)}"})
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    failed += 1
+
+        await asyncio.gather(*[one() for _ in range(requests)])
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else float("nan"),
+        "failed": failed,
+    }
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare a single LLM backend with the latency-aware router")
+    parser.add_argument("--requests", type=int, default=60, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--cooldown", type=float, default=2.0, help="circuit breaker cooldown")
+    args = parser.parse_args(argv)
+
+    llms = {name: FakeLLM(latency=latency, tokens_per_second=2000) for name, latency in LATENCIES.items()}
+    phases = ["healthy", "a down", "a back", "a slow"]
+    modes = {
+        "single": lambda: LLMRouter([LLMBackend("a")], explore=0, cooldown=args.cooldown),
+        "router": lambda: LLMRouter([LLMBackend(name) for name in PORTS], cooldown=args.cooldown),
+    }
+
+    async def compare() -> dict:
+        # One event loop for every run, since the pooled LLM clients are bound to the loop they were first used on
+        results = {}
+        for mode, make_router in modes.items():
+            with mock.patch("app.llm_router", make_router()):
+                for phase in phases:
+                    set_phase(llms, phase)
+                    if phase == "a back":
+                        # Past the breaker cooldown, as a real outage would be
+                        await asyncio.sleep(args.cooldown)
+                    result = await run_phase(args.requests, args.concurrency)
+                    result["served"] = {name: llm.requests for name, llm in llms.items()}
+                    results[mode, phase] = result
+        return results
+
+    servers = [BackgroundServer(PORTS[name], llm) for name, llm in llms.items()]
+    for server in servers:
+        server.__enter__()
+    try:
+        results = asyncio.run(compare())
+    finally:
+        for server in servers:
+            server.__exit__(None, None, None)
+
+    print(f"\n=== {args.requests} requests per phase, {args.concurrency} concurrent; backend latency "
+          f"a={LATENCIES['a']:g}s b={LATENCIES['b']:g}s c={LATENCIES['c']:g}s ===\n")
+    print(f"{'mode':<8}{'phase':<10}{'p50 s':>8}{'p95 s':>8}{'failed':>8}{'a':>6}{'b':>6}{'c':>6}")
+    for (mode, phase), result in results.items():
+        served = result["served"]
+        print(f"{mode:<8}{phase:<10}{result['p50']:>8.2f}{result['p95']:>8.2f}{result['failed']:>8}"
+              f"{served['a']:>6}{served['b']:>6}{served['c']:>6}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.ERROR)
+    main(sys.argv[1:])
@@ -0,0 +1,122 @@
+"""
+Request payload and prompt size per ranking round, with and without a ranking session.
+
+Simulates a user answering ranking questionnaires round after round: each round
+asks /generate-ranking-questionnaire for new questions, answers them and calls
+/rank-products. Without a session the client resends the products, every
+previous question and every answer each round; with a session it sends only its
+session id and the latest answers. The fake LLM server makes every generated
+question unique so the previous-question list really grows.
+
+Usage: python bench_sessions.py [--rounds 8] [--products 10]
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+import logging
+
+FAKE_PORT = 9939
+os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}"
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+os.environ["RESPONSE_STORE_ENABLED"] = "false"
+
+import httpx
+
+import fake_llm_server
+from app import fastapi_app
+from fake_llm_server import BackgroundServer, FakeLLM
+from streaming import parse_questionnaire
+
+_canned_response = fake_llm_server.canned_response
+_question_counter = itertools.count(1)
+
+
+def unique_questions(messages: list, custom: list = ()) -> str:
+    """The fake server's canned response, with every questionnaire question made distinct"""
+    response = _canned_response(messages, custom)
+    if "questionnaire" in (messages[0].get("content", "") if messages else ""):
+        response = "\n".join(
+            line.replace("?", f" (variant {next(_question_counter)})?") if line[:1].isdigit() else line
+            for line in response.split("\n")
+        )
+    return response
+
+
+async def run_rounds(client: httpx.AsyncClient, llm: FakeLLM, rounds: int, products: list, use_session: bool) -> list:
+    results = []
+    session_id = None
+    if use_session:
+        created = await client.post("/ranking-sessions", json={"search_query": "laptop", "products": products})
+        session_id = created.json()["session_id"]
+
+    previous_questions, answers, new_answers = [], {}, {}
+    for _ in range(rounds):
+        if use_session:
+            body = {"session_id": session_id, "answers": new_answers}
+        else:
+            body = {"search_query": "laptop", "products": products, "previous_questions": previous_questions}
+        payload = json.dumps(body)
+        prompt_tokens = llm.prompt_tokens
+        response = await client.post("/generate-ranking-questionnaire", content=payload,
+                                     headers={"Content-Type": "application/json"})
+        questions = [question["question"] for question in parse_questionnaire(response.json()["questionnaire"])]
+        questionnaire_tokens = llm.prompt_tokens - prompt_tokens
+
+        new_answers = {question: "A) Option one" for question in questions}
+        previous_questions = previous_questions + questions
+        answers.update(new_answers)
+        if use_session:
+            rank_body = {"session_id": session_id, "answers": new_answers, "incremental": False}
+            new_answers = {}
+        else:
+            rank_body = {"products": products, "ranking_preferences": answers, "incremental": False}
+        rank_payload = json.dumps(rank_body)
+        prompt_tokens = llm.prompt_tokens
+        await client.post("/rank-products", content=rank_payload, headers={"Content-Type": "application/json"})
+        results.append({
+            "questionnaire_bytes": len(payload),
+            "questionnaire_prompt_tokens": questionnaire_tokens,
+            "rank_bytes": len(rank_payload),
+            "rank_prompt_tokens": llm.prompt_tokens - prompt_tokens,
+        })
+    return results
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Compare ranking rounds with and without server-side sessions")
+    parser.add_argument("--rounds", type=int, default=8)
+    parser.add_argument("--products", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    fake_llm_server.canned_response = unique_questions
+    products = [f"{i}. Laptop {i} - ${999 + i * 100}" for i in range(1, args.products + 1)]
+    llm = FakeLLM(latency=0.01, tokens_per_second=100000)
+
+    async def compare() -> dict:
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return {
+                "resend": await run_rounds(client, llm, args.rounds, products, use_session=False),
+                "session": await run_rounds(client, llm, args.rounds, products, use_session=True),
+            }
+
+    with BackgroundServer(FAKE_PORT, llm):
+        results = asyncio.run(compare())
+
+    print(f"\n=== Ranking rounds ({args.products} products) ===\n")
+    print(f"{'':<8}{'questionnaire request':>44}{'rank request':>32}")
+    print(f"{'round':<8}" + f"{'resend B':>11}{'session B':>11}{'resend tok':>11}{'session tok':>12}" * 2)
+    for round_number, (resend, session) in enumerate(zip(results["resend"], results["session"]), 1):
+        print(f"{round_number:<8}"
+              f"{resend['questionnaire_bytes']:>11}{session['questionnaire_bytes']:>11}"
+              f"{resend['questionnaire_prompt_tokens']:>11}{session['questionnaire_prompt_tokens']:>12}"
+              f"{resend['rank_bytes']:>11}{session['rank_bytes']:>11}"
+              f"{resend['rank_prompt_tokens']:>11}{session['rank_prompt_tokens']:>12}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
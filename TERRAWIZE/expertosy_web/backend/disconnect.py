@@ -0,0 +1,151 @@
+"""
+Cancellation of requests whose client has gone away.
+
+Users often navigate away while a questionnaire or ranking is still being
+generated. Starlette only notices a disconnect in streaming responses; a plain
+JSON endpoint keeps awaiting its LLM calls, and the tokens are paid for even
+though nobody reads them. DisconnectMiddleware runs each request's handler in
+its own task and listens for http.disconnect alongside it. A disconnect that
+arrives before the response is complete cancels the handler. The cancellation
+unwinds through the engine into the pooled httpx client, which closes the
+upstream connection, so the provider stops generating.
+
+Work shared with other callers is only cancelled once nobody is waiting for it.
+Coalesced calls keep running while another caller still waits for them. Jobs
+and speculative questionnaires run outside the request and are not affected.
+
+Cancelled LLM calls are counted together with an estimate of the completion
+tokens they saved, from running averages of the completion tokens and duration
+of finished calls with the same generation profile. A call still waiting for
+admission saves all of its tokens. A streamed call saves the tokens it had not
+received yet. A non-streamed call saves the share of its expected duration that
+was still to come.
+"""
+import os
+import asyncio
+import contextvars
+
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "true").lower() == "true"
+
+
+class RequestState:
+    """Whether the client of the request being served has disconnected"""
+    __slots__ = ("disconnected",)
+
+    def __init__(self):
+        self.disconnected = False
+
+
+# State of the request being served; tasks spawned while serving it share the same object
+current_request: contextvars.ContextVar = contextvars.ContextVar("http_request_state", default=None)
+
+
+def client_disconnected() -> bool:
+    state = current_request.get()
+    return state is not None and state.disconnected
+
+
+class CancellationTracker:
+    """Counts of client disconnects and cancelled LLM calls, with the completion tokens they saved"""
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.disconnects = 0
+        # reason ("disconnect" or "other", e.g. a losing hedge or a missed deadline) -> count
+        self.cancelled = {}
+        self.tokens_saved = {}
+        # generation profile name -> moving averages of completion tokens and seconds of finished calls
+        self._expected = {}
+
+    def record_completion(self, profile, completion_tokens: int, seconds: float):
+        previous = self._expected.get(profile.name)
+        if previous is None:
+            self._expected[profile.name] = [completion_tokens, seconds]
+        else:
+            previous[0] += self.smoothing * (completion_tokens - previous[0])
+            previous[1] += self.smoothing * (seconds - previous[1])
+
+    def expected_tokens(self, profile) -> float:
+        """Typical completion tokens of the profile, or its max_tokens before any call has finished"""
+        expected = self._expected.get(profile.name)
+        return profile.max_tokens if expected is None else expected[0]
+
+    def record_cancelled(self, profile, seconds: float = None, received_tokens: int = None) -> int:
+        """
+        Count an LLM call given up on, returning the completion tokens that saved.
+
+        seconds is how long the call had been upstream (None if it was never sent) and received_tokens how
+        much of a streamed call had arrived.
+        """
+        reason = "disconnect" if client_disconnected() else "other"
+        expected = self._expected.get(profile.name)
+        remaining = 1.0
+        if received_tokens is None and seconds is not None and expected is not None and expected[1] > 0:
+            remaining = max(1.0 - seconds / expected[1], 0.0)
+        saved = int(max(self.expected_tokens(profile) * remaining - (received_tokens or 0), 0))
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        self.tokens_saved[reason] = self.tokens_saved.get(reason, 0) + saved
+        return saved
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CANCEL_ON_DISCONNECT,
+            "disconnects": self.disconnects,
+            "cancelled_calls": dict(self.cancelled),
+            "tokens_saved": dict(self.tokens_saved),
+            "expected_completion_tokens": {name: round(expected[0]) for name, expected in self._expected.items()},
+        }
+
+
+class DisconnectMiddleware:
+    """ASGI middleware cancelling a request's handler when its client disconnects before the response is complete"""
+
+    def __init__(self, app, tracker: CancellationTracker = None):
+        self.app = app
+        self.tracker = tracker or cancellations
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not CANCEL_ON_DISCONNECT:
+            return await self.app(scope, receive, send)
+        state = RequestState()
+        # The listener owns the server's receive channel and hands every message on to the handler
+        messages = asyncio.Queue()
+        response_complete = False
+
+        async def send_wrapper(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        token = current_request.set(state)
+        try:
+            handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+        finally:
+            current_request.reset(token)
+
+        async def listen():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_complete and not handler.done():
+                        state.disconnected = True
+                        self.tracker.disconnects += 1
+                        handler.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        listener.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # Nobody is left to answer; anything else cancelling this request is passed on
+            if not state.disconnected:
+                raise
+        finally:
+            listener.cancel()
+
+
+# Process-wide cancellation counters
+cancellations = CancellationTracker()
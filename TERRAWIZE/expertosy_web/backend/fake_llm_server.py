@@ -0,0 +1,421 @@
+"""
+Local OpenAI-compatible stand-in for the upstream LLM API.
+
+Serves /chat/completions (streaming and non-streaming) with canned responses
+chosen from the system prompt, and simulates upstream timing as a sampled
+time-to-first-token plus a token generation rate. Time-to-first-token can be
+constant, uniform or lognormal with an optional slow tail, and a share of
+requests can fail with 429/500 like the real API does under load. Token usage
+is estimated and accumulated so benchmarks can compare token costs.
+
+Prompt-prefix caching is simulated at message granularity: the longest run of
+leading messages already seen in an earlier request counts as cached, is
+reported as prompt_cache_hit_tokens like DeepSeek does, and skips the prefill
+time charged per uncached prompt token.
+
+Requests honour max_tokens and stop sequences, and models can be given their
+own generation speed to stand in for a fast and a strong model tier.
+
+A client that disconnects mid-generation aborts it, like the real API: only the
+completion tokens generated until then count as generated_tokens.
+
+Usage: python fake_llm_server.py [port] [--latency 0.5 --distribution lognormal --tail-probability 0.01 ...]
+"""
+import os
+import re
+import sys
+import json
+import math
+import hashlib
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+import uvicorn
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200"))
+# constant, uniform (latency +/- jitter) or lognormal (median latency, sigma)
+FAKE_LLM_DISTRIBUTION = os.getenv("FAKE_LLM_DISTRIBUTION", "constant")
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.2"))
+FAKE_LLM_SIGMA = float(os.getenv("FAKE_LLM_SIGMA", "0.5"))
+FAKE_LLM_TAIL_PROBABILITY = float(os.getenv("FAKE_LLM_TAIL_PROBABILITY", "0"))
+FAKE_LLM_TAIL_LATENCY = float(os.getenv("FAKE_LLM_TAIL_LATENCY", "10"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_CHUNK_SIZE = int(os.getenv("FAKE_LLM_CHUNK_SIZE", "16"))
+# Prompt processing rate for uncached prompt tokens; 0 makes prompts free
+FAKE_LLM_PREFILL_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_PREFILL_TOKENS_PER_SECOND", "0"))
+FAKE_LLM_PREFIX_CACHE = os.getenv("FAKE_LLM_PREFIX_CACHE", "true").lower() == "true"
+# Per-model generation speed overriding FAKE_LLM_TOKENS_PER_SECOND, e.g. "fast-chat=600,deepseek-chat=200"
+FAKE_LLM_MODEL_TOKENS_PER_SECOND = os.getenv("FAKE_LLM_MODEL_TOKENS_PER_SECOND", "")
+# Optional JSON file of [{"match": "text in the system prompt", "response": "..."}] checked before the built-ins
+FAKE_LLM_RESPONSES = os.getenv("FAKE_LLM_RESPONSES", "")
+
+PRODUCTS = [f"{i}. Laptop {i} - ${999 + i * 100}" for i in range(1, 11)]
+
+FACTORS = [
+    "What is my budget?",
+    "How portable does it need to be?",
+    "What will I mainly use it for?",
+    "How long does the battery need to last?",
+    "Which screen size suits me?",
+    "How much storage do I need?",
+    "Which operating system do I prefer?",
+    "How important is build quality?",
+    "Do I need a dedicated graphics card?",
+    "How important is brand support?",
+]
+
+QUESTIONNAIRE = "\n\n".join(
+    f"{i}. {factor}\nA) Option one\nB) Option two\nC) Option three\nD) Option four"
+    for i, factor in enumerate(FACTORS, 1)
+)
+
+PRODUCT_LINE_RE = re.compile(r'^\s*\d+[.)]\s*(.+?)\s*-\s*(\$[\d,.]+)', re.MULTILINE)
+RUN_ID_RE = re.compile(r'^([AB]\d+)\.', re.MULTILINE)
+
+
+def ranking_response(request_text: str) -> str:
+    """Rank the products listed in the prompt in the order they were given"""
+    listed = request_text.split("User Preferences:")[0]
+    products = PRODUCT_LINE_RE.findall(listed) or [(f"Laptop {i}", f"${999 + i * 100}") for i in range(1, 11)]
+    return json.dumps({"ranked_products": [
+        {
+            "name": name,
+            "price": price,
+            "explanation": "Good balance of price and performance for the stated needs",
+            "advantages": ["Battery life", "Build quality", "Display"],
+            "why_not_first": "" if position == 0 else "Slightly more expensive for similar specs",
+            "product_caveats": ["Limited ports", "Average speakers"]
+        }
+        for position, (name, price) in enumerate(products)
+    ]})
+
+
+def merge_response(request_text: str) -> str:
+    """Interleave the two runs of a merge prompt"""
+    ids = RUN_ID_RE.findall(request_text)
+    left = [identifier for identifier in ids if identifier.startswith("A")]
+    right = [identifier for identifier in ids if identifier.startswith("B")]
+    order = []
+    for index in range(max(len(left), len(right))):
+        order.extend(run[index] for run in (left, right) if index < len(run))
+    return json.dumps({"order": order})
+
+
+def rerank_response(request_text: str) -> str:
+    """Swap the top two products of a delta re-rank prompt"""
+    ids = re.findall(r'^(P\d+)\.', request_text, re.MULTILINE)
+    order = ids[1::-1] + ids[2:]
+    updated = [{"id": identifier, "explanation": "Moved after your updated answers",
+                "why_not_first": "" if position == 0 else "Now ranked just below the new top pick"}
+               for position, identifier in enumerate(order[:2])]
+    return json.dumps({"order": order, "updated": updated})
+
+
+def load_responses(path: str) -> list:
+    """Read custom canned responses from a JSON file"""
+    if not path:
+        return []
+    with open(path) as f:
+        return [(entry["match"], entry["response"]) for entry in json.load(f)]
+
+
+def canned_response(messages: list, custom: list = ()) -> str:
+    """Pick a response shaped like what the engine expects for this prompt"""
+    prompt = messages[0].get("content", "") if messages else ""
+    request_text = "\n".join(message.get("content", "") for message in messages[1:])
+    for match, response in custom:
+        if match in prompt:
+            return response
+    if "### FACTORS" in prompt:
+        return f"### FACTORS\n{'*'.join(FACTORS)}\n### QUESTIONNAIRE\n{QUESTIONNAIRE}"
+    if '"updated"' in prompt:
+        return rerank_response(request_text)
+    if '"order"' in prompt:
+        return merge_response(request_text)
+    if "product ranking expert" in prompt:
+        return ranking_response(request_text)
+    if "questionnaire" in prompt:
+        return QUESTIONNAIRE
+    if "recommend by name and price" in prompt:
+        return "\n".join(PRODUCTS)
+    return "*".join(FACTORS)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def parse_model_speeds(spec: str) -> dict:
+    """Parse "model=tokens_per_second,..." into a dict"""
+    speeds = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, speed = entry.partition("=")
+        speeds[model.strip()] = float(speed)
+    return speeds
+
+
+def apply_limits(content: str, max_tokens: int = None, stop=None) -> tuple:
+    """Cut a response at the first stop sequence and at max_tokens, returning it with its finish reason"""
+    for sequence in ([stop] if isinstance(stop, str) else stop or []):
+        index = content.find(sequence)
+        if index != -1:
+            content = content[:index]
+    if max_tokens and estimate_tokens(content) > max_tokens:
+        return content[:max_tokens * 4], "length"
+    return content, "stop"
+
+
+class LatencyModel:
+    """Time-to-first-token distribution with an optional slow tail"""
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, distribution: str = FAKE_LLM_DISTRIBUTION,
+                 jitter: float = FAKE_LLM_JITTER, sigma: float = FAKE_LLM_SIGMA,
+                 tail_probability: float = FAKE_LLM_TAIL_PROBABILITY, tail_latency: float = FAKE_LLM_TAIL_LATENCY):
+        if distribution not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency = latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.sigma = sigma
+        self.tail_probability = tail_probability
+        self.tail_latency = tail_latency
+
+    def sample(self) -> float:
+        if self.tail_probability and random.random() < self.tail_probability:
+            return self.tail_latency
+        if self.distribution == "uniform":
+            return max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+        if self.distribution == "lognormal":
+            return random.lognormvariate(math.log(max(self.latency, 1e-3)), self.sigma)
+        return self.latency
+
+
+class FakeLLM:
+    """Canned-response model with simulated latency, errors and token accounting"""
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 latency_model: LatencyModel = None, error_rate: float = FAKE_LLM_ERROR_RATE,
+                 chunk_size: int = FAKE_LLM_CHUNK_SIZE, responses: list = None,
+                 prefill_tokens_per_second: float = FAKE_LLM_PREFILL_TOKENS_PER_SECOND,
+                 prefix_cache: bool = FAKE_LLM_PREFIX_CACHE, model_speeds: dict = None):
+        self.latency_model = latency_model or LatencyModel(latency)
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prefix_cache = prefix_cache
+        self.model_speeds = model_speeds if model_speeds is not None else parse_model_speeds(FAKE_LLM_MODEL_TOKENS_PER_SECOND)
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.responses = responses if responses is not None else load_responses(FAKE_LLM_RESPONSES)
+        self.reset()
+
+    @property
+    def latency(self) -> float:
+        """A fresh time-to-first-token sample"""
+        return self.latency_model.sample()
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.generated_tokens = 0
+        self.aborted = 0
+        self.prefixes = set()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "generated_tokens": self.generated_tokens,
+            "aborted": self.aborted,
+        }
+
+    def speed(self, model: str) -> float:
+        return self.model_speeds.get(model, self.tokens_per_second)
+
+    def prefill_time(self, usage: dict) -> float:
+        if not self.prefill_tokens_per_second:
+            return 0.0
+        return usage["prompt_cache_miss_tokens"] / self.prefill_tokens_per_second
+
+    def injected_error(self):
+        """An OpenAI-style error response for a share of requests, or None"""
+        if not self.error_rate or random.random() >= self.error_rate:
+            return None
+        self.errors += 1
+        status, kind = random.choice([(429, "rate_limit_exceeded"), (500, "server_error")])
+        return JSONResponse({"error": {"message": "Injected fake LLM error", "type": kind, "code": kind}},
+                            status_code=status)
+
+    def cached_tokens(self, messages: list) -> int:
+        """Tokens of the longest run of leading messages seen before, remembering this prompt's prefixes"""
+        digest = hashlib.sha256()
+        cached = tokens = 0
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content", "")]).encode("utf-8"))
+            tokens += estimate_tokens(message.get("content", ""))
+            prefix = digest.copy().hexdigest()
+            if prefix in self.prefixes:
+                cached = tokens
+            self.prefixes.add(prefix)
+        return cached
+
+    def account(self, messages: list, content: str) -> dict:
+        prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in messages)
+        cached = self.cached_tokens(messages) if self.prefix_cache else 0
+        completion_tokens = estimate_tokens(content)
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_prompt_tokens += cached
+        self.completion_tokens += completion_tokens
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": cached, "prompt_cache_miss_tokens": prompt_tokens - cached}
+
+
+def create_app(llm: FakeLLM = None) -> FastAPI:
+    llm = llm or FakeLLM()
+    app = FastAPI()
+    app.state.llm = llm
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = llm.injected_error()
+        if error is not None:
+            await asyncio.sleep(llm.latency)
+            return error
+        messages = body.get("messages", [])
+        content, finish_reason = apply_limits(canned_response(messages, llm.responses),
+                                              body.get("max_tokens"), body.get("stop"))
+        usage = llm.account(messages, content)
+        model = body.get("model", "fake-model")
+        tokens_per_second = llm.speed(model)
+        created = int(time.time())
+
+        if not body.get("stream"):
+            first_token = llm.latency + llm.prefill_time(usage)
+            finished = time.monotonic() + first_token + usage["completion_tokens"] / tokens_per_second
+            while time.monotonic() < finished:
+                await asyncio.sleep(min(finished - time.monotonic(), 0.1))
+                if await request.is_disconnected():
+                    generating = max(time.monotonic() - (finished - usage["completion_tokens"] / tokens_per_second), 0)
+                    llm.aborted += 1
+                    llm.generated_tokens += int(generating * tokens_per_second)
+                    return JSONResponse({}, status_code=499)
+            llm.generated_tokens += usage["completion_tokens"]
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        async def stream():
+            await asyncio.sleep(llm.latency + llm.prefill_time(usage))
+            # Roughly one token per four characters, sent in small bursts
+            chunk_size = llm.chunk_size
+            sent = 0
+            try:
+                for start in range(0, len(content), chunk_size):
+                    delta = content[start:start + chunk_size]
+                    chunk = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    sent += len(delta)
+                    await asyncio.sleep(estimate_tokens(delta) / tokens_per_second)
+            except BaseException:
+                llm.aborted += 1
+                llm.generated_tokens += sent // 4
+                raise
+            llm.generated_tokens += usage["completion_tokens"]
+            # Usage rides on a final chunk without choices, as DeepSeek sends it
+            final = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return llm.stats()
+
+    return app
+
+
+class BackgroundServer:
+    """Run a fake LLM server on a local port in a daemon thread"""
+
+    def __init__(self, port: int, llm: FakeLLM = None):
+        self.llm = llm or FakeLLM()
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        config = uvicorn.Config(create_app(self.llm), host="127.0.0.1", port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible fake LLM server")
+    parser.add_argument("port", nargs="?", type=int, default=9911)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=FAKE_LLM_LATENCY, help="time to first token in seconds (median for lognormal)")
+    parser.add_argument("--distribution", choices=["constant", "uniform", "lognormal"], default=FAKE_LLM_DISTRIBUTION)
+    parser.add_argument("--jitter", type=float, default=FAKE_LLM_JITTER)
+    parser.add_argument("--sigma", type=float, default=FAKE_LLM_SIGMA)
+    parser.add_argument("--tail-probability", type=float, default=FAKE_LLM_TAIL_PROBABILITY)
+    parser.add_argument("--tail-latency", type=float, default=FAKE_LLM_TAIL_LATENCY)
+    parser.add_argument("--tokens-per-second", type=float, default=FAKE_LLM_TOKENS_PER_SECOND)
+    parser.add_argument("--error-rate", type=float, default=FAKE_LLM_ERROR_RATE)
+    parser.add_argument("--chunk-size", type=int, default=FAKE_LLM_CHUNK_SIZE)
+    parser.add_argument("--responses", default=FAKE_LLM_RESPONSES, help="JSON file of custom canned responses")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=FAKE_LLM_PREFILL_TOKENS_PER_SECOND)
+    parser.add_argument("--model-tokens-per-second", default=FAKE_LLM_MODEL_TOKENS_PER_SECOND,
+                        help='per-model speeds, e.g. "fast-chat=600,deepseek-chat=200"')
+    parser.add_argument("--no-prefix-cache", dest="prefix_cache", action="store_false", default=FAKE_LLM_PREFIX_CACHE)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    llm = FakeLLM(
+        tokens_per_second=args.tokens_per_second,
+        latency_model=LatencyModel(args.latency, args.distribution, args.jitter, args.sigma,
+                                   args.tail_probability, args.tail_latency),
+        error_rate=args.error_rate,
+        chunk_size=args.chunk_size,
+        responses=load_responses(args.responses),
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        prefix_cache=args.prefix_cache,
+        model_speeds=parse_model_speeds(args.model_tokens_per_second),
+    )
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,100 @@
+"""
+Record/replay of LLM completions for deterministic engine benchmarks.
+
+In record mode every upstream completion made by the engine is appended to a
+gzipped JSON-lines fixture as {key, elapsed, response}, where key is the
+completion_key of the request. In replay mode the engine never calls the API:
+completions are served from the fixture in recorded order per key, after the
+recorded upstream time multiplied by a scale factor (0 replays instantly, so
+only our own parsing, validation and routing code is measured).
+"""
+import os
+import gzip
+import json
+import asyncio
+import threading
+from collections import defaultdict, deque
+from typing import Optional
+
+# off, record or replay
+LLM_FIXTURES_MODE = os.getenv("LLM_FIXTURES_MODE", "off")
+LLM_FIXTURES_PATH = os.getenv("LLM_FIXTURES_PATH", "llm_fixtures.jsonl.gz")
+# Multiplier for recorded upstream timings during replay
+LLM_FIXTURES_TIME_SCALE = float(os.getenv("LLM_FIXTURES_TIME_SCALE", "1.0"))
+
+
+class FixtureMissing(KeyError):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+class CompletionFixtures:
+    """A fixture file of recorded completions, opened for recording or replay"""
+
+    def __init__(self, path: str, mode: str, time_scale: float = LLM_FIXTURES_TIME_SCALE):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown fixtures mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        self.recorded = 0
+        self.replayed = 0
+        if mode == "replay":
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append((entry["elapsed"], entry["response"]))
+
+    def record(self, key: str, response: str, elapsed: float):
+        line = json.dumps({"key": key, "elapsed": round(elapsed, 4), "response": response}, ensure_ascii=False)
+        with self._lock:
+            # Every write is its own gzip member, which gzip readers concatenate transparently
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+    def next(self, key: str) -> tuple:
+        """The next recorded (elapsed, response) for a key, cycling when replayed more often than recorded"""
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise FixtureMissing(f"No recorded completion for key {key[:12]} in {self.path}")
+            entry = recorded.popleft()
+            recorded.append(entry)
+            self.replayed += 1
+            return entry
+
+    async def replay(self, key: str) -> str:
+        elapsed, response = self.next(key)
+        if self.time_scale > 0:
+            await asyncio.sleep(elapsed * self.time_scale)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "keys": len(self._entries),
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+        }
+
+
+def fixtures_from_env() -> Optional[CompletionFixtures]:
+    """The fixtures configured by LLM_FIXTURES_MODE, or None when disabled"""
+    if LLM_FIXTURES_MODE == "off":
+        return None
+    return CompletionFixtures(LLM_FIXTURES_PATH, LLM_FIXTURES_MODE)
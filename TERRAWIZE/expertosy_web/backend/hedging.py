@@ -0,0 +1,236 @@
+"""
+Per-endpoint deadlines and hedged upstream calls.
+
+Upstream latency has a long tail (p50 of a few seconds, p99 many times that),
+so waiting on a single request lets one slow call dominate a user's wait. Each
+endpoint gets a deadline budget shared by every LLM call it makes; a call that
+has not finished by the hedge delay gets a duplicate request, the first result
+wins and the loser is cancelled. The hedge delay follows a percentile of a
+decaying latency histogram kept per endpoint, so only the slowest few percent
+of calls are duplicated even as upstream latency drifts.
+"""
+import os
+import time
+import asyncio
+import bisect
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+from admission import UpstreamUnavailable
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# Used until an endpoint has HEDGE_MIN_SAMPLES observations, and the longest delay ever used
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+# Counts are halved every this many samples so the histogram tracks recent latency
+HEDGE_HISTOGRAM_HALF_LIFE = int(os.getenv("HEDGE_HISTOGRAM_HALF_LIFE", "500"))
+DEADLINE_DEFAULT = float(os.getenv("DEADLINE_DEFAULT", "60"))
+
+# Log-spaced bucket upper bounds from 50 ms to about 3 minutes
+BUCKET_BOUNDS = [0.05 * 1.25 ** index for index in range(38)]
+
+# Absolute monotonic deadline and endpoint of the request being served
+current_deadline: contextvars.ContextVar = contextvars.ContextVar("llm_deadline", default=None)
+current_endpoint: contextvars.ContextVar = contextvars.ContextVar("llm_endpoint", default="default")
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """Raised when an endpoint's deadline budget runs out before the LLM answers"""
+    status_code = 504
+
+    def __init__(self, endpoint: str, budget: float):
+        super().__init__(f"LLM deadline of {budget:g}s exceeded for {endpoint}", budget / 2)
+
+
+@contextmanager
+def deadline_scope(endpoint: str, budget: Optional[float]):
+    """Give every LLM call in the block a shared deadline budget"""
+    deadline_token = current_deadline.set((time.monotonic() + budget, budget) if budget else None)
+    endpoint_token = current_endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        current_deadline.reset(deadline_token)
+        current_endpoint.reset(endpoint_token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline[0] - time.monotonic()
+
+
+class DeadlineMiddleware:
+    """ASGI middleware applying a deadline budget per path; paths not listed get the default"""
+
+    def __init__(self, app, deadlines: dict, default: float = DEADLINE_DEFAULT):
+        self.app = app
+        # Exact paths only, so /rank-products/stream does not inherit the budget of /rank-products
+        self.deadlines = dict(deadlines)
+        self.default = default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        with deadline_scope(path, self.deadlines.get(path, self.default)):
+            await self.app(scope, receive, send)
+
+
+class LatencyHistogram:
+    """Decaying log-bucket histogram of call latencies"""
+
+    def __init__(self, half_life: int = HEDGE_HISTOGRAM_HALF_LIFE):
+        self.half_life = half_life
+        self.counts = [0.0] * (len(BUCKET_BOUNDS) + 1)
+        self.samples = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.samples += 1
+        if self.samples % self.half_life == 0:
+            self.counts = [count / 2 for count in self.counts]
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given fraction of observations"""
+        total = sum(self.counts)
+        if not total:
+            return None
+        threshold, cumulative = total * fraction, 0.0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return BUCKET_BOUNDS[min(index, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+
+class Hedger:
+    """Run upstream calls under the current deadline, hedging the slow ones"""
+
+    def __init__(self, enabled: bool = HEDGE_ENABLED, percentile: float = HEDGE_PERCENTILE):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.histograms = {}
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def hedge_delay(self, endpoint: str) -> float:
+        histogram = self.histograms.get(endpoint)
+        if histogram is None or histogram.samples < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(histogram.percentile(self.percentile), HEDGE_MIN_DELAY), HEDGE_DEFAULT_DELAY)
+
+    async def call(self, fn: Callable[[Optional[float], Callable[[], None]], Awaitable[Any]]) -> Any:
+        """
+        Await fn(timeout, sent) and return its result, hedging with a second fn call past the hedge delay.
+
+        fn receives the seconds left in the deadline budget so the SDK request can be bounded too, and calls
+        sent() once it has an admission slot and goes upstream. The hedge delay counts from there, so time
+        spent queueing for admission never triggers a hedge.
+        """
+        endpoint = current_endpoint.get()
+        deadline = current_deadline.get()
+        self.calls += 1
+        delay = self.hedge_delay(endpoint)
+        sent_at = None
+        sent = asyncio.Event()
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else deadline[0] - time.monotonic()
+
+        def primary_sent():
+            nonlocal sent_at
+            sent_at = time.monotonic()
+            sent.set()
+
+        if remaining() is not None and remaining() <= 0:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(endpoint, deadline[1])
+
+        primary = self._start(fn, remaining(), primary_sent)
+        pending = {primary}
+        hedge = sent_wait = None
+        try:
+            while True:
+                wait_for = remaining()
+                waiting = set(pending)
+                if self.enabled and hedge is None:
+                    if sent_at is None:
+                        if sent_wait is None:
+                            sent_wait = asyncio.ensure_future(sent.wait())
+                        waiting.add(sent_wait)
+                    else:
+                        hedge_at = delay - (time.monotonic() - sent_at)
+                        wait_for = hedge_at if wait_for is None else min(wait_for, hedge_at)
+                done, _ = await asyncio.wait(
+                    waiting, timeout=max(wait_for, 0) if wait_for is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                done.discard(sent_wait)
+                pending -= done
+                for task in done:
+                    if task.exception() is None:
+                        # The primary's own time upstream, even when the hedge won: by then the primary has
+                        # taken at least this long, and recording only winners would drag the delay down
+                        if sent_at is not None:
+                            self._record(endpoint, time.monotonic() - sent_at)
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                if done and not pending:
+                    # Every attempt failed: surface the primary's error
+                    raise primary.exception()
+
+                if remaining() is not None and remaining() <= 0:
+                    self.deadline_exceeded += 1
+                    raise DeadlineExceeded(endpoint, deadline[1])
+                if (self.enabled and hedge is None and not done and sent_at is not None
+                        and time.monotonic() - sent_at >= delay):
+                    self.hedged += 1
+                    hedge = self._start(fn, remaining(), lambda: None)
+                    pending.add(hedge)
+        finally:
+            for task in (primary, hedge, sent_wait):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _start(fn: Callable, timeout: Optional[float], sent: Callable[[], None]) -> asyncio.Future:
+        task = asyncio.ensure_future(fn(timeout, sent))
+        # A losing attempt's failure is irrelevant once the other one answered
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def _record(self, endpoint: str, seconds: float):
+        histogram = self.histograms.get(endpoint)
+        if histogram is None:
+            histogram = self.histograms[endpoint] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "endpoints": {
+                endpoint: {
+                    "samples": histogram.samples,
+                    "p50": histogram.percentile(0.5),
+                    "p95": histogram.percentile(0.95),
+                    "p99": histogram.percentile(0.99),
+                    "hedge_delay": self.hedge_delay(endpoint),
+                }
+                for endpoint, histogram in self.histograms.items()
+            },
+        }
+
+
+# Process-wide hedger shared by every engine
+hedger = Hedger()
@@ -0,0 +1,267 @@
+"""
+Asynchronous jobs for long-running requests.
+
+Ranking and recommendation calls can take most of a minute upstream. In job
+mode the request only validates its input and queues the work: it returns a
+job id at once, a bounded pool of asyncio workers runs the queued jobs, and the
+client polls GET /jobs/<id>, optionally long-polling with ?wait=<seconds> until
+the job finishes. Jobs can be cancelled while queued or running, and finished
+jobs are dropped JOB_RESULT_TTL seconds after they finish.
+
+A job runs in a copy of the submitting request's context, so it keeps that
+request's LLM priority, but under its own JOB_DEADLINE budget instead of the
+interactive deadline. Jobs live in the worker process that accepted them, like
+speculative questionnaires; deployments running several workers need sticky
+routing for /jobs.
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable
+
+from admission import UpstreamUnavailable, LLM_MAX_CONCURRENCY
+from hedging import deadline_scope
+
+logger = logging.getLogger(__name__)
+
+# Running more jobs than the LLM concurrency limit would only move the wait into the admission queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(LLM_MAX_CONCURRENCY)))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "200"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+# LLM deadline budget of a job, shared by every call it makes
+JOB_DEADLINE = float(os.getenv("JOB_DEADLINE", "240"))
+# Longest a single long-poll request waits for a job to finish
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobNotFound(KeyError):
+    """Raised for an unknown or expired job id"""
+
+
+class JobQueueFull(UpstreamUnavailable):
+    """Raised when a job is submitted while JOB_MAX_QUEUED jobs are already waiting"""
+
+    def __init__(self, queued: int, retry_after: float):
+        super().__init__(f"Job queue is full ({queued} jobs waiting)", retry_after)
+
+
+class Job:
+    __slots__ = ("id", "kind", "status", "result", "error", "status_code", "created_at", "started_at",
+                 "finished_at", "_fn", "_context", "_task", "_done")
+
+    def __init__(self, kind: str, fn: Callable[[], Awaitable[Any]], context: contextvars.Context):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._fn = fn
+        self._context = context
+        self._task = None
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def _finish(self, status: str):
+        self.status = status
+        self.finished_at = time.monotonic()
+        self._fn = self._context = self._task = None
+        self._done.set()
+
+    def to_dict(self) -> dict:
+        job = {"job_id": self.id, "kind": self.kind, "status": self.status}
+        if self.started_at is not None:
+            job["queued_seconds"] = round(self.started_at - self.created_at, 3)
+        if self.finished_at is not None and self.started_at is not None:
+            job["run_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.status == SUCCEEDED:
+            job["result"] = self.result
+        elif self.status == FAILED:
+            job["error"] = self.error
+            job["status_code"] = self.status_code
+        if self.finished:
+            job["expires_in"] = round(max(self.finished_at + JOB_RESULT_TTL - time.monotonic(), 0.0), 3)
+        return job
+
+
+class JobManager:
+    """Queue jobs, run them on a bounded pool of asyncio workers and keep their results until they expire"""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_MAX_QUEUED, ttl: float = JOB_RESULT_TTL,
+                 deadline: float = JOB_DEADLINE):
+        self.workers = max(workers, 1)
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.deadline = deadline
+        self._jobs = OrderedDict()
+        self._queue = deque()
+        self._wakeup = None
+        self._workers = []
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.expired = 0
+
+    def submit(self, kind: str, endpoint: str, fn: Callable[[], Awaitable[Any]]) -> Job:
+        """Queue fn, whose LLM calls are accounted to endpoint, and return its job at once"""
+        self._sweep()
+        if len(self._queue) >= self.max_queued:
+            self.rejected += 1
+            raise JobQueueFull(len(self._queue), self._retry_after())
+
+        async def run():
+            with deadline_scope(endpoint, self.deadline):
+                return await fn()
+
+        job = Job(kind, run, contextvars.copy_context())
+        self._jobs[job.id] = job
+        self._queue.append(job)
+        self.submitted += 1
+        self._ensure_workers()
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        self._sweep()
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Job:
+        """The job once it has finished, or as it is after timeout seconds"""
+        job = self.get(job_id)
+        if not job.finished and timeout > 0:
+            try:
+                await asyncio.wait_for(job._done.wait(), min(timeout, JOB_MAX_WAIT))
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def cancel(self, job_id: str) -> Job:
+        """Cancel a queued or running job; finished jobs are dropped instead"""
+        job = self.get(job_id)
+        if job.status == QUEUED:
+            self._queue.remove(job)
+            self.cancelled += 1
+            job._finish(CANCELLED)
+        elif job.status == RUNNING:
+            job._task.cancel()
+            # The worker records the cancellation once the task has unwound, which is normally immediate
+            await self.wait(job_id, 1.0)
+        else:
+            del self._jobs[job_id]
+        return job
+
+    def _ensure_workers(self):
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        if not self._workers:
+            self._wakeup = asyncio.Event()
+        # Workers start in an empty context so they do not inherit the first submitter's request state
+        empty = contextvars.Context()
+        while len(self._workers) < self.workers:
+            self._workers.append(empty.run(asyncio.get_running_loop().create_task, self._work()))
+
+    async def _work(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._run(self._queue.popleft())
+
+    async def _run(self, job: Job):
+        job.status = RUNNING
+        job.started_at = time.monotonic()
+        self.running += 1
+        # create_task copies the current context, so running it inside the job's context hands that to the task
+        task = job._task = job._context.run(asyncio.get_running_loop().create_task, job._fn())
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            self.running -= 1
+        if job.finished:
+            # Already recorded by close()
+            return
+        if task.cancelled():
+            self.cancelled += 1
+            job._finish(CANCELLED)
+        elif task.exception() is not None:
+            error = task.exception()
+            self.failed += 1
+            job.error = str(error)
+            job.status_code = getattr(error, "status_code", 500)
+            logger.error(f"Job {job.id} ({job.kind}) failed: {error}")
+            job._finish(FAILED)
+        else:
+            self.succeeded += 1
+            job.result = task.result()
+            job._finish(SUCCEEDED)
+
+    def _retry_after(self) -> float:
+        """Rough time until the queue drains, from the mean run time of recent jobs"""
+        runs = [job.finished_at - job.started_at for job in list(self._jobs.values())[-50:]
+                if job.finished_at is not None and job.started_at is not None]
+        mean = sum(runs) / len(runs) if runs else 10.0
+        return mean * len(self._queue) / self.workers
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.expired += len(expired)
+
+    def close(self):
+        """Cancel queued and running jobs and stop the workers"""
+        for job in self._jobs.values():
+            if job.status == RUNNING:
+                job._task.cancel()
+            if not job.finished:
+                self.cancelled += 1
+                job._finish(CANCELLED)
+        self._queue.clear()
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": len(self._queue),
+            "running": self.running,
+            "retained": len(self._jobs),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "expired": self.expired,
+        }
+
+
+# Process-wide job manager
+jobs = JobManager()
@@ -0,0 +1,146 @@
+"""
+Process-wide async LLM clients.
+
+Every engine shares one AsyncOpenAI client per upstream backend, each backed by
+its own httpx connection pool, so TLS handshakes to the upstream API are paid
+once per connection rather than once per request. Pool limits are tunable
+through environment variables.
+
+LLM_BACKENDS lists the OpenAI-compatible backends calls can be routed to (see
+router.py), as a JSON list such as
+[{"name": "deepseek", "base_url": "https://api.deepseek.com", "api_key_env": "DEEPSEEK_API_KEY"},
+ {"name": "backup", "base_url": "https://llm.example.com/v1", "api_key_env": "BACKUP_API_KEY",
+  "models": {"deepseek-chat": "backup-chat"}}]
+where "models" maps profile model names to the backend's own. Without it there
+is a single backend, LLM_BASE_URL with DEEPSEEK_API_KEY.
+"""
+import os
+import json
+import logging
+import weakref
+from typing import Dict, List
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+
+
+def parse_backends(spec: str) -> List[dict]:
+    """Backend configs from LLM_BACKENDS, or the single LLM_BASE_URL backend"""
+    default = [{"name": "default", "base_url": LLM_BASE_URL, "api_key_env": "DEEPSEEK_API_KEY", "models": {}}]
+    if not spec:
+        return default
+    try:
+        backends = [
+            {"name": entry["name"], "base_url": entry["base_url"],
+             "api_key_env": entry.get("api_key_env", "DEEPSEEK_API_KEY"), "models": entry.get("models", {})}
+            for entry in json.loads(spec)
+        ]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Ignoring invalid LLM_BACKENDS: {e}")
+        return default
+    return backends or default
+
+
+BACKENDS = {backend["name"]: backend for backend in parse_backends(LLM_BACKENDS)}
+
+
+class PoolStatsTransport(httpx.AsyncHTTPTransport):
+    """httpx transport that counts requests and newly opened connections"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.failed_requests = 0
+        self.connections_opened = 0
+        self._seen_connections = weakref.WeakSet()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        try:
+            return await super().handle_async_request(request)
+        except Exception:
+            self.failed_requests += 1
+            raise
+        finally:
+            self._track_new_connections()
+
+    def _track_new_connections(self):
+        # httpx does not expose its httpcore pool publicly, but the pool's
+        # connection list is the only reliable signal of a fresh handshake.
+        for connection in self._pool.connections:
+            if connection not in self._seen_connections:
+                self._seen_connections.add(connection)
+                self.connections_opened += 1
+
+    def stats(self) -> dict:
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "requests": self.requests,
+            "failed_requests": self.failed_requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests - self.connections_opened, 0),
+            "open_connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "limits": {
+                "max_connections": LLM_MAX_CONNECTIONS,
+                "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry": LLM_KEEPALIVE_EXPIRY,
+            },
+        }
+
+
+# backend name -> (client, transport)
+_clients: Dict[str, tuple] = {}
+
+
+def get_llm_client(backend: str = None) -> AsyncOpenAI:
+    """Return the shared AsyncOpenAI client of a backend (the first one by default), creating it on first use"""
+    name = backend or next(iter(BACKENDS))
+    if name not in _clients:
+        config = BACKENDS[name]
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+        transport = PoolStatsTransport(limits=limits)
+        client = AsyncOpenAI(
+            api_key=os.getenv(config["api_key_env"], ""),
+            base_url=config["base_url"],
+            timeout=LLM_TIMEOUT,
+            # With somewhere else to go, the router falls back to another backend instead of retrying this one
+            max_retries=LLM_MAX_RETRIES if len(BACKENDS) == 1 else 0,
+            http_client=httpx.AsyncClient(transport=transport, timeout=LLM_TIMEOUT),
+        )
+        _clients[name] = (client, transport)
+        logger.info(
+            f"Created shared LLM client for {config['base_url']} "
+            f"(max_connections={LLM_MAX_CONNECTIONS}, max_keepalive={LLM_MAX_KEEPALIVE_CONNECTIONS})"
+        )
+    return _clients[name][0]
+
+
+async def close_llm_client():
+    """Close the shared clients and their connection pools"""
+    for client, _ in list(_clients.values()):
+        await client.close()
+    _clients.clear()
+
+
+def pool_stats() -> dict:
+    """Connection pool statistics for the shared client of each backend"""
+    if not _clients:
+        return {"initialized": False}
+    return {"initialized": True, "backends": {name: transport.stats() for name, (_, transport) in _clients.items()}}
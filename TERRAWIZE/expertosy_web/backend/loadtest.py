@@ -0,0 +1,355 @@
+"""
+Offline load test for the backend routes.
+
+Starts the fake LLM server and the backend (uvicorn with N workers) as local
+subprocesses, then drives every route open-loop at a target request rate:
+requests are fired on schedule whether or not earlier ones have finished, so
+queueing shows up as latency instead of silently lowering the offered load.
+Reports throughput, p50/p95/p99 latency and error rate per route, plus the
+resident memory of every worker process. Nothing leaves the machine.
+
+Usage: python loadtest.py --rps 20 --duration 30 --workers 2 [--routes rank-products,bootstrap]
+       python loadtest.py --url http://127.0.0.1:8080 --pid <uvicorn pid>   # existing deployment
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import itertools
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+
+import httpx
+
+from fake_llm_server import PRODUCTS, FACTORS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = ["laptop", "gaming laptop", "ultrabook", "tablet", "smartphone", "headphones",
+           "monitor", "camera", "smartwatch", "e-reader", "desktop pc", "router"]
+
+
+def scenarios(unique: bool) -> dict:
+    """Request builders per route; unique queries defeat the caches so every call reaches the LLM"""
+    counter = itertools.count()
+
+    def query() -> str:
+        index = next(counter)
+        base = QUERIES[index % len(QUERIES)]
+        return f"{base} model {index}" if unique else base
+
+    def products() -> list:
+        if not unique:
+            return PRODUCTS
+        index = next(counter)
+        return [line.replace(" - ", f" Gen {index} - ", 1) for line in PRODUCTS]
+
+    def preferences() -> dict:
+        index = next(counter)
+        budget = "A) Under $1500" if index % 2 else "B) $1500 - $2500"
+        return {"What is my budget?": budget, "What will I mainly use it for?": f"C) Work {index if unique else ''}".strip()}
+
+    return {
+        "health": ("GET", "/health", lambda: None),
+        "generate-factors": ("POST", "/generate-factors", lambda: {"search_query": query()}),
+        "create-questionnaire": ("POST", "/create-questionnaire", lambda: {"search_query": query(), "factors": FACTORS}),
+        "create-questionnaire-stream": ("POST", "/create-questionnaire/stream", lambda: {"search_query": query(), "factors": FACTORS}),
+        "bootstrap": ("POST", "/bootstrap", lambda: {"search_query": query()}),
+        "generate-recommendation": ("POST", "/generate-recommendation",
+                                    lambda: {"search_query": query(), "user_preferences": preferences()}),
+        "generate-ranking-questionnaire": ("POST", "/generate-ranking-questionnaire",
+                                           lambda: {"search_query": query(), "products": products()}),
+        "rank-products": ("POST", "/rank-products", lambda: {"products": PRODUCTS, "ranking_preferences": preferences()}),
+        "rank-products-stream": ("POST", "/rank-products/stream",
+                                 lambda: {"products": PRODUCTS, "ranking_preferences": preferences()}),
+        "rank-products-local": ("POST", "/rank-products/local",
+                                lambda: {"products": PRODUCTS, "ranking_preferences": preferences()}),
+        "rank-products-fast": ("POST", "/rank-products/fast",
+                               lambda: {"products": PRODUCTS, "ranking_preferences": preferences()}),
+    }
+
+
+def child_pids(pid: int) -> list:
+    """Direct children of a process, read from /proc"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid follows the closing parenthesis
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return children
+
+
+def is_helper_process(pid: int) -> bool:
+    """multiprocessing's resource tracker is a child of the server but not a worker"""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"resource_tracker" in f.read()
+    except OSError:
+        return True
+
+
+def rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class MemorySampler:
+    """Periodically sample the RSS of a server's worker processes"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak = defaultdict(float)
+        self.last = {}
+
+    def sample(self):
+        workers = [pid for pid in child_pids(self.pid) if not is_helper_process(pid)] or [self.pid]
+        self.last = {pid: rss_mb(pid) for pid in workers}
+        for pid, rss in self.last.items():
+            self.peak[pid] = max(self.peak[pid], rss)
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+async def fire(client: httpx.AsyncClient, name: str, method: str, path: str, body, results: dict):
+    started = time.perf_counter()
+    try:
+        if method == "GET":
+            response = await client.get(path)
+        else:
+            # Read streamed responses to the end so their full duration is measured
+            async with client.stream(method, path, json=body) as response:
+                payload = await response.aread()
+            if response.status_code == 200 and b"event: error" in payload:
+                raise RuntimeError("stream error event")
+        ok = response.status_code < 400
+        status = response.status_code
+    except Exception as e:
+        ok, status = False, type(e).__name__
+    results[name].append((time.perf_counter() - started, ok, status))
+
+
+async def drive(base_url: str, routes: list, rps: float, duration: float, unique: bool,
+                sampler: MemorySampler = None, timeout: float = 120) -> tuple:
+    """Fire requests round-robin over routes at a fixed rate and collect (latency, ok, status) per route"""
+    builders = scenarios(unique)
+    results = defaultdict(list)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    sampler_task = asyncio.ensure_future(sampler.run()) if sampler else None
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        tasks = []
+        total = int(rps * duration)
+        started = time.perf_counter()
+        for index in range(total):
+            delay = started + index / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = routes[index % len(routes)]
+            method, path, build = builders[name]
+            tasks.append(asyncio.ensure_future(fire(client, name, method, path, build(), results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    if sampler_task:
+        sampler_task.cancel()
+        sampler.sample()
+    return results, elapsed
+
+
+def report(results: dict, elapsed: float, sampler: MemorySampler = None, llm_stats: dict = None) -> dict:
+    """Summarise results per route and overall"""
+    summary = {"elapsed": round(elapsed, 2), "routes": {}}
+    every = []
+    for name, samples in sorted(results.items()):
+        latencies = sorted(latency for latency, ok, _ in samples if ok)
+        errors = [status for _, ok, status in samples if not ok]
+        every.extend(samples)
+        summary["routes"][name] = {
+            "requests": len(samples),
+            "error_rate": round(len(errors) / len(samples), 4),
+            "errors": dict(sorted((str(status), errors.count(status)) for status in set(errors))),
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "mean": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        }
+    latencies = sorted(latency for latency, ok, _ in every if ok)
+    failed = sum(1 for _, ok, _ in every if not ok)
+    summary["overall"] = {
+        "requests": len(every),
+        "throughput_rps": round((len(every) - failed) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(failed / len(every), 4) if every else 0.0,
+        "p50": round(percentile(latencies, 0.50), 3),
+        "p95": round(percentile(latencies, 0.95), 3),
+        "p99": round(percentile(latencies, 0.99), 3),
+    }
+    if sampler:
+        summary["workers"] = {
+            str(pid): {"rss_mb": round(sampler.last.get(pid, 0.0), 1), "peak_rss_mb": round(peak, 1)}
+            for pid, peak in sorted(sampler.peak.items())
+        }
+    if llm_stats:
+        summary["llm"] = llm_stats
+    return summary
+
+
+def print_report(summary: dict):
+    print(f"\n{'route':<32}{'reqs':>6}{'err%':>7}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for name, route in summary["routes"].items():
+        print(f"{name:<32}{route['requests']:>6}{route['error_rate'] * 100:>6.1f}%"
+              f"{route['p50']:>8.3f}{route['p95']:>8.3f}{route['p99']:>8.3f}")
+    overall = summary["overall"]
+    print(f"{'overall':<32}{overall['requests']:>6}{overall['error_rate'] * 100:>6.1f}%"
+          f"{overall['p50']:>8.3f}{overall['p95']:>8.3f}{overall['p99']:>8.3f}")
+    print(f"\nthroughput: {overall['throughput_rps']} req/s over {summary['elapsed']}s")
+    for pid, worker in summary.get("workers", {}).items():
+        print(f"worker {pid}: {worker['rss_mb']} MB RSS (peak {worker['peak_rss_mb']} MB)")
+    if "llm" in summary:
+        print(f"fake LLM: {summary['llm']}")
+    for name, route in summary["routes"].items():
+        if route["errors"]:
+            print(f"errors on {name}: {route['errors']}")
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_stack(args, workdir: str) -> tuple:
+    """Launch the fake LLM server and the backend as subprocesses pointed at it"""
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "fake_llm_server.py"), str(args.llm_port),
+         "--latency", str(args.llm_latency), "--distribution", args.llm_distribution,
+         "--tail-probability", str(args.llm_tail_probability), "--tail-latency", str(args.llm_tail_latency),
+         "--tokens-per-second", str(args.llm_tokens_per_second), "--error-rate", str(args.llm_error_rate)],
+        cwd=HERE
+    )
+    env = dict(
+        os.environ,
+        LLM_BASE_URL=f"http://127.0.0.1:{args.llm_port}",
+        DEEPSEEK_API_KEY="fake",
+        RESPONSE_STORE_PATH=os.path.join(workdir, "responses.sqlite3"),
+        SINGLEFLIGHT_LOCK_DIR=os.path.join(workdir, "locks"),
+    )
+    # The app logs every prompt and response; keep that out of the report
+    log = open(os.path.join(workdir, "backend.log"), "w")
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:asgi_app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    wait_until_up(f"http://127.0.0.1:{args.llm_port}/stats")
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.port}/health")
+    except RuntimeError:
+        with open(log.name) as f:
+            print(f.read()[-4000:])
+        raise
+    # Let every worker finish importing before measuring
+    time.sleep(1.0)
+    return fake, backend
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for the Expertosy backend")
+    parser.add_argument("--rps", type=float, default=10, help="offered request rate across all routes")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--routes", default="", help="comma-separated subset of routes (default: all)")
+    parser.add_argument("--repeat-queries", action="store_true", help="reuse queries so cached paths are exercised")
+    parser.add_argument("--url", help="target an already running backend instead of starting one")
+    parser.add_argument("--pid", type=int, help="uvicorn/gunicorn master pid of --url, for worker memory")
+    parser.add_argument("--port", type=int, default=9800)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--llm-port", type=int, default=9801)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-distribution", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--llm-tail-probability", type=float, default=0.01)
+    parser.add_argument("--llm-tail-latency", type=float, default=5.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=400)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also write the summary to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list) -> int:
+    args = parse_args(argv)
+    available = scenarios(False)
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()] or list(available)
+    unknown = [route for route in routes if route not in available]
+    if unknown:
+        print(f"Unknown routes: {', '.join(unknown)}. Available: {', '.join(available)}")
+        return 2
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.url:
+                base_url, pid, llm_url = args.url, args.pid, None
+            else:
+                processes = list(start_stack(args, workdir))
+                base_url, pid = f"http://127.0.0.1:{args.port}", processes[1].pid
+                llm_url = f"http://127.0.0.1:{args.llm_port}/stats"
+
+            sampler = MemorySampler(pid) if pid else None
+            print(f"Driving {len(routes)} routes at {args.rps} req/s for {args.duration}s against {base_url}")
+            results, elapsed = asyncio.run(
+                drive(base_url, routes, args.rps, args.duration, not args.repeat_queries, sampler)
+            )
+            llm_stats = httpx.get(llm_url).json() if llm_url else None
+            summary = report(results, elapsed, sampler, llm_stats)
+        finally:
+            for process in reversed(processes):
+                stop(process)
+
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["overall"]["error_rate"] > 0 and not args.llm_error_rate else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
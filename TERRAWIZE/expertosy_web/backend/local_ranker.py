@@ -0,0 +1,140 @@
+"""
+Deterministic local ranking of "N. Name - $Price" product lines.
+
+Questionnaire answers are mapped to weighted features (price-range fit, budget
+vs premium leaning, words shared between the answer and the product name) and
+every product is scored in one pass over precomputed feature columns, so an
+ordering for thousands of products is available in milliseconds without any
+LLM call. The LLM is only needed afterwards to write explanation text.
+"""
+import re
+import math
+from typing import List, Optional, Tuple, Union
+
+from records import Product, parse_products
+
+OPTION_PREFIX_RE = re.compile(r'^\s*[A-D][).]\s*')
+MONEY = r'\$\s*([\d,]+(?:\.\d+)?)\s*(k)?'
+RANGE_RE = re.compile(MONEY + r'\s*(?:-|–|to)\s*\$?\s*([\d,]+(?:\.\d+)?)\s*(k)?', re.IGNORECASE)
+UNDER_RE = re.compile(r'(?:under|less than|below|up to|at most|max(?:imum)?)\s*' + MONEY, re.IGNORECASE)
+OVER_RE = re.compile(MONEY + r'\s*(?:or more|\+|and up|and above|or higher)', re.IGNORECASE)
+ABOVE_RE = re.compile(r'(?:over|more than|above|at least)\s*' + MONEY, re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+BUDGET_WORDS = {"price", "value", "budget", "affordable", "cheap", "cheaper", "cheapest", "cost", "money",
+                "save", "saving", "inexpensive", "economical", "deal"}
+PREMIUM_WORDS = {"premium", "performance", "powerful", "power", "flagship", "professional", "luxury",
+                 "best", "quality", "top", "highend", "high", "fastest"}
+STOP_WORDS = {"and", "the", "for", "with", "of", "or", "a", "an", "to", "in", "on", "is", "my", "i",
+              "more", "less", "than", "both", "balance", "between", "very", "most", "important", "not"}
+
+PRICE_RANGE_WEIGHT = 3.0
+NAME_MATCH_WEIGHT = 2.0
+PRICE_LEANING_WEIGHT = 1.0
+
+
+def _money(amount: str, thousands: Optional[str]) -> float:
+    value = float(amount.replace(',', ''))
+    return value * 1000 if thousands else value
+
+
+def parse_price_range(answer: str) -> Optional[Tuple[float, float]]:
+    """Extract the price range an answer asks for, if it mentions one"""
+    match = RANGE_RE.search(answer)
+    if match:
+        low, high = _money(match.group(1), match.group(2)), _money(match.group(3), match.group(4))
+        return (min(low, high), max(low, high))
+    match = UNDER_RE.search(answer)
+    if match:
+        return (0.0, _money(match.group(1), match.group(2)))
+    match = OVER_RE.search(answer) or ABOVE_RE.search(answer)
+    if match:
+        return (_money(match.group(1), match.group(2)), math.inf)
+    return None
+
+
+def _words(text: str) -> set:
+    return {word for word in WORD_RE.findall(text.lower().replace('-', '')) if word not in STOP_WORDS and len(word) > 1}
+
+
+def _price_fit(price: Optional[float], price_range: Tuple[float, float]) -> float:
+    if price is None:
+        return 0.0
+    low, high = price_range
+    if low <= price <= high:
+        return 1.0
+    width = max((high if high != math.inf else low) * 0.25, 1.0)
+    distance = low - price if price < low else price - high
+    return math.exp(-distance / width)
+
+
+class LocalRanker:
+    """Score products against questionnaire answers with deterministic weighted features"""
+
+    def __init__(self, products: List[Union[str, Product]]):
+        self.products = parse_products(products)
+        self._name_words = [_words(product.name) for product in self.products]
+        prices = [product.price for product in self.products if product.price is not None]
+        low, high = (min(prices), max(prices)) if prices else (0.0, 0.0)
+        spread = (high - low) or 1.0
+        # 0 for the cheapest product, 1 for the most expensive
+        self._relative_price = [
+            (product.price - low) / spread if product.price is not None else 0.5 for product in self.products
+        ]
+
+    def rank(self, ranking_preferences: dict) -> List[dict]:
+        """Return products best-first in the ranked_products shape, with scores and local explanations"""
+        if not self.products:
+            return []
+        scores = [0.0] * len(self.products)
+        reasons = [[] for _ in self.products]
+
+        for question, answer in ranking_preferences.items():
+            answer_text = OPTION_PREFIX_RE.sub('', str(answer))
+            self._score_answer(answer_text, scores, reasons)
+
+        # Python's sort is stable, so ties keep the original list order
+        order = sorted(range(len(self.products)), key=lambda index: -scores[index])
+        ranked = []
+        for rank, index in enumerate(order):
+            product = self.products[index]
+            ranked.append({
+                "id": product.id,
+                "name": product.name,
+                "price": product.price_text,
+                "score": round(scores[index], 4),
+                "explanation": "; ".join(reasons[index]) or "Ranked by overall fit with your answers",
+                "advantages": [],
+                "why_not_first": "" if rank == 0 else "Scored lower on your stated preferences than the products above it",
+                "product_caveats": [],
+                "source_line": product.line,
+            })
+        return ranked
+
+    def _score_answer(self, answer: str, scores: List[float], reasons: List[list]):
+        price_range = parse_price_range(answer)
+        if price_range is not None:
+            label = f"${price_range[0]:,.0f}+" if price_range[1] == math.inf else f"${price_range[0]:,.0f}-${price_range[1]:,.0f}"
+            for index, product in enumerate(self.products):
+                fit = _price_fit(product.price, price_range)
+                scores[index] += PRICE_RANGE_WEIGHT * fit
+                if fit == 1.0:
+                    reasons[index].append(f"Within your {label} budget")
+
+        answer_words = _words(answer)
+        leaning = len(answer_words & PREMIUM_WORDS) - len(answer_words & BUDGET_WORDS)
+        if leaning and price_range is None:
+            for index, relative_price in enumerate(self._relative_price):
+                fit = relative_price if leaning > 0 else 1.0 - relative_price
+                scores[index] += PRICE_LEANING_WEIGHT * fit
+            favoured = "premium" if leaning > 0 else "value"
+            best = max(range(len(self.products)), key=lambda i: self._relative_price[i] if leaning > 0 else -self._relative_price[i])
+            reasons[best].append(f"Best {favoured} option for your priorities")
+
+        if answer_words:
+            for index, name_words in enumerate(self._name_words):
+                shared = answer_words & name_words
+                if shared:
+                    scores[index] += NAME_MATCH_WEIGHT * len(shared) / len(answer_words)
+                    reasons[index].append(f"Matches your preference for {', '.join(sorted(shared))}")
+
@@ -0,0 +1,366 @@
+"""
+Prometheus-style metrics that aggregate across worker processes.
+
+Each worker keeps counters, gauges and histograms in memory and periodically
+writes a JSON snapshot to METRICS_DIR/<pid>.json. /metrics merges every
+worker's snapshot before rendering the text exposition format, so any worker
+can answer a scrape with totals for the whole server. Snapshots left by dead
+workers are folded into archive.json, keeping counters monotonic across
+worker restarts; their gauges are dropped.
+"""
+import os
+import json
+import time
+import fcntl
+import asyncio
+import logging
+import tempfile
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "expertosy_metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: dict) -> str:
+    return json.dumps([str(labels.get(name, "")) for name in labelnames])
+
+
+class Counter:
+    """Monotonic per-process value, summed across workers"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels):
+        self.values[_label_key(self.labelnames, labels)] += amount
+
+    def set(self, value: float, **labels):
+        """Mirror a process-local counter kept elsewhere (used by collectors)"""
+        self.values[_label_key(self.labelnames, labels)] = float(value)
+
+    def samples(self) -> dict:
+        return dict(self.values)
+
+
+class Gauge(Counter):
+    """Point-in-time value, summed across live workers"""
+    kind = "gauge"
+
+
+class Histogram:
+    """Bucketed distribution, summed across workers"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum, count
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> dict:
+        return {key: [list(counts), total, count] for key, (counts, total, count) in self.values.items()}
+
+
+def _merge_samples(kind: str, into: dict, samples: dict):
+    for key, value in samples.items():
+        if kind == "histogram":
+            current = into.get(key)
+            if current is None:
+                into[key] = [list(value[0]), value[1], value[2]]
+            else:
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+                current[2] += value[2]
+        else:
+            into[key] = into.get(key, 0.0) + value
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """Metric definitions plus the per-worker snapshot files they are aggregated from"""
+
+    def __init__(self, directory: str = METRICS_DIR, enabled: bool = METRICS_ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Run collect before every snapshot, e.g. to mirror stats kept by other modules"""
+        self._collectors.append(collect)
+
+    def snapshot(self) -> dict:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return {
+            name: {"kind": metric.kind, "samples": metric.samples()}
+            for name, metric in self._metrics.items()
+        }
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def flush(self):
+        """Write this worker's snapshot atomically"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(f"{os.getpid()}.json")
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"pid": os.getpid(), "written_at": time.time(), "metrics": self.snapshot()}, f)
+        os.replace(temporary, path)
+
+    def _fold_dead_workers(self):
+        """Move counters and histograms of exited workers into the archive so totals never go backwards"""
+        with open(self._path("archive.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self._path("archive.json")
+            dead = []
+            for entry in os.listdir(self.directory):
+                if entry.endswith(".json") and entry[:-5].isdigit() and not _pid_alive(int(entry[:-5])):
+                    dead.append(entry)
+            if not dead:
+                return
+            archive = self._read(archive_path) or {"metrics": {}}
+            for entry in dead:
+                snapshot = self._read(self._path(entry))
+                for name, metric in (snapshot or {}).get("metrics", {}).items():
+                    if metric["kind"] == "gauge":
+                        continue
+                    target = archive["metrics"].setdefault(name, {"kind": metric["kind"], "samples": {}})
+                    _merge_samples(metric["kind"], target["samples"], metric["samples"])
+            temporary = f"{archive_path}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(archive, f)
+            os.replace(temporary, archive_path)
+            for entry in dead:
+                os.remove(self._path(entry))
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self) -> dict:
+        """Merge the snapshots of every worker, past and present"""
+        if not self.enabled:
+            return self.snapshot()
+        self.flush()
+        self._fold_dead_workers()
+        merged = {}
+        for entry in sorted(os.listdir(self.directory)):
+            if not entry.endswith(".json"):
+                continue
+            snapshot = self._read(self._path(entry))
+            for name, metric in (snapshot or {}).get("metrics", {}).items():
+                target = merged.setdefault(name, {"kind": metric["kind"], "samples": {}})
+                _merge_samples(metric["kind"], target["samples"], metric["samples"])
+        return merged
+
+    def render(self) -> str:
+        """Text exposition format of the merged metrics"""
+        merged = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            samples = merged.get(name, {}).get("samples", {})
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(samples.items()):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{name}_bucket{self._labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(labels: list) -> str:
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+    async def flush_periodically(self, interval: float = METRICS_FLUSH_INTERVAL):
+        """Background task keeping this worker's snapshot fresh for scrapes served by other workers"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except OSError as e:
+                logger.warning(f"Metrics flush failed: {e}")
+
+
+# Process-wide registry
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "expertosy_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+http_duration = registry.histogram(
+    "expertosy_http_request_duration_seconds", "Time from request to last response byte", ("route",))
+http_response_size = registry.histogram(
+    "expertosy_http_response_size_bytes", "Response body size", ("route",), SIZE_BUCKETS)
+llm_duration = registry.histogram(
+    "expertosy_llm_request_duration_seconds", "Upstream LLM completion time per endpoint", ("endpoint", "mode"))
+llm_profile_duration = registry.histogram(
+    "expertosy_llm_profile_duration_seconds", "Upstream LLM completion time per generation profile", ("profile", "model"))
+llm_tokens = registry.counter(
+    "expertosy_llm_tokens_total", "Tokens reported by the LLM API per endpoint", ("endpoint", "kind"))
+llm_errors = registry.counter(
+    "expertosy_llm_errors_total", "Failed upstream LLM calls per endpoint", ("endpoint",))
+thread_queue = registry.histogram(
+    "expertosy_thread_queue_seconds", "Time a to_thread call waited for a worker thread", ("stage",))
+thread_run = registry.histogram(
+    "expertosy_thread_run_seconds", "Time a to_thread call ran in its worker thread", ("stage",))
+ranking_failures = registry.counter(
+    "expertosy_ranking_failures_total", "rank_products responses that were truncated or failed JSON parsing or validation", ("kind",))
+ranking_repairs = registry.counter(
+    "expertosy_ranking_repairs_total", "Incomplete or missing ranked products completed by a follow-up call or locally", ("result",))
+tournament_merges = registry.counter(
+    "expertosy_tournament_merges_total", "Tournament merge steps ordered by the LLM, partly or wholly by local scores",
+    ("result",))
+tournament_chunks = registry.counter(
+    "expertosy_tournament_chunks_total", "Tournament chunks ranked by the LLM or, after a failed call, locally",
+    ("result",))
+question_dedup = registry.counter(
+    "expertosy_question_dedup_total", "Generated ranking questions kept, dropped as repeats or added by a top-up call", ("result",))
+cache_lookups = registry.counter(
+    "expertosy_cache_lookups_total", "Query cache and response store lookups by result", ("cache", "result"))
+admission_calls = registry.counter(
+    "expertosy_llm_admission_total", "LLM calls admitted or shed by priority", ("priority", "result"))
+admission_slots = registry.gauge(
+    "expertosy_llm_admission_slots", "LLM calls currently running or waiting for a slot", ("state",))
+hedged_calls = registry.counter(
+    "expertosy_llm_hedged_total", "Hedge requests fired and won", ("result",))
+llm_backend_calls = registry.counter(
+    "expertosy_llm_backend_calls_total", "LLM calls per upstream backend by result", ("backend", "result"))
+llm_backend_open = registry.gauge(
+    "expertosy_llm_backend_breaker_open", "1 while a backend's circuit breaker keeps it out of rotation", ("backend",))
+client_disconnects = registry.counter(
+    "expertosy_client_disconnects_total", "Requests cancelled because their client left before the response was complete")
+llm_cancelled = registry.counter(
+    "expertosy_llm_cancelled_total", "Upstream LLM calls cancelled before they finished", ("reason",))
+llm_tokens_saved = registry.counter(
+    "expertosy_llm_tokens_saved_total", "Estimated completion tokens not generated because their call was cancelled",
+    ("reason",))
+
+
+async def timed_to_thread(stage: str, fn: Callable, *args):
+    """asyncio.to_thread, timing both the wait for a free thread and the call itself"""
+    submitted = time.perf_counter()
+    started = []
+
+    def run():
+        started.append(time.perf_counter())
+        return fn(*args)
+
+    try:
+        return await asyncio.to_thread(run)
+    finally:
+        if started:
+            thread_queue.observe(started[0] - submitted, stage=stage)
+            thread_run.observe(time.perf_counter() - started[0], stage=stage)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, durations and response sizes per route"""
+
+    def __init__(self, app, routes: Callable[[], Iterable[str]]):
+        self.app = app
+        self._routes = routes
+        self._known = None
+
+    def _route(self, path: str) -> str:
+        # Unknown paths share one label so scanners cannot blow up the series count
+        if self._known is None:
+            self._known = set(self._routes())
+        return path if path in self._known else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self._route(scope["path"])
+        started = time.perf_counter()
+        status = [500]
+        size = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                size[0] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            # The client went away (see DisconnectMiddleware); logged like nginx's 499 Client Closed Request
+            status[0] = 499
+            raise
+        finally:
+            http_requests.inc(route=route, method=scope["method"], status=status[0])
+            http_duration.observe(time.perf_counter() - started, route=route)
+            http_response_size.observe(size[0], route=route)
@@ -0,0 +1,94 @@
+"""
+Generation profiles: the model and sampling parameters of each engine method.
+
+Every completion used to run on one model with max_tokens=2000 and
+temperature=0.7. Each engine method now names a profile instead, so short
+free-text answers (factors, questionnaires) run on the fast tier with a
+max_tokens sized to their output, while ranking runs on the strong tier at a
+low temperature in JSON mode. max_tokens also bounds the tokens the admission
+scheduler reserves for a call, so tight limits let more calls share the
+per-minute budget.
+
+Tiers map to models through LLM_MODEL_FAST and LLM_MODEL_STRONG, and any
+profile field can be overridden with LLM_PROFILE_OVERRIDES, a JSON object such
+as {"rank_products": {"max_tokens": 4000}}.
+"""
+import os
+import json
+import logging
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL_FAST = os.getenv("LLM_MODEL_FAST", "deepseek-chat")
+LLM_MODEL_STRONG = os.getenv("LLM_MODEL_STRONG", "deepseek-chat")
+LLM_PROFILE_OVERRIDES = os.getenv("LLM_PROFILE_OVERRIDES", "")
+
+
+class GenerationProfile:
+    """Model, sampling parameters and response format for one kind of completion"""
+
+    def __init__(self, name: str, model: str, max_tokens: int, temperature: float,
+                 stop: Optional[Tuple[str, ...]] = None, json_mode: bool = False):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = tuple(stop) if stop else None
+        self.json_mode = json_mode
+
+    def params(self) -> dict:
+        """Keyword arguments for chat.completions.create, also part of the completion key"""
+        params = {"temperature": self.temperature, "max_tokens": self.max_tokens}
+        if self.stop:
+            params["stop"] = list(self.stop)
+        if self.json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    def replace(self, **fields) -> "GenerationProfile":
+        values = {
+            "model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature,
+            "stop": self.stop, "json_mode": self.json_mode,
+        }
+        values.update(fields)
+        return GenerationProfile(self.name, **values)
+
+    def describe(self) -> dict:
+        return {"model": self.model, **self.params()}
+
+
+def _apply_overrides(profiles: dict, overrides: str) -> dict:
+    if not overrides:
+        return profiles
+    try:
+        for name, fields in json.loads(overrides).items():
+            profiles[name] = profiles[name].replace(**fields)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Ignoring invalid LLM_PROFILE_OVERRIDES: {e}")
+    return profiles
+
+
+# Keyed by engine method; sizes allow roughly twice the longest answer seen for each prompt
+GENERATION_PROFILES = _apply_overrides({
+    "default": GenerationProfile("default", LLM_MODEL_STRONG, 2000, 0.7),
+    # About ten short factors; no stop sequence, since a blank line after a heading would cut the list short
+    "generate_factors": GenerationProfile("generate_factors", LLM_MODEL_FAST, 400, 0.7),
+    "create_questionnaire": GenerationProfile("create_questionnaire", LLM_MODEL_FAST, 1500, 0.5),
+    "bootstrap": GenerationProfile("bootstrap", LLM_MODEL_FAST, 2000, 0.5),
+    "generate_ranking_questionnaire": GenerationProfile("generate_ranking_questionnaire", LLM_MODEL_FAST, 1500, 0.5),
+    # A handful of replacement questions; warmer so it strays from the topics it just repeated
+    "top_up_ranking_questionnaire": GenerationProfile("top_up_ranking_questionnaire", LLM_MODEL_FAST, 500, 0.8),
+    # Product names and prices come from the model's knowledge, so this stays on the strong tier
+    "generate_recommendation": GenerationProfile("generate_recommendation", LLM_MODEL_STRONG, 800, 0.7),
+    "rank_products": GenerationProfile("rank_products", LLM_MODEL_STRONG, 3000, 0.2, json_mode=True),
+    "merge_rankings": GenerationProfile("merge_rankings", LLM_MODEL_STRONG, 500, 0.0, json_mode=True),
+    "rerank_products": GenerationProfile("rerank_products", LLM_MODEL_STRONG, 1500, 0.2, json_mode=True),
+}, LLM_PROFILE_OVERRIDES)
+
+
+def get_profile(name: Union[str, GenerationProfile]) -> GenerationProfile:
+    """The named profile, or the given one for calls that adjust a profile to their input"""
+    if isinstance(name, GenerationProfile):
+        return name
+    return GENERATION_PROFILES.get(name) or GENERATION_PROFILES["default"]
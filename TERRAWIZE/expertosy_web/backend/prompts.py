@@ -0,0 +1,278 @@
+"""
+Prompt templates laid out for upstream prompt-prefix caching.
+
+The upstream API serves a request faster and bills its prompt tokens at a
+fraction of the price when the start of the prompt repeats an earlier one.
+Each template therefore keeps its instructions and examples in a static system
+message and renders the per-request data (search query, factors, products,
+answers) only into the final user message, so every call made by an endpoint
+shares the same prefix whatever the user searched for.
+
+Cached and uncached prompt tokens are taken from the usage of every completion
+and accumulated per endpoint, together with the latency of calls that mostly
+hit the cache versus the rest, for /prompt-cache-stats.
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import List, Tuple
+
+# Price in USD per million prompt tokens, used to report what caching saved
+PROMPT_PRICE_CACHE_MISS = float(os.getenv("PROMPT_PRICE_CACHE_MISS", "0.27"))
+PROMPT_PRICE_CACHE_HIT = float(os.getenv("PROMPT_PRICE_CACHE_HIT", "0.07"))
+# A call counts as a cache hit when at least this share of its prompt was cached
+PROMPT_CACHE_HIT_RATIO = float(os.getenv("PROMPT_CACHE_HIT_RATIO", "0.5"))
+
+
+class PromptTemplate:
+    """A static system prompt followed by a user message rendered from the request's data"""
+
+    def __init__(self, name: str, system: str, user: str):
+        self.name = name
+        # Never formatted: anything request-specific here would break the shared prefix
+        self.system = system
+        self.user = user
+
+    def render(self, **variables) -> List[dict]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**variables)},
+        ]
+
+
+def prompt_cache_usage(usage) -> Tuple[int, int]:
+    """(cached, uncached) prompt tokens of a completion's usage, across API flavours"""
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    # DeepSeek reports the split directly
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is not None:
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        return hit, miss if miss is not None else max(prompt_tokens - hit, 0)
+    # OpenAI nests it under prompt_tokens_details
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    cached = cached or 0
+    return cached, max(prompt_tokens - cached, 0)
+
+
+class PromptCacheStats:
+    """Per-endpoint prompt cache hit tokens, estimated savings and latency split by cache hit"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # endpoint -> [calls, cached tokens, uncached tokens, hit calls, hit seconds, miss calls, miss seconds]
+        self.endpoints = defaultdict(lambda: [0, 0, 0, 0, 0.0, 0, 0.0])
+
+    def record(self, endpoint: str, cached: int, uncached: int, seconds: float):
+        hit = cached + uncached > 0 and cached / (cached + uncached) >= PROMPT_CACHE_HIT_RATIO
+        with self._lock:
+            entry = self.endpoints[endpoint]
+            entry[0] += 1
+            entry[1] += cached
+            entry[2] += uncached
+            if hit:
+                entry[3] += 1
+                entry[4] += seconds
+            else:
+                entry[5] += 1
+                entry[6] += seconds
+
+    @staticmethod
+    def _summary(calls, cached, uncached, hit_calls, hit_seconds, miss_calls, miss_seconds) -> dict:
+        prompt_tokens = cached + uncached
+        cost = (cached * PROMPT_PRICE_CACHE_HIT + uncached * PROMPT_PRICE_CACHE_MISS) / 1_000_000
+        uncached_cost = prompt_tokens * PROMPT_PRICE_CACHE_MISS / 1_000_000
+        return {
+            "calls": calls,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached,
+            "uncached_tokens": uncached,
+            "hit_ratio": cached / prompt_tokens if prompt_tokens else 0.0,
+            "prompt_cost_usd": round(cost, 6),
+            "saved_usd": round(uncached_cost - cost, 6),
+            "mean_latency_hit": hit_seconds / hit_calls if hit_calls else None,
+            "mean_latency_miss": miss_seconds / miss_calls if miss_calls else None,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = {endpoint: list(entry) for endpoint, entry in self.endpoints.items()}
+        totals = [sum(column) for column in zip(*entries.values())] if entries else [0] * 7
+        return {
+            "total": self._summary(*totals),
+            "endpoints": {endpoint: self._summary(*entry) for endpoint, entry in entries.items()},
+        }
+
+
+# Process-wide prompt cache accounting
+prompt_cache_stats = PromptCacheStats()
+
+
+FACTORS_PROMPT = PromptTemplate(
+    "factors",
+    system=(
+        "You are an expert at analyzing products and what matters to people when choosing between them. "
+        "List unique and comprehensive factors for evaluating what is most important to the user when choosing the item. "
+        "Focus on the key differences between the options and create factors that will help determine the best match for the user. "
+        "They are the factors that you would think about when choosing the item, "
+        "in the form of a question that the user would ask themselves. "
+        "When considering the factors, think about the trade-offs between the options.\n\n"
+        "Provide factors separated by '*', without numbering or additional text."
+    ),
+    user="List {number_of_factors} factors for choosing a {search_query}."
+)
+
+QUESTIONNAIRE_PROMPT = PromptTemplate(
+    "questionnaire",
+    system=(
+        "You are an expert at creating questionnaires. "
+        "Generate many questions for a questionnaire with multiple-choice questions. "
+        "Format each question with a clear text and 4 lettered options (A, B, C, D). "
+        "Include cost ranges or relevant details for each option when applicable. "
+        "The questionnaire should help determine the user's precise preferences.\n\n"
+        "Format requirements:\n"
+        "1. Number each question as '1.', '2.'\n"
+        "2. Each question should be clear and direct\n"
+        "3. Format options exactly as 'A)', 'B)', 'C)', 'D)'\n"
+        "4. Each option should be on a new line\n"
+        "5. Do not include any additional text or formatting\n\n"
+        "Example format:\n"
+        "1. What is your preferred price range?\n"
+        "A) $0-$500\n"
+        "B) $501-$1000\n"
+        "C) $1001-$1500\n"
+        "D) $1501 or more\n\n"
+        "2. What is your primary use case?\n"
+        "A) Personal use\n"
+        "B) Professional work\n"
+        "C) Gaming\n"
+        "D) Content creation"
+    ),
+    user="Create a questionnaire for {search_query} using these factors: {factors}."
+)
+
+BOOTSTRAP_PROMPT = PromptTemplate(
+    "bootstrap",
+    system=(
+        "You are an expert at analyzing products and at creating questionnaires for them. "
+        "List unique and comprehensive factors for what is most important to the user when choosing the item. "
+        "Focus on the key differences and trade-offs between the options, "
+        "phrased as the questions the user would ask themselves. "
+        "Then create the questionnaire for those factors so it determines the user's precise preferences. "
+        "Answer with exactly two sections and nothing else:\n\n"
+        "### FACTORS\n"
+        "The factors separated by '*', without numbering or additional text.\n"
+        "### QUESTIONNAIRE\n"
+        "One multiple-choice question per factor, in the same order.\n\n"
+        "Questionnaire format requirements:\n"
+        "1. Number each question as '1.', '2.'\n"
+        "2. Each question should be clear and direct\n"
+        "3. Format options exactly as 'A)', 'B)', 'C)', 'D)'\n"
+        "4. Each option should be on a new line\n"
+        "5. Include cost ranges or relevant details for each option when applicable\n\n"
+        "Example questionnaire format:\n"
+        "1. What is your preferred price range?\n"
+        "A) $0-$500\n"
+        "B) $501-$1000\n"
+        "C) $1001-$1500\n"
+        "D) $1501 or more"
+    ),
+    user="List {number_of_factors} factors for choosing a {search_query}, then the questionnaire."
+)
+
+RECOMMENDATION_PROMPT = PromptTemplate(
+    "recommendation",
+    system=(
+        "Based on all the user's answers, recommend by name and price the products "
+        "that would most likely fit this profile. Format each line as:\n"
+        "1. [Product Name] - $[Price]\n"
+        "2. [Product Name] - $[Price]\n"
+        "... and so on.\n"
+        "ONLY include the name and price. NO descriptions or additional details."
+    ),
+    user=(
+        "Based on these preferences, list 20 {search_query}s with ONLY their names and prices:\n\n"
+        "{preference_text}"
+    )
+)
+
+RANKING_QUESTIONNAIRE_PROMPT = PromptTemplate(
+    "ranking-questionnaire",
+    system=(
+        "You are an expert at creating questionnaires that help rank products based on trade-offs. "
+        "Create multiple-choice questions that help understand user preferences regarding the key differences between these products. "
+        "Focus on the key differences between the specific products given and create questions that will help determine the best match for the user. "
+        "When wording the questions think about specific things that would rule out some of the products.\n\n"
+        "Format requirements:\n"
+        "1. Number each question as '1.', '2.', etc.\n"
+        "2. Each question MUST end with a question mark (?)\n"
+        "3. Format options exactly as 'A)', 'B)', 'C)', 'D)'\n"
+        "4. Focus on comparing price vs features, performance vs portability, etc.\n"
+        "5. Make questions that help distinguish between the products' advantages and disadvantages.\n"
+        "6. DO NOT duplicate any questions that were previously asked, "
+        "or ask about the same topics in a different way.\n\n"
+        "Example format:\n"
+        "1. What is your primary concern when choosing between these products?\n"
+        "A) Price and value for money\n"
+        "B) Performance and speed\n"
+        "C) Build quality and durability\n"
+        "D) Brand reputation and support"
+    ),
+    user="Create a questionnaire to help rank these products based on their trade-offs:\n\n{products_text}\n{previous_questions_text}"
+)
+
+# Follow-up turn after a ranking questionnaire whose questions mostly repeated earlier ones; sent as a
+# continuation of the same conversation, so the whole first call is a cached prefix
+RANKING_QUESTIONNAIRE_TOP_UP = (
+    "These questions repeat topics that were already asked: {repeated}. "
+    "Write {count} more questions about different trade-offs, in the same format, numbered from 1."
+)
+
+RANK_PRODUCTS_PROMPT = PromptTemplate(
+    "rank-products",
+    system=(
+        "You are a product ranking expert. Analyze the given products and user preferences, "
+        "then return a JSON array of ranked products. Each product should include: name, price, "
+        "explanation (why it's ranked here), advantages (array of key benefits), "
+        "why_not_first (for products not ranked first, explain why they didn't get the top spot), "
+        "and product_caveats (array of potential drawbacks or things to consider). "
+        "Format the response as valid JSON. Do not include any markdown formatting or additional text.\n\n"
+        "Provide a JSON response in this exact format:\n"
+        '{"ranked_products": [\n'
+        '  {\n'
+        '    "name": "Product Name",\n'
+        '    "price": "$1234",\n'
+        '    "explanation": "Why this product is ranked here",\n'
+        '    "advantages": ["benefit 1", "benefit 2"],\n'
+        '    "why_not_first": "Only for non-first ranked products, explain why not #1",\n'
+        '    "product_caveats": ["caveat 1", "caveat 2"]\n'
+        '  }\n'
+        ']}'
+    ),
+    user="Products to rank:\n{products_text}\n\nUser Preferences:\n{preferences_text}"
+)
+
+MERGE_PROMPT = PromptTemplate(
+    "merge",
+    system=(
+        "You are a product ranking expert. You are given two lists of products, each already ranked "
+        "best-first for the user. Merge them into a single best-first ranking by comparing products "
+        "from the two lists against the user's preferences. Keep the relative order within each list. "
+        'Return only JSON in this exact format: {"order": ["A1", "B1", "A2"]} using the given ids. '
+        "Do not include any markdown formatting or additional text."
+    ),
+    user="User Preferences:\n{preferences_text}\n\nList A:\n{left}\n\nList B:\n{right}"
+)
+
+RERANK_PROMPT = PromptTemplate(
+    "rerank",
+    system=(
+        "You are a product ranking expert. The user already received the ranking below and then "
+        "changed some of their answers. Re-rank the same products for the updated answers. "
+        'Return only JSON in this exact format: {"order": ["P2", "P1"], "updated": '
+        '[{"id": "P2", "explanation": "Why it is ranked here now", "why_not_first": "Why it is not #1"}]}. '
+        'List every id in "order". Include in "updated" only the products whose position changed. '
+        "Do not include any markdown formatting or additional text."
+    ),
+    user="Previous ranking:\n{ranking_text}\n\nCurrent answers:\n{preferences_text}\n\nChanged answers:\n{changes_text}"
+)
@@ -0,0 +1,203 @@
+"""
+Normalized, near-duplicate-aware cache for search-query driven LLM results.
+
+generate_factors and create_questionnaire depend only on the search query (and
+the factor list), so "Laptop", "laptops" and "a laptop " can all share one
+result. Queries are normalized first; if there is no exact match, a character
+trigram index proposes candidates and a per-token edit distance check accepts
+typo-level near-duplicates ("labtop" -> "laptop"). Short words and model
+numbers must match exactly, so "chair" never collides with "chain".
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+
+ARTICLES = {"a", "an", "the", "some", "any"}
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:['+][a-z0-9]+)*")
+# Words ending in "s" that are not plurals and must be left alone
+SINGULAR_S_WORDS = {"glass", "bus", "gas", "lens", "series", "species", "news", "chess", "jeans", "pants", "shorts"}
+
+
+def singularize(word: str) -> str:
+    """Strip common English plural suffixes from a single lowercase token"""
+    if len(word) <= 3 or word in SINGULAR_S_WORDS or word.isdigit():
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "ches", "shes", "zes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query: lowercase, no articles or punctuation, singular nouns"""
+    tokens = TOKEN_RE.findall((query or "").lower())
+    return " ".join(singularize(token) for token in tokens if token not in ARTICLES)
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance between two tokens, giving up once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _allowed_typos(token: str) -> int:
+    if any(c.isdigit() for c in token) or len(token) < 6:
+        return 0
+    return 1 if len(token) < 10 else 2
+
+
+def is_near_duplicate(a: str, b: str) -> bool:
+    """Whether two normalized queries differ only by small typos in long words"""
+    tokens_a, tokens_b = a.split(), b.split()
+    if len(tokens_a) != len(tokens_b):
+        return False
+    for token_a, token_b in zip(tokens_a, tokens_b):
+        if token_a == token_b:
+            continue
+        limit = min(_allowed_typos(token_a), _allowed_typos(token_b))
+        if limit == 0 or _edit_distance(token_a, token_b, limit) > limit:
+            return False
+    return True
+
+
+class QueryCache:
+    """Thread-safe LRU + TTL cache keyed by (namespace, normalized query, extra key)"""
+
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl: float = QUERY_CACHE_TTL,
+                 enabled: bool = QUERY_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[tuple, Tuple[float, Any]]" = OrderedDict()
+        self._trigram_index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, namespace: str, query: str, extra: Hashable = None) -> Optional[Any]:
+        """Return the cached value for the query or a near-duplicate of it, or None"""
+        if not self.enabled:
+            return None
+        normalized = normalize_query(query)
+        key = (namespace, normalized, extra)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            near_key = self._nearest(key)
+            if near_key is not None:
+                value = self._lookup(near_key)
+                if value is not None:
+                    self.near_hits += 1
+                    logger.info(f"Query cache near-duplicate hit: '{normalized}' -> '{near_key[1]}'")
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, namespace: str, query: str, value: Any, extra: Hashable = None):
+        """Store a value for the normalized query"""
+        if not self.enabled or value is None:
+            return
+        key = (namespace, normalize_query(query), extra)
+        with self._lock:
+            if key not in self._entries:
+                for trigram in _trigrams(key[1]):
+                    self._trigram_index.setdefault(trigram, set()).add(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._unindex(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._trigram_index.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+    def _lookup(self, key: tuple) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._unindex(key)
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _nearest(self, key: tuple) -> Optional[tuple]:
+        namespace, normalized, extra = key
+        if not normalized:
+            return None
+        overlaps = {}
+        for trigram in _trigrams(normalized):
+            for candidate in self._trigram_index.get(trigram, ()):
+                if candidate[0] == namespace and candidate[2] == extra:
+                    overlaps[candidate] = overlaps.get(candidate, 0) + 1
+
+        # Check the candidates sharing the most trigrams first
+        for candidate, _ in sorted(overlaps.items(), key=lambda item: item[1], reverse=True):
+            if is_near_duplicate(normalized, candidate[1]):
+                return candidate
+        return None
+
+    def _unindex(self, key: tuple):
+        for trigram in _trigrams(key[1]):
+            keys = self._trigram_index.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigram_index[trigram]
+
+
+# Process-wide cache shared by every engine instance
+query_cache = QueryCache()
@@ -0,0 +1,250 @@
+"""
+Near-duplicate detection for ranking questionnaire questions.
+
+The ranking questionnaire prompt lists the previously asked questions and tells
+the model not to repeat them, but it still re-asks the same topic in other
+words ("What is your budget?" / "How much are you willing to spend?"), which
+costs the user a whole extra round. Each asked question is reduced to a set of
+topic terms (stop words and the category's own words dropped, words folded to a
+crude stem, common trade-off synonyms mapped to one topic) and indexed by the
+LSH bands of its MinHash signature, so a lookup only compares against questions
+sharing a band. Generated questions whose terms have a Jaccard similarity of at
+least QUESTION_DEDUP_THRESHOLD with an asked question are dropped.
+
+An index covers one ranking session within one product category and is kept in
+a per-worker LRU; it is derived from the questions the session stores, so any
+worker can rebuild it.
+"""
+import os
+import re
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sessions import question_id
+
+QUESTION_DEDUP_ENABLED = os.getenv("QUESTION_DEDUP_ENABLED", "true").lower() == "true"
+# Estimated Jaccard similarity of topic terms at which a question counts as a repeat
+QUESTION_DEDUP_THRESHOLD = float(os.getenv("QUESTION_DEDUP_THRESHOLD", "0.6"))
+# A round with fewer new questions than this asks the model for a top-up
+QUESTION_DEDUP_MIN_QUESTIONS = int(os.getenv("QUESTION_DEDUP_MIN_QUESTIONS", "3"))
+QUESTION_INDEX_SIZE = int(os.getenv("QUESTION_INDEX_SIZE", "5000"))
+
+# Two-row bands make any pair at the threshold share a band almost surely; candidates are then checked exactly
+MINHASH_BANDS = 32
+MINHASH_ROWS = 2
+MINHASH_PERMUTATIONS = MINHASH_BANDS * MINHASH_ROWS
+MERSENNE_PRIME = (1 << 61) - 1
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+QUESTION_NUMBER_RE = re.compile(r'^\s*\d+[.)]\s*')
+
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "at", "by", "from", "as", "into",
+    "is", "are", "be", "do", "does", "did", "can", "could", "would", "will", "should", "need", "needs",
+    "what", "which", "how", "when", "where", "who", "why", "whether", "if", "than", "that", "this", "these",
+    "those", "it", "its", "you", "your", "yours", "i", "me", "my", "we", "our", "they", "them",
+    "most", "more", "less", "much", "many", "very", "really", "some", "any", "all", "each", "other",
+    "important", "importance", "matter", "matters", "prefer", "preference", "prefers", "priority",
+    "prioritize", "care", "about", "consider", "considering", "choose", "choosing", "pick", "option",
+    "options", "product", "products", "one", "ones", "between", "like", "want", "willing",
+    "looking", "plan", "planning", "typically", "usually", "kind", "type", "level", "mainly", "around",
+    "compare", "compared", "comparison", "versus", "vs", "suit", "suits", "fit", "often", "get", "have", "has",
+    "make", "feel", "feature", "features", "dedicated", "card", "life", "long", "last", "work", "working",
+}
+
+# Words that name the same trade-off, folded to one topic term (after stemming)
+TOPIC_SYNONYMS = {
+    "price": ("budget", "cost", "spend", "afford", "affordable", "money", "expensive", "cheap", "pay", "paying",
+              "dollar"),
+    "portability": ("portable", "weight", "light", "lightweight", "heavy", "carry", "carrying", "travel",
+                    "commute", "mobility", "compact"),
+    "battery": ("battery", "charge", "charger", "charging", "unplugged", "runtime"),
+    "performance": ("performance", "speed", "fast", "powerful", "power", "processor", "cpu", "responsive"),
+    "display": ("screen", "display", "monitor", "resolution"),
+    "storage": ("storage", "ssd", "disk", "space", "capacity"),
+    "durability": ("durable", "durability", "build", "sturdy", "robust", "reliable", "reliability", "quality"),
+    "support": ("warranty", "support", "service", "brand", "reputation"),
+    "usage": ("use", "using", "usage", "purpose", "primary", "primarily", "task", "activity", "activities", "mostly"),
+    "graphics": ("graphics", "gpu", "gaming", "game"),
+    "size": ("size", "dimension", "big", "small", "large"),
+}
+_TOPICS = {word: topic for topic, words in TOPIC_SYNONYMS.items() for word in words}
+
+# Fixed (a, b) pairs for the universal hashes h(x) = (a * x + b) mod p standing in for permutations
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha1(f"a{i}".encode()).digest()[:8], "big") % (MERSENNE_PRIME - 1) + 1,
+     int.from_bytes(hashlib.sha1(f"b{i}".encode()).digest()[:8], "big") % MERSENNE_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def topic_terms(question: str, ignored: frozenset = frozenset()) -> frozenset:
+    """The set of topic terms a question is compared by, leaving out the ignored (category) terms"""
+    terms = set()
+    for word in WORD_RE.findall(QUESTION_NUMBER_RE.sub('', question).lower()):
+        if word in STOP_WORDS:
+            continue
+        term = _TOPICS.get(word) or _TOPICS.get(_stem(word)) or _stem(word)
+        if term not in ignored:
+            terms.add(term)
+    return frozenset(terms)
+
+
+def category_terms(category: str) -> frozenset:
+    """Terms of the product category itself, which say nothing about a question's topic"""
+    return frozenset(_stem(word) for word in WORD_RE.findall((category or "").lower()) if word not in STOP_WORDS)
+
+
+def minhash(terms: Iterable[str]) -> Tuple[int, ...]:
+    """MinHash signature of a set of terms"""
+    hashes = [struct.unpack(">Q", hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest())[0]
+              for term in terms]
+    if not hashes:
+        return (MERSENNE_PRIME,) * MINHASH_PERMUTATIONS
+    return tuple(min((a * value + b) % MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(left: frozenset, right: frozenset) -> float:
+    return len(left & right) / len(left | right) if left or right else 0.0
+
+
+class QuestionIndex:
+    """MinHash LSH index of the questions already asked in one scope"""
+
+    def __init__(self, category: str = "", threshold: float = QUESTION_DEDUP_THRESHOLD):
+        self.category = category
+        self.threshold = threshold
+        self.ignored = category_terms(category)
+        # question id -> (question text, topic terms)
+        self._questions: Dict[str, Tuple[str, frozenset]] = {}
+        # (band number, band values) -> question ids
+        self._buckets: Dict[tuple, List[str]] = {}
+
+    @classmethod
+    def from_questions(cls, questions: Iterable[str], category: str = "",
+                       threshold: float = QUESTION_DEDUP_THRESHOLD) -> "QuestionIndex":
+        index = cls(category, threshold)
+        index.update(questions)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def __contains__(self, question: str) -> bool:
+        return question_id(question) in self._questions
+
+    @staticmethod
+    def _bands(terms: frozenset):
+        signature = minhash(terms)
+        for band in range(MINHASH_BANDS):
+            yield band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+
+    def add(self, question: str) -> str:
+        identifier = question_id(question)
+        if identifier not in self._questions:
+            terms = topic_terms(question, self.ignored)
+            self._questions[identifier] = (question, terms)
+            if terms:
+                for band in self._bands(terms):
+                    self._buckets.setdefault(band, []).append(identifier)
+        return identifier
+
+    def update(self, questions: Iterable[str]):
+        for question in questions:
+            self.add(question)
+
+    def duplicate_of(self, question: str) -> Optional[str]:
+        """The indexed question this one repeats, if any"""
+        identifier = question_id(question)
+        if identifier in self._questions:
+            return self._questions[identifier][0]
+        terms = topic_terms(question, self.ignored)
+        if not terms:
+            return None
+        best, best_similarity = None, self.threshold
+        candidates = {candidate for band in self._bands(terms) for candidate in self._buckets.get(band, ())}
+        for candidate in candidates:
+            text, other = self._questions[candidate]
+            score = jaccard(terms, other)
+            if score >= best_similarity:
+                best, best_similarity = text, score
+        return best
+
+    def filter(self, questions: List[dict], accepted: Iterable[dict] = (),
+               limit: int = None) -> Tuple[List[dict], List[dict]]:
+        """Split parsed questions into new ones and repeats of indexed or already accepted questions.
+
+        The index itself is left unchanged: questions only join it once the session records them as asked.
+        """
+        batch = QuestionIndex.from_questions((question["question"] for question in accepted), self.category,
+                                             self.threshold)
+        kept, repeated = [], []
+        for question in questions:
+            if limit is not None and len(kept) >= limit:
+                break
+            original = self.duplicate_of(question["question"]) or batch.duplicate_of(question["question"])
+            if original is None:
+                batch.add(question["question"])
+                kept.append(question)
+            else:
+                repeated.append({**question, "duplicate_of": original})
+        return kept, repeated
+
+
+def format_question(question: dict, number: int) -> str:
+    return "\n".join([f"{number}. {question['question']}", *question["options"]])
+
+
+def format_questionnaire(questions: List[dict]) -> str:
+    """Render parsed questions back into a numbered questionnaire"""
+    return "\n\n".join(format_question(question, number) for number, question in enumerate(questions, 1))
+
+
+class QuestionIndexCache:
+    """Per-worker LRU of question indexes keyed by product category and session"""
+
+    def __init__(self, max_entries: int = QUESTION_INDEX_SIZE):
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, category: str, session_id: str, asked: Iterable[str]) -> QuestionIndex:
+        """The scope's index, brought up to date with the questions asked so far"""
+        key = (category, session_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                self.misses += 1
+                index = self._indexes[key] = QuestionIndex(category)
+                while len(self._indexes) > self.max_entries:
+                    self._indexes.popitem(last=False)
+            else:
+                self.hits += 1
+                self._indexes.move_to_end(key)
+        # Picks up the questions recorded since the last round, by this worker or another one
+        index.update(asked)
+        return index
+
+    def discard(self, session_id: str):
+        with self._lock:
+            for key in [key for key in self._indexes if key[1] == session_id]:
+                del self._indexes[key]
+
+    def stats(self) -> dict:
+        return {"indexes": len(self._indexes), "hits": self.hits, "misses": self.misses}
+
+
+# Process-wide question index cache
+question_indexes = QuestionIndexCache()
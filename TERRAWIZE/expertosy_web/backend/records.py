@@ -0,0 +1,181 @@
+"""
+Typed records for questionnaire questions, answer options and products.
+
+Questionnaires come back from the model as numbered text and products as free
+form "N. Name - $Price" lines. Both are parsed once on the server into small
+__slots__ records: questions and products get a canonical id, and prices are
+normalized to numbers. Two lines naming the same product with different
+numbering, case, spacing or punctuation share an id, so ids are stable cache
+keys. Symbols such as "+" are kept, since they tell models apart ("Galaxy S23"
+and "Galaxy S23+"). A product list only drops a repeat when its name matches an
+earlier one up to case and spacing, never on a matching id alone. Records
+serialize to compact dicts for responses, and product records render back to
+canonical lines for prompts.
+"""
+import re
+import hashlib
+from typing import Iterable, List, Optional, Union
+
+from sessions import question_id
+from streaming import parse_questionnaire
+
+PRODUCT_LINE_RE = re.compile(r'^\s*(?:\d+[.)]\s*)?(?P<name>.+?)\s*[-–—:]\s*\$\s*(?P<price>[\d,]+(?:\.\d+)?)\s*(?P<rest>.*)$')
+PRODUCT_NUMBER_RE = re.compile(r'^\s*\d+[.)]\s*')
+PRICE_RE = re.compile(r'\$?\s*([\d,]*\d(?:\.\d+)?)\s*(k)?', re.IGNORECASE)
+OPTION_LINE_RE = re.compile(r'^\s*([A-D])[).]\s*(.*)$')
+# Words and the symbols that are part of a model name; other punctuation is dropped
+PRODUCT_TOKEN_RE = re.compile(r'[a-z0-9]+|[+#&]')
+
+
+def normalize_product_name(name: str) -> str:
+    """Canonical form of a product name: lowercase words and model symbols such as "+", single spaced"""
+    return " ".join(PRODUCT_TOKEN_RE.findall((name or "").lower()))
+
+
+def product_id(name: str) -> str:
+    """Canonical id of a product name, ignoring case, spacing and punctuation other than model symbols"""
+    return hashlib.sha1(normalize_product_name(name).encode("utf-8")).hexdigest()[:12]
+
+
+def parse_price(value) -> Optional[float]:
+    """Numeric price from a number or text such as "$1,299.99" or "1.2k" """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = PRICE_RE.search(str(value or ""))
+    if not match:
+        return None
+    price = float(match.group(1).replace(',', ''))
+    return price * 1000 if match.group(2) else price
+
+
+def format_price(price: Optional[float]) -> str:
+    if price is None:
+        return ""
+    return f"${price:,.0f}" if float(price).is_integer() else f"${price:,.2f}"
+
+
+class Option:
+    """One lettered answer option of a question"""
+    __slots__ = ("label", "text")
+
+    def __init__(self, label: str, text: str):
+        self.label = label
+        self.text = text
+
+    @property
+    def answer(self) -> str:
+        """The option as clients send it back in answers, e.g. "A) Under $1,000" """
+        return f"{self.label}) {self.text}"
+
+    def to_dict(self) -> dict:
+        return {"label": self.label, "text": self.text}
+
+
+class Question:
+    """A multiple-choice question with its canonical id"""
+    __slots__ = ("id", "number", "text", "options")
+
+    def __init__(self, text: str, options: List[Option], number: int = 0):
+        self.id = question_id(text)
+        self.number = number
+        self.text = text
+        self.options = options
+
+    @classmethod
+    def from_parsed(cls, parsed: dict) -> "Question":
+        """Build from a question dict of the questionnaire stream parser"""
+        options = []
+        for line in parsed["options"]:
+            match = OPTION_LINE_RE.match(line)
+            if match:
+                options.append(Option(match.group(1), match.group(2).strip()))
+        return cls(parsed["question"], options, parsed.get("number", 0))
+
+    def format(self, number: int = None) -> str:
+        lines = [f"{number or self.number}. {self.text}"]
+        lines.extend(option.answer for option in self.options)
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "number": self.number, "question": self.text,
+                "options": [option.to_dict() for option in self.options]}
+
+
+class Product:
+    """A product with a normalized price and a canonical id; position is its 0-based place in its list"""
+    __slots__ = ("id", "name", "price", "position", "details", "_line")
+
+    def __init__(self, name: str, price: Optional[float], position: int = 0, details: str = "", line: str = None):
+        self.id = product_id(name)
+        self.name = name
+        self.price = price
+        self.position = position
+        self.details = details
+        self._line = line
+
+    @property
+    def price_text(self) -> str:
+        return format_price(self.price)
+
+    @property
+    def line(self) -> str:
+        """The line the product was parsed from, or its canonical "N. Name - $Price" line"""
+        if self._line is not None:
+            return self._line
+        line = f"{self.position + 1}. {self.name}"
+        if self.price is not None:
+            line += f" - {self.price_text}"
+        return f"{line} {self.details}" if self.details else line
+
+    def to_dict(self) -> dict:
+        price = int(self.price) if self.price is not None and self.price.is_integer() else self.price
+        product = {"id": self.id, "name": self.name, "price": price}
+        if self.details:
+            product["details"] = self.details
+        return product
+
+    def __repr__(self) -> str:
+        return f"Product({self.name!r}, {self.price!r}, id={self.id!r})"
+
+
+def parse_product_line(line: str, position: int) -> Product:
+    """Split a "N. Name - $Price" line into its name and numeric price"""
+    match = PRODUCT_LINE_RE.match(line)
+    if not match:
+        return Product(PRODUCT_NUMBER_RE.sub('', line).strip(), None, position, line=line)
+    return Product(match.group('name').strip(), parse_price(match.group('price')), position,
+                   match.group('rest').strip(), line)
+
+
+def parse_product(item: Union[str, dict, Product], position: int) -> Product:
+    """A product record from a product line, a product dict or an existing record"""
+    if isinstance(item, Product):
+        return item
+    if isinstance(item, dict):
+        return Product(str(item.get("name", "")).strip(), parse_price(item.get("price")), position,
+                       str(item.get("details") or "").strip())
+    return parse_product_line(str(item), position)
+
+
+def parse_products(items: Iterable[Union[str, dict, Product]]) -> List[Product]:
+    """Product records of a product list, dropping blank entries and repeats of the same name"""
+    products, seen = [], set()
+    for item in items or []:
+        product = parse_product(item, len(products))
+        # Matching ids alone are not a repeat; a product the user listed is never dropped for an id collision
+        name = " ".join(product.name.lower().split())
+        if not product.name or (product.id, name) in seen:
+            continue
+        seen.add((product.id, name))
+        products.append(product)
+    return products
+
+
+def product_lines(products: Iterable[Union[str, dict, Product]]) -> List[str]:
+    """Product lines for prompts; lines the client sent are passed through unchanged"""
+    return [product.line for product in parse_products(products)]
+
+
+def parse_questions(questionnaire: str) -> List[Question]:
+    """Question records of a finished questionnaire"""
+    return [Question.from_parsed(question) for question in parse_questionnaire(questionnaire)]
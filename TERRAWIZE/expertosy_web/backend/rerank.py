@@ -0,0 +1,134 @@
+"""
+Incremental re-ranking support for /rank-products.
+
+Users often tweak one answer and resubmit the same products. The previous
+ranking is remembered per session and product set; on resubmit the preference
+diff is computed and, when it is small, the model only receives the previous
+order plus the changed answers and returns a new order with fresh text for the
+products that moved. Per-product advantages and caveats are reused as-is.
+Requests without a session id are always ranked in full: with no session to
+scope it, the memory would replay one user's ranking against another's answers.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from records import parse_products
+
+RERANK_MEMORY_SIZE = int(os.getenv("RERANK_MEMORY_SIZE", "5000"))
+RERANK_TTL = float(os.getenv("RERANK_TTL", "3600"))
+# Above this share of changed answers a full ranking is cheaper to reason about
+RERANK_MAX_CHANGED_RATIO = float(os.getenv("RERANK_MAX_CHANGED_RATIO", "0.5"))
+
+DELTA_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def products_fingerprint(products: List[str]) -> str:
+    """Same for any listing of the same products and prices, whatever their numbering, order or formatting"""
+    keys = sorted(f"{product.id}:{product.price}" for product in parse_products(products))
+    return hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+def preference_diff(previous: dict, current: dict) -> dict:
+    """Answers that were added, removed or changed between two preference dicts"""
+    changed = {}
+    for question in previous.keys() | current.keys():
+        old, new = previous.get(question), current.get(question)
+        if old != new:
+            changed[question] = (old, new)
+    return changed
+
+
+def parse_delta(response: str) -> Tuple[List[str], dict]:
+    """Extract the new order of ids and the per-id text updates from a delta completion"""
+    match = DELTA_JSON_RE.search(response.replace('```json', '').replace('```', ''))
+    if not match:
+        return [], {}
+    try:
+        result = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return [], {}
+    order = [str(item).strip().upper() for item in result.get("order", []) if isinstance(item, (str, int))]
+    updates = {}
+    for update in result.get("updated", []):
+        if isinstance(update, dict) and update.get("id"):
+            updates[str(update["id"]).strip().upper()] = update
+    return order, updates
+
+
+def apply_delta(previous_ranking: List[dict], order: List[str], updates: dict) -> List[dict]:
+    """Reorder the previous ranking by id and refresh the text of the products the model updated"""
+    by_id = {f"P{position}": product for position, product in enumerate(previous_ranking, 1)}
+    seen = set()
+    ranked = []
+    for identifier in order + list(by_id):
+        if identifier in by_id and identifier not in seen:
+            seen.add(identifier)
+            product = dict(by_id[identifier])
+            update = updates.get(identifier, {})
+            for field in ('explanation', 'why_not_first'):
+                if isinstance(update.get(field), str) and update[field]:
+                    product[field] = update[field]
+            ranked.append(product)
+
+    for position, product in enumerate(ranked):
+        if position == 0:
+            product['why_not_first'] = ""
+        elif not product.get('why_not_first'):
+            product['why_not_first'] = f"Ranked below {ranked[0]['name']} given your updated answers"
+    return ranked
+
+
+class RankingMemory:
+    """LRU + TTL memory of the last ranking per (session, product set)"""
+
+    def __init__(self, max_entries: int = RERANK_MEMORY_SIZE, ttl: float = RERANK_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.full = 0
+        self.incremental = 0
+        self.unchanged = 0
+        self.no_session = 0
+
+    @staticmethod
+    def key(session_id: str, products: List[str]) -> tuple:
+        return (session_id, products_fingerprint(products))
+
+    def get(self, key: tuple) -> Optional[Tuple[dict, List[dict]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, preferences, ranking = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return preferences, ranking
+
+    def remember(self, key: tuple, preferences: dict, ranking: List[dict]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(preferences), ranking)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "full": self.full,
+            "incremental": self.incremental,
+            "unchanged": self.unchanged,
+            "no_session": self.no_session,
+        }
+
+
+# Process-wide memory of recent rankings
+ranking_memory = RankingMemory()
@@ -0,0 +1,168 @@
+"""
+Persistent, content-addressed store for LLM responses shared by all workers.
+
+Responses are keyed by a hash of the model, the messages and the sampling
+parameters passed to _get_completion, and kept in a SQLite database in WAL mode
+so every gunicorn/uvicorn worker on the host can read and write concurrently.
+The store outlives worker recycling (max_requests) and, when RESPONSE_STORE_PATH
+points at a mounted volume, deploys as well. Total size is bounded by evicting
+the least recently used responses.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_STORE_ENABLED = os.getenv("RESPONSE_STORE_ENABLED", "true").lower() == "true"
+RESPONSE_STORE_PATH = os.getenv(
+    "RESPONSE_STORE_PATH", os.path.join(tempfile.gettempdir(), "expertosy_responses.sqlite3")
+)
+RESPONSE_STORE_MAX_BYTES = int(os.getenv("RESPONSE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESPONSE_STORE_TTL = float(os.getenv("RESPONSE_STORE_TTL", str(7 * 86400)))
+
+# How many writes between size checks, and how far below the limit eviction goes
+EVICTION_CHECK_INTERVAL = 50
+EVICTION_TARGET_RATIO = 0.9
+
+
+def completion_key(model: str, messages: List[dict], **params) -> str:
+    """Content hash identifying a completion request"""
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseStore:
+    """SQLite/WAL backed response store safe for concurrent use across threads and processes"""
+
+    def __init__(self, path: str = RESPONSE_STORE_PATH, max_bytes: int = RESPONSE_STORE_MAX_BYTES,
+                 ttl: float = RESPONSE_STORE_TTL, enabled: bool = RESPONSE_STORE_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            try:
+                self._init_schema()
+            except sqlite3.Error as e:
+                logger.error(f"Disabling response store at {self.path}: {e}")
+                self.enabled = False
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+        return connection
+
+    def _init_schema(self):
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the stored response for key, or None if missing or expired"""
+        if not self.enabled:
+            return None
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] + self.ttl < time.time():
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Response store read failed: {e}")
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str):
+        """Store a response, evicting least recently used entries when over the size limit"""
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICTION_CHECK_INTERVAL == 1:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"Response store write failed: {e}")
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until under the size limit"""
+        connection = self._connection()
+        expired = connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        self.evictions += max(expired, 0)
+
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        freed = 0
+        victims = []
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if total - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        # Another worker may have evicted some of the same rows concurrently
+        deleted = connection.executemany("DELETE FROM responses WHERE key = ?", victims).rowcount
+        self.evictions += max(deleted, 0)
+        logger.info(f"Evicted {deleted} responses from the response store")
+
+    def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.enabled:
+            try:
+                count, size = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                stats.update({"entries": count, "bytes": size})
+            except sqlite3.Error as e:
+                logger.warning(f"Response store stats failed: {e}")
+        return stats
+
+
+# Process-wide handle; every worker opens the same database file
+response_store = ResponseStore()
@@ -0,0 +1,265 @@
+"""
+Latency-aware routing of LLM calls across OpenAI-compatible backends.
+
+With one hardwired provider, every endpoint degrades when that provider does.
+The router keeps, for each backend listed in LLM_BACKENDS (see llm_client.py),
+an EWMA of call latency per generation profile, an EWMA of its error rate and
+a circuit breaker. Latencies are kept per profile because a ranking and a list
+of factors take very different times, so only like calls are compared.
+
+Each call goes to the healthy backend with the lowest expected latency for its
+profile. A backend without a latency sample for the profile is tried first, by
+one call at a time, so every backend gets measured. A share of calls
+(LLM_ROUTER_EXPLORE) goes to another healthy backend at random, so the
+estimates for backends that are not currently preferred stay current and a
+recovered backend is noticed.
+
+A backend failing LLM_BREAKER_FAILURES calls in a row, or whose error rate EWMA
+reaches LLM_BREAKER_ERROR_RATE, is taken out of rotation for
+LLM_BREAKER_COOLDOWN seconds. After that a single probe call decides whether it
+comes back; other calls only join the probe when no other backend is healthy. A
+call failing with a backend error (connection error, timeout, rate limit, auth
+or server error) falls back to the next backend, so a degraded provider costs a
+failed attempt rather than the request. Errors in the request itself (400, 422)
+are raised as they are. When every breaker is open, calls are shed with a 503
+until the first cooldown ends.
+"""
+import os
+import time
+import random
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import openai
+from openai import AsyncOpenAI
+
+from admission import UpstreamUnavailable
+from llm_client import BACKENDS, get_llm_client
+
+logger = logging.getLogger(__name__)
+
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.3"))
+# Slower than the latency average, so a couple of failures alone do not trip the error rate threshold
+LLM_ROUTER_ERROR_ALPHA = float(os.getenv("LLM_ROUTER_ERROR_ALPHA", "0.1"))
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Errors caused by the request rather than the backend; another backend would reject it too
+REQUEST_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+BACKEND_ERRORS = (openai.APIConnectionError, openai.APIStatusError)
+
+
+class NoBackendAvailable(UpstreamUnavailable):
+    """Raised when every backend's circuit breaker is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Every LLM backend is failing", retry_after)
+
+
+class LLMBackend:
+    """An OpenAI-compatible backend with its latency and error estimates and circuit breaker"""
+
+    def __init__(self, name: str, models: Dict[str, str] = None, client: AsyncOpenAI = None,
+                 alpha: float = LLM_ROUTER_EWMA_ALPHA, error_alpha: float = LLM_ROUTER_ERROR_ALPHA):
+        self.name = name
+        self.models = models or {}
+        self.alpha = alpha
+        self.error_alpha = error_alpha
+        self._client = client
+        # profile name -> EWMA seconds of successful calls
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.trips = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        return self._client or get_llm_client(self.name)
+
+    def model(self, model: str) -> str:
+        """The backend's name for a profile's model"""
+        return self.models.get(model, model)
+
+    def available(self, now: float, cooldown: float, probing: bool = False) -> bool:
+        """Whether a call may go here; an open breaker turns half-open once its cooldown has passed"""
+        if self.state == OPEN and now - self.opened_at >= cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return probing or not self.probing
+        return self.state == CLOSED
+
+    def record_success(self, profile: str, seconds: float):
+        self.calls += 1
+        previous = self.latency.get(profile)
+        self.latency[profile] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+        self.error_rate -= self.error_alpha * self.error_rate
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            logger.info(f"LLM backend {self.name} recovered; closing its circuit breaker")
+        self.state = CLOSED
+
+    def record_failure(self, failures: int, error_rate: float):
+        """Count a failed call, opening the breaker past failures in a row or the error rate"""
+        self.calls += 1
+        self.failures += 1
+        self.error_rate += self.error_alpha * (1.0 - self.error_rate)
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= failures or self.error_rate >= error_rate:
+            if self.state != OPEN:
+                self.trips += 1
+                logger.warning(f"Opening circuit breaker of LLM backend {self.name} "
+                               f"({self.consecutive_failures} failures in a row, error rate {self.error_rate:.2f})")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "latency": {profile: round(seconds, 3) for profile, seconds in self.latency.items()},
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "trips": self.trips,
+        }
+
+
+class LLMRouter:
+    """Send each completion to the fastest healthy backend, falling back to the others when it fails"""
+
+    def __init__(self, backends: List[LLMBackend], explore: float = LLM_ROUTER_EXPLORE,
+                 failures: int = LLM_BREAKER_FAILURES, error_rate: float = LLM_BREAKER_ERROR_RATE,
+                 cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.backends = backends
+        self.explore = explore
+        self.failures = failures
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.fallbacks = 0
+        self.explored = 0
+        self.shed = 0
+
+    @classmethod
+    def from_config(cls) -> "LLMRouter":
+        return cls([LLMBackend(name, config["models"]) for name, config in BACKENDS.items()])
+
+    @classmethod
+    def for_client(cls, client: AsyncOpenAI) -> "LLMRouter":
+        """A router over one given client, for engines created with their own"""
+        return cls([LLMBackend("client", client=client)])
+
+    def pick(self, profile: str, exclude: Tuple[LLMBackend, ...] = ()) -> Optional[LLMBackend]:
+        """The backend for the next call of a profile (its latency key), or None if none is available"""
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends
+                      if backend not in exclude and backend.available(now, self.cooldown)]
+        if not candidates:
+            # Rather than shedding, share a probe that is already in flight
+            candidates = [backend for backend in self.backends
+                          if backend not in exclude and backend.available(now, self.cooldown, probing=True)]
+            return candidates[0] if candidates else None
+        # A backend whose cooldown has passed gets its probe ahead of everyone else
+        probe = next((backend for backend in candidates if backend.state == HALF_OPEN), None)
+        if probe is not None:
+            return probe
+        unmeasured = [backend for backend in candidates if profile not in backend.latency and not backend.in_flight]
+        if unmeasured:
+            return unmeasured[0]
+        measured = [backend for backend in candidates if profile in backend.latency]
+        best = min(measured, key=lambda backend: backend.latency[profile]) if measured else candidates[0]
+        if len(candidates) > 1 and random.random() < self.explore:
+            self.explored += 1
+            return random.choice([backend for backend in candidates if backend is not best])
+        return best
+
+    def _retry_after(self) -> float:
+        now = time.monotonic()
+        return min(max(self.cooldown - (now - backend.opened_at), 0) for backend in self.backends
+                   if backend.opened_at is not None)
+
+    async def create(self, profile, messages: List[dict], timeout: float = None, **params) -> tuple:
+        """
+        chat.completions.create on the best backend, falling back to the others on backend errors.
+
+        Returns the backend that answered and its response. Attempts share the timeout. Non-streamed calls have
+        their latency recorded here; for streams (stream=True) the caller records the outcome once the stream ends.
+        """
+        started = time.monotonic()
+        key = self._latency_key(profile, params.get("stream", False))
+        tried, error = (), None
+        while True:
+            backend = self.pick(key, tried)
+            if backend is None:
+                if error is not None:
+                    raise error
+                self.shed += 1
+                raise NoBackendAvailable(self._retry_after())
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            if remaining is not None and remaining <= 0 and error is not None:
+                raise error
+            if tried:
+                self.fallbacks += 1
+            tried += (backend,)
+
+            attempt_started = time.monotonic()
+            probe = backend.state == HALF_OPEN
+            backend.probing = backend.probing or probe
+            backend.in_flight += 1
+            try:
+                response = await backend.client.chat.completions.create(
+                    model=backend.model(profile.model),
+                    messages=messages,
+                    **params,
+                    **({"timeout": max(remaining, 0.1)} if remaining is not None else {})
+                )
+            except REQUEST_ERRORS:
+                raise
+            except BACKEND_ERRORS as e:
+                backend.record_failure(self.failures, self.error_rate)
+                logger.warning(f"LLM backend {backend.name} failed ({type(e).__name__}: {e}); trying the next one")
+                error = e
+                continue
+            finally:
+                backend.in_flight -= 1
+                if probe:
+                    backend.probing = False
+            if not params.get("stream"):
+                backend.record_success(key, time.monotonic() - attempt_started)
+            return backend, response
+
+    @staticmethod
+    def _latency_key(profile, stream: bool) -> str:
+        # A stream's duration depends on its reader too, so streams are only compared with streams
+        return f"{profile.name} (stream)" if stream else profile.name
+
+    def record_stream(self, backend: LLMBackend, profile, seconds: float = None):
+        """Record how a stream from the backend ended: its duration, or None if it failed part way"""
+        if seconds is None:
+            backend.record_failure(self.failures, self.error_rate)
+        else:
+            backend.record_success(self._latency_key(profile, True), seconds)
+
+    def stats(self) -> dict:
+        return {
+            "fallbacks": self.fallbacks,
+            "explored": self.explored,
+            "shed": self.shed,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+
+# Process-wide router over the configured backends
+llm_router = LLMRouter.from_config()
@@ -0,0 +1,247 @@
+"""
+Server-side ranking sessions.
+
+A ranking session holds the product list, the ranking questions already asked
+and the user's answers, so after creating it the client only sends its session
+id and the answers of the latest round instead of resending the products and
+an ever-growing previous_questions list every time. Questions are stored once,
+keyed by a short hash of their normalized text, and answers refer to those ids.
+Only the most recent questions go back into the ranking questionnaire prompt,
+so its size stays flat however many rounds a session runs.
+
+Sessions expire after SESSION_TTL seconds without use. The in-memory backend
+only serves the worker that created the session; run with SESSION_BACKEND=redis
+and any Redis-compatible server when there is more than one worker.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+# memory or redis
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+# Previously asked questions included in the ranking questionnaire prompt
+SESSION_PROMPT_QUESTIONS = int(os.getenv("SESSION_PROMPT_QUESTIONS", "15"))
+
+QUESTION_NUMBER_RE = re.compile(r'^\s*\d+[.)]\s*')
+NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+
+def question_id(question: str) -> str:
+    """Short stable id of a question, ignoring numbering, case and punctuation"""
+    text = NON_WORD_RE.sub(' ', QUESTION_NUMBER_RE.sub('', question).lower()).strip()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+
+class SessionNotFound(KeyError):
+    """Raised for an unknown or expired session id"""
+
+
+class InvalidAnswers(ValueError):
+    """Raised for answers that are not an object mapping questions to answers"""
+
+
+class RankingSession:
+    """Products, asked questions and answers of one user's ranking rounds"""
+
+    def __init__(self, session_id: str, search_query: str, products: List[str], questions: Dict[str, str] = None,
+                 answers: Dict[str, str] = None, rounds: int = 0, created_at: float = None):
+        self.id = session_id
+        self.search_query = search_query
+        self.products = list(products)
+        # question id -> question text, in the order they were asked
+        self.questions = dict(questions or {})
+        # question id -> answer text
+        self.answers = dict(answers or {})
+        self.rounds = rounds
+        self.created_at = created_at or time.time()
+
+    def add_questions(self, questions: Iterable[str]) -> List[str]:
+        """Record asked questions and return their ids; repeats keep their first wording"""
+        ids = []
+        for question in questions:
+            identifier = question_id(question)
+            self.questions.setdefault(identifier, QUESTION_NUMBER_RE.sub('', question).strip())
+            ids.append(identifier)
+        self.rounds += 1
+        return ids
+
+    def record_answers(self, answers: dict):
+        """Store answers keyed by question id or by question text"""
+        if not isinstance(answers, dict):
+            raise InvalidAnswers(f"answers must be an object, not {type(answers).__name__}")
+        for key, answer in answers.items():
+            identifier = key if key in self.questions else question_id(key)
+            if identifier not in self.questions:
+                self.questions[identifier] = key
+            self.answers[identifier] = answer
+
+    def recent_questions(self, limit: int = SESSION_PROMPT_QUESTIONS) -> List[str]:
+        return list(self.questions.values())[-limit:] if limit > 0 else []
+
+    def preferences(self) -> dict:
+        """Answers keyed by question text, in the shape the ranking prompts expect"""
+        return {self.questions[identifier]: answer for identifier, answer in self.answers.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "search_query": self.search_query,
+            "products": self.products,
+            "questions": self.questions,
+            "answers": self.answers,
+            "rounds": self.rounds,
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RankingSession":
+        return cls(data["id"], data.get("search_query", ""), data.get("products", []), data.get("questions"),
+                   data.get("answers"), data.get("rounds", 0), data.get("created_at"))
+
+    def summary(self) -> dict:
+        return {
+            "session_id": self.id,
+            "search_query": self.search_query,
+            "products": len(self.products),
+            "rounds": self.rounds,
+            "questions": [{"id": identifier, "question": question, "answer": self.answers.get(identifier)}
+                          for identifier, question in self.questions.items()],
+        }
+
+
+class MemorySessionBackend:
+    """LRU + TTL dict of serialized sessions, local to this worker"""
+    name = "memory"
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, session_id: str, ttl: float) -> Optional[str]:
+        """The session's payload, extending its expiry by ttl"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._entries[session_id]
+                return None
+            self._entries[session_id] = (time.monotonic() + ttl, payload)
+            self._entries.move_to_end(session_id)
+            return payload
+
+    async def put(self, session_id: str, payload: str, ttl: float):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + ttl, payload)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisSessionBackend:
+    """Sessions in any Redis-compatible server, shared by every worker; expiry is left to the server"""
+    name = "redis"
+
+    def __init__(self, url: str = SESSION_REDIS_URL, client=None, prefix: str = "expertosy:session:"):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("SESSION_BACKEND=redis needs the redis package (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, session_id: str, ttl: float) -> Optional[str]:
+        payload = await self.client.getex(self.prefix + session_id, px=int(ttl * 1000))
+        return payload.decode("utf-8") if isinstance(payload, bytes) else payload
+
+    async def put(self, session_id: str, payload: str, ttl: float):
+        await self.client.set(self.prefix + session_id, payload, px=int(ttl * 1000))
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self.prefix + session_id)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class SessionStore:
+    """Create, load and save ranking sessions on a pluggable backend"""
+
+    def __init__(self, backend=None, ttl: float = SESSION_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        # Saves of one session are serialized so concurrent rounds do not drop each other's questions
+        self._locks = {}
+        self.created = 0
+        self.loaded = 0
+        self.missing = 0
+
+    def _backend(self):
+        if self.backend is None:
+            self.backend = RedisSessionBackend() if SESSION_BACKEND == "redis" else MemorySessionBackend()
+        return self.backend
+
+    async def create(self, search_query: str, products: List[str]) -> RankingSession:
+        session = RankingSession(secrets.token_urlsafe(12), search_query or "", products)
+        await self.save(session)
+        self.created += 1
+        return session
+
+    async def get(self, session_id: str) -> RankingSession:
+        payload = await self._backend().get(session_id, self.ttl) if session_id else None
+        if payload is None:
+            self.missing += 1
+            raise SessionNotFound(session_id)
+        self.loaded += 1
+        return RankingSession.from_dict(json.loads(payload))
+
+    async def save(self, session: RankingSession):
+        payload = json.dumps(session.to_dict(), separators=(",", ":"), ensure_ascii=False)
+        await self._backend().put(session.id, payload, self.ttl)
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Per-session lock for read-modify-write updates within this worker"""
+        if len(self._locks) > SESSION_MAX_ENTRIES:
+            for key in [key for key, lock in self._locks.items() if not lock.locked()]:
+                del self._locks[key]
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    async def delete(self, session_id: str):
+        await self._backend().delete(session_id)
+        self._locks.pop(session_id, None)
+
+    def stats(self) -> dict:
+        backend = self._backend()
+        return {
+            "backend": backend.name,
+            "ttl": self.ttl,
+            "sessions": backend.size(),
+            "created": self.created,
+            "loaded": self.loaded,
+            "missing": self.missing,
+        }
+
+
+# Process-wide session store
+session_store = SessionStore()
@@ -0,0 +1,182 @@
+"""
+Request coalescing ("single-flight") for identical in-flight LLM calls.
+
+Within a worker, concurrent callers with the same key await one shared task.
+Across workers, the leader holds an flock on a per-key lock file while it calls
+upstream; leaders in other workers wait on that lock and poll a shared result
+source (the response store) so they can reuse the result instead of repeating
+the call. A follower waits at most SINGLEFLIGHT_DEADLINE_SHARE of what is left
+of its request's deadline, so a stuck leader in another worker cannot hold it
+past its budget; after that it makes its own upstream call.
+
+The shared call runs in its own task and is cancelled only once every caller
+waiting for it has been cancelled, e.g. because all their clients left.
+"""
+import os
+import time
+import errno
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from hedging import remaining_budget
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms only coalesce within a worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_CROSS_WORKER = os.getenv("SINGLEFLIGHT_CROSS_WORKER", "true").lower() == "true"
+SINGLEFLIGHT_LOCK_DIR = os.getenv("SINGLEFLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "expertosy_singleflight"))
+SINGLEFLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT", "90"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.05"))
+# Share of the remaining request deadline a follower may spend waiting, leaving the rest for its own call
+SINGLEFLIGHT_DEADLINE_SHARE = float(os.getenv("SINGLEFLIGHT_DEADLINE_SHARE", "0.5"))
+
+
+class WorkerLock:
+    """Non-blocking flock on a per-key lock file shared by all workers on the host"""
+
+    def __init__(self, key: Hashable, lock_dir: str = SINGLEFLIGHT_LOCK_DIR):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        self.path = os.path.join(lock_dir, f"{digest}.lock")
+        self._fd: Optional[int] = None
+
+    def try_acquire(self) -> bool:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        # Unlinking is only housekeeping: a racing worker that opened the old
+        # inode may still lead once more, which costs a duplicate call at worst.
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class Flight:
+    """A shared call and the number of callers waiting for it"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+
+    def __init__(self, name: str, cross_worker: bool = False):
+        self.name = name
+        self.cross_worker = cross_worker and SINGLEFLIGHT_CROSS_WORKER and fcntl is not None
+        self._inflight = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.collapsed_cross_worker = 0
+        self.abandoned = 0
+        self.wait_timeouts = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 shared_result: Optional[Callable[[], Optional[Any]]] = None) -> Any:
+        """
+        Run fn once for all concurrent callers with this key.
+
+        shared_result, when given, is a blocking lookup of a result published by
+        another worker; it enables cross-worker coalescing.
+        """
+        flight = self._inflight.get(key)
+        if flight is None:
+            if self.cross_worker and shared_result is not None:
+                call = self._run_with_worker_lock(key, fn, shared_result)
+            else:
+                call = fn()
+            # The task copies the leader's context, so the call keeps its deadline and priority
+            flight = self._inflight[key] = Flight(asyncio.ensure_future(call))
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Every caller was cancelled, so nobody will read the result
+                self.abandoned += 1
+                self._inflight.pop(key, None)
+                flight.task.cancel()
+
+    def _finished(self, key: Hashable, flight: Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every caller has left
+        flight.task.cancelled() or flight.task.exception()
+
+    async def _run_with_worker_lock(self, key: Hashable, fn, shared_result) -> Any:
+        lock = WorkerLock((self.name, key))
+        wait = SINGLEFLIGHT_LOCK_TIMEOUT
+        budget = remaining_budget()
+        if budget is not None:
+            wait = min(wait, max(budget, 0) * SINGLEFLIGHT_DEADLINE_SHARE)
+        deadline = time.monotonic() + wait
+        waited = False
+        while not lock.try_acquire():
+            waited = True
+            result = await asyncio.to_thread(shared_result)
+            if result is not None:
+                self.collapsed_cross_worker += 1
+                return result
+            if time.monotonic() > deadline:
+                self.wait_timeouts += 1
+                logger.warning(f"Gave up waiting {wait:.1f}s for another worker on {self.name} call; calling upstream")
+                return await fn()
+            await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+
+        try:
+            if waited:
+                # The previous holder may have published its result just before releasing
+                result = await asyncio.to_thread(shared_result)
+                if result is not None:
+                    self.collapsed_cross_worker += 1
+                    return result
+            return await fn()
+        finally:
+            lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "collapsed": self.collapsed,
+            "collapsed_cross_worker": self.collapsed_cross_worker,
+            "abandoned": self.abandoned,
+            "wait_timeouts": self.wait_timeouts,
+            "cross_worker": self.cross_worker,
+        }
+
+
+# Upstream completions, keyed by the completion hash; results are shared across workers via the response store
+completion_flight = SingleFlight("completion", cross_worker=True)
+# Engine-level calls keyed by the normalized search query, so "Laptop" and "laptops" collapse too
+query_flight = SingleFlight("query")
@@ -0,0 +1,118 @@
+"""
+Speculative background work keyed by an opaque token.
+
+After /generate-factors the frontend always asks for the questionnaire, so the
+questionnaire completion is started speculatively and its token returned with
+the factors. The follow-up request claims the token and awaits the finished or
+still running task instead of starting a second sequential LLM round-trip.
+
+Speculation is bounded: only a limited number of tasks may run at once, and
+tasks nobody claims within the TTL are cancelled and dropped.
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "8"))
+SPECULATION_MAX_PENDING = int(os.getenv("SPECULATION_MAX_PENDING", "200"))
+SPECULATION_TTL = float(os.getenv("SPECULATION_TTL", "120"))
+
+
+class Speculation:
+    __slots__ = ("task", "match_key", "created_at")
+
+    def __init__(self, task: asyncio.Task, match_key: Hashable):
+        self.task = task
+        self.match_key = match_key
+        self.created_at = time.monotonic()
+
+
+class SpeculationManager:
+    """Run bounded speculative tasks and hand them to the request that claims their token"""
+
+    def __init__(self, max_inflight: int = SPECULATION_MAX_INFLIGHT, max_pending: int = SPECULATION_MAX_PENDING,
+                 ttl: float = SPECULATION_TTL, enabled: bool = SPECULATION_ENABLED):
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.enabled = enabled
+        self._speculations = {}
+        self.started = 0
+        self.rejected = 0
+        self.claimed = 0
+        self.mismatched = 0
+        self.abandoned = 0
+
+    def start(self, match_key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Optional[str]:
+        """Start fn in the background and return its token, or None when over budget"""
+        if not self.enabled:
+            return None
+        self._sweep()
+        if self.inflight >= self.max_inflight or len(self._speculations) >= self.max_pending:
+            self.rejected += 1
+            return None
+
+        token = uuid.uuid4().hex
+        task = asyncio.get_running_loop().create_task(fn())
+        # Speculative failures are reported to whoever claims them, never logged as unretrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._speculations[token] = Speculation(task, match_key)
+        self.started += 1
+        return token
+
+    def claim(self, token: str, match_key: Hashable) -> Optional[asyncio.Task]:
+        """Take ownership of a speculation if its inputs match the follow-up request"""
+        speculation = self._speculations.pop(token, None)
+        if speculation is None:
+            return None
+        if speculation.match_key != match_key:
+            # The client changed its inputs since the speculation started
+            self.mismatched += 1
+            speculation.task.cancel()
+            return None
+        self.claimed += 1
+        return speculation.task
+
+    @property
+    def inflight(self) -> int:
+        return sum(1 for speculation in self._speculations.values() if not speculation.task.done())
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = [token for token, speculation in self._speculations.items()
+                   if now - speculation.created_at > self.ttl]
+        for token in expired:
+            speculation = self._speculations.pop(token)
+            if not speculation.task.done():
+                speculation.task.cancel()
+            self.abandoned += 1
+        if expired:
+            logger.info(f"Dropped {len(expired)} abandoned speculations")
+
+    def cancel_all(self):
+        for speculation in self._speculations.values():
+            speculation.task.cancel()
+        self._speculations.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._speculations),
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "started": self.started,
+            "rejected": self.rejected,
+            "claimed": self.claimed,
+            "mismatched": self.mismatched,
+            "abandoned": self.abandoned,
+        }
+
+
+# Process-wide manager for speculative questionnaire generation
+speculations = SpeculationManager()
@@ -0,0 +1,223 @@
+"""
+Incremental parsers and Server-Sent Events helpers for streamed completions.
+
+The parsers are fed raw completion deltas as they arrive and hand back whole
+units (a complete A)-D) question, a complete ranked product) as soon as they
+can be parsed, so the client can render useful content long before the
+completion finishes.
+"""
+import re
+import json
+from typing import List, Optional, Tuple
+
+QUESTION_RE = re.compile(r'^\s*(\d+)[.)]\s+(.*\S)\s*$')
+OPTION_RE = re.compile(r'^\s*([A-D])\)\s*(.*\S)\s*$')
+RANKED_PRODUCTS_RE = re.compile(r'"ranked_products"\s*:\s*\[')
+FENCE_RE = re.compile(r'```(?:json)?', re.IGNORECASE)
+
+
+def sse_event(event: str, data) -> str:
+    """Format a single Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+class QuestionnaireStreamParser:
+    """Emit numbered multiple-choice questions once all their A)-D) options are parsed"""
+
+    def __init__(self):
+        self._pending = ""
+        self._current: Optional[dict] = None
+        self.emitted = 0
+
+    def feed(self, text: str) -> List[dict]:
+        """Consume a completion delta and return any questions it completed"""
+        self._pending += text
+        *lines, self._pending = self._pending.split('\n')
+        completed = []
+        for line in lines:
+            question = self._consume_line(line)
+            if question:
+                completed.append(question)
+        return completed
+
+    def close(self) -> List[dict]:
+        """Flush the trailing line and any question that was still open"""
+        completed = []
+        if self._pending:
+            question = self._consume_line(self._pending)
+            self._pending = ""
+            if question:
+                completed.append(question)
+        question = self._finish_current()
+        if question:
+            completed.append(question)
+        return completed
+
+    def _consume_line(self, line: str) -> Optional[dict]:
+        option = OPTION_RE.match(line)
+        if option and self._current is not None:
+            self._current["options"].append(f"{option.group(1)}) {option.group(2)}")
+            self._current["raw"].append(line.strip())
+            if option.group(1) == 'D':
+                return self._finish_current()
+            return None
+
+        question = QUESTION_RE.match(line)
+        if question:
+            finished = self._finish_current()
+            self._current = {
+                "number": int(question.group(1)),
+                "question": question.group(2),
+                "options": [],
+                "raw": [line.strip()],
+            }
+            return finished
+        return None
+
+    def _finish_current(self) -> Optional[dict]:
+        current, self._current = self._current, None
+        if not current or not current["options"]:
+            return None
+        self.emitted += 1
+        current["raw"] = "\n".join(current["raw"])
+        return current
+
+
+def parse_questionnaire(questionnaire: str) -> List[dict]:
+    """Every complete question of a finished questionnaire"""
+    parser = QuestionnaireStreamParser()
+    return parser.feed(questionnaire) + parser.close()
+
+
+class RankedProductStreamParser:
+    """Emit each object of the ``ranked_products`` JSON array as soon as it closes"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        self._in_array = False
+        # Closing brackets owed by the object being parsed, innermost last
+        self._closers = []
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        # Structural commas of the open object with the closers owed at each, for repairing a truncated tail
+        self._commas = []
+        self.closed = False
+        self.emitted = 0
+
+    def feed(self, text: str) -> List[dict]:
+        """Consume a completion delta and return any products it completed"""
+        self._buffer += text
+        if self.closed or (not self._in_array and not self._find_array()):
+            return []
+
+        completed = []
+        buffer = self._buffer
+        for index in range(self._position, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == '{' or (char == '[' and self._closers):
+                if not self._closers:
+                    self._object_start = index
+                    self._commas = []
+                self._closers.append('}' if char == '{' else ']')
+            elif char in '}]' and self._closers:
+                self._closers.pop()
+                if not self._closers and self._object_start is not None:
+                    product = self._decode(buffer[self._object_start:index + 1])
+                    self._object_start = None
+                    if product is not None:
+                        completed.append(product)
+            elif char == ',' and self._closers:
+                self._commas.append((index, "".join(reversed(self._closers))))
+            elif char == ']':
+                # End of the ranked_products array; anything after it is not a product
+                self.closed = True
+                self._position = index + 1
+                return completed
+        self._position = len(buffer)
+        return completed
+
+    def partial(self) -> Optional[dict]:
+        """Best-effort decode of a product object cut off mid-way, keeping the fields that were complete"""
+        if self.closed or self._object_start is None:
+            return None
+        text = self._buffer[self._object_start:]
+        # A string cut off mid-way is never trusted; close the object as-is only between values
+        candidates = [] if self._in_string else [text + "".join(reversed(self._closers))]
+        # Otherwise drop the half-written member after the last comma that still yields valid JSON
+        for index, closers in reversed(self._commas):
+            candidates.append(self._buffer[self._object_start:index] + closers)
+        for candidate in candidates:
+            try:
+                product = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(product, dict):
+                return product
+        return None
+
+    def _find_array(self) -> bool:
+        match = RANKED_PRODUCTS_RE.search(self._buffer)
+        if match:
+            self._position = match.end()
+        else:
+            # Tolerate a bare top-level array in place of the wrapper object
+            stripped = FENCE_RE.sub('', self._buffer).lstrip()
+            if not stripped.startswith('['):
+                return False
+            self._position = self._buffer.index('[') + 1
+        self._in_array = True
+        return True
+
+    def _decode(self, text: str) -> Optional[dict]:
+        try:
+            product = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(product, dict):
+            return None
+        self.emitted += 1
+        return product
+
+
+def salvage_ranked_products(response: str) -> Tuple[List[dict], bool]:
+    """
+    Every product object that can be recovered from a ranking response, and whether the array was complete.
+
+    Well-formed JSON takes the fast path. Otherwise markdown fences and surrounding prose are skipped,
+    every closed product object is kept and a product cut off by max_tokens is kept with its complete fields.
+    """
+    text = FENCE_RE.sub('', response).strip()
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError:
+        result = None
+    if isinstance(result, dict) and isinstance(result.get('ranked_products'), list):
+        result = result['ranked_products']
+    if isinstance(result, list):
+        return [product for product in result if isinstance(product, dict)], True
+
+    parser = RankedProductStreamParser()
+    products = parser.feed(text)
+    partial = parser.partial()
+    if partial is not None:
+        products.append(partial)
+    return products, parser.closed
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from admission import (
+    AdmissionController, AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+)
+
+WAITS = {PRIORITY_INTERACTIVE: 5, PRIORITY_NORMAL: 5, PRIORITY_BACKGROUND: 5}
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_wait=WAITS)
+        admission.average_latency = 0.1
+        held = await admission.acquire(PRIORITY_NORMAL)
+        order = []
+
+        async def call(name, priority):
+            async with admission.slot(priority=priority):
+                order.append(name)
+
+        waiters = [asyncio.ensure_future(call(name, priority)) for name, priority in [
+            ("background", PRIORITY_BACKGROUND), ("normal", PRIORITY_NORMAL),
+            ("interactive", PRIORITY_INTERACTIVE), ("normal 2", PRIORITY_NORMAL),
+        ]]
+        await asyncio.sleep(0)
+        assert admission.stats()["waiting"] == 4
+        admission.release(held, 0.1)
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "normal", "normal 2", "background"]
+
+
+def test_full_queue_displaces_lower_priority_waiters():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_queue=1, max_wait=WAITS)
+        admission.average_latency = 0.1
+        held = await admission.acquire(PRIORITY_NORMAL)
+        background = asyncio.ensure_future(admission.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(admission.acquire(PRIORITY_INTERACTIVE))
+        with pytest.raises(AdmissionRejected):
+            await background
+        # Nothing below normal priority is waiting now, so another normal call is the one shed
+        with pytest.raises(AdmissionRejected):
+            await admission.acquire(PRIORITY_NORMAL)
+        admission.release(held, 0.1)
+        await interactive
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert stats["rejected"] == {"interactive": 0, "normal": 1, "background": 1}
+    assert stats["admitted"]["interactive"] == 1
+
+
+def test_long_expected_wait_is_rejected_at_once():
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_wait={**WAITS, PRIORITY_BACKGROUND: 2})
+        admission.average_latency = 10
+        await admission.acquire(PRIORITY_NORMAL)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(PRIORITY_BACKGROUND)
+        assert rejected.value.retry_after == 10
+
+    asyncio.run(run())
+
+
+def test_tokens_per_minute_budget():
+    async def run():
+        admission = AdmissionController(max_concurrency=4, tokens_per_minute=1000, max_wait=WAITS)
+        first = await admission.acquire(PRIORITY_NORMAL, 800)
+        # Slots are free, but the budget only frees up once the reservation leaves the one-minute window
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(PRIORITY_NORMAL, 400)
+        assert 55 <= rejected.value.retry_after <= 60
+        # The call used fewer tokens than estimated, which gives the difference back at once
+        admission.record_usage(first, 300)
+        await admission.acquire(PRIORITY_NORMAL, 400)
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert stats["tokens_in_window"] == 700 and stats["active"] == 2
+
+
+def test_oversized_call_is_admitted_when_idle():
+    async def run():
+        admission = AdmissionController(tokens_per_minute=100, max_wait=WAITS)
+        async with admission.slot(5000):
+            assert admission.active == 1
+
+    asyncio.run(run())
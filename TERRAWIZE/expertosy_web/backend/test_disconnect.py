@@ -0,0 +1,79 @@
+import asyncio
+
+from profiles import GenerationProfile
+from disconnect import DisconnectMiddleware, CancellationTracker, RequestState, current_request
+
+PROFILE = GenerationProfile("rank_products", "model", 1000, 0.2)
+SCOPE = {"type": "http", "path": "/rank-products"}
+
+
+def slow_app(seen: list):
+    """An endpoint waiting on a long LLM call, recording whether it was cancelled"""
+
+    async def app(scope, receive, send):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            seen.append("cancelled")
+            raise
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    return app
+
+
+def test_disconnect_cancels_the_handler():
+    seen, sent = [], []
+    tracker = CancellationTracker()
+    middleware = DisconnectMiddleware(slow_app(seen), tracker)
+
+    async def receive():
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asyncio.wait_for(middleware(SCOPE, receive, send), 1))
+    assert seen == ["cancelled"] and sent == []
+    assert tracker.disconnects == 1
+
+
+def test_disconnect_after_the_response_cancels_nothing():
+    sent = []
+    tracker = CancellationTracker()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(DisconnectMiddleware(app, tracker)(SCOPE, receive, send))
+    assert len(sent) == 2 and tracker.disconnects == 0
+
+
+def test_cancelled_calls_estimate_the_tokens_they_saved():
+    tracker = CancellationTracker(smoothing=1.0)
+    # Nothing has finished yet, so a call never sent saves its whole max_tokens
+    assert tracker.record_cancelled(PROFILE) == 1000
+    tracker.record_completion(PROFILE, 400, 4.0)
+    # A quarter of the way through a typical call
+    assert tracker.record_cancelled(PROFILE, seconds=1.0) == 300
+    # A stream that had received 100 tokens
+    assert tracker.record_cancelled(PROFILE, seconds=1.0, received_tokens=100) == 300
+    assert tracker.stats()["cancelled_calls"] == {"other": 3}
+
+    state = RequestState()
+    state.disconnected = True
+    token = current_request.set(state)
+    try:
+        tracker.record_cancelled(PROFILE, seconds=8.0)
+    finally:
+        current_request.reset(token)
+    assert tracker.cancelled["disconnect"] == 1 and tracker.tokens_saved["disconnect"] == 0
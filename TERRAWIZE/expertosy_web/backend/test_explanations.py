@@ -0,0 +1,58 @@
+import json
+import asyncio
+
+from app import ExpertosyRecommendationEngine
+
+PRODUCTS = ["1. Dell XPS 15 - $1,499", "2. MacBook Air M1 - $999", "3. Acer Swift 3 - $699"]
+PREFERENCES = {"What is your budget?": "A) Under $1,000"}
+
+
+def explained(*names: str) -> str:
+    """A ranking answer with text naming the product it belongs to"""
+    return json.dumps({"ranked_products": [
+        {"name": name, "price": "$1", "explanation": f"About {name}", "advantages": [f"{name} advantage"],
+         "why_not_first": f"{name} is not first", "product_caveats": [f"{name} caveat"]}
+        for name in names
+    ]})
+
+
+def engine_answering(answer: str) -> ExpertosyRecommendationEngine:
+    engine = ExpertosyRecommendationEngine("laptop")
+
+    async def get_completion(messages, profile="default"):
+        return answer
+
+    engine._get_completion = get_completion
+    return engine
+
+
+def test_explain_ranking_matches_reordered_and_skipped_products_by_id():
+    engine = engine_answering(explained("Acer Swift 3", "Dell XPS 15"))
+    ranked = engine.rank_products_locally(PRODUCTS, PREFERENCES)
+    local_text = {product["name"]: product["explanation"] for product in ranked}
+
+    merged = asyncio.run(engine.explain_ranking(ranked, PREFERENCES))
+    assert [product["name"] for product in merged] == [product["name"] for product in ranked]
+    by_name = {product["name"]: product for product in merged}
+    assert by_name["Acer Swift 3"]["explanation"] == "About Acer Swift 3"
+    assert by_name["Dell XPS 15"]["advantages"] == ["Dell XPS 15 advantage"]
+    # Skipped by the model, so it keeps the local ranker's text
+    assert by_name["MacBook Air M1"]["explanation"] == local_text["MacBook Air M1"]
+    assert merged[0]["why_not_first"] == ""
+
+
+def test_complete_ranking_matches_follow_up_text_by_id():
+    # Cut off after its first product, so the other two are ranked locally and explained by a follow-up call
+    truncated = explained("Dell XPS 15")[:-2] + ', {"name": "MacB'
+    engine = engine_answering(explained("Acer Swift 3"))
+    local_text = {product["name"]: product["explanation"]
+                  for product in engine.rank_products_locally(PRODUCTS, PREFERENCES)}
+
+    ranked = asyncio.run(engine._complete_ranking(PRODUCTS, PREFERENCES, truncated))
+    by_name = {product["name"]: product for product in ranked}
+    assert ranked[0]["name"] == "Dell XPS 15"
+    assert sorted(by_name) == ["Acer Swift 3", "Dell XPS 15", "MacBook Air M1"]
+    assert by_name["Dell XPS 15"]["explanation"] == "About Dell XPS 15"
+    assert by_name["Acer Swift 3"]["explanation"] == "About Acer Swift 3"
+    # The follow-up answer skipped it, so it keeps the local text rather than another product's
+    assert by_name["MacBook Air M1"]["explanation"] == local_text["MacBook Air M1"]
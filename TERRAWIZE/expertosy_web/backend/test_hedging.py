@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import hedging
+from hedging import Hedger, DeadlineExceeded, LatencyHistogram, deadline_scope
+
+
+@pytest.fixture(autouse=True)
+def short_hedge_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.1)
+
+
+def attempts(*latencies, queued=0.0):
+    """fn for Hedger.call whose nth attempt waits queued seconds for admission (the first only) and then answers"""
+    started, cancelled = [], []
+
+    async def fn(timeout, sent):
+        attempt = len(started)
+        started.append(attempt)
+        if attempt == 0:
+            await asyncio.sleep(queued)
+        sent()
+        try:
+            await asyncio.sleep(latencies[attempt])
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    return fn, started, cancelled
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    hedger = Hedger(enabled=True)
+    fn, started, cancelled = attempts(5.0, 0.01)
+
+    async def run():
+        result = await hedger.call(fn)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 1
+    assert started == [0, 1] and cancelled == [0]
+    assert (hedger.hedged, hedger.hedge_wins) == (1, 1)
+
+
+def test_time_queued_for_admission_does_not_trigger_a_hedge():
+    hedger = Hedger(enabled=True)
+    fn, started, _ = attempts(0.05, queued=0.3)
+    assert asyncio.run(hedger.call(fn)) == 0
+    assert started == [0] and hedger.hedged == 0
+
+
+def test_records_the_primarys_time_when_the_hedge_wins():
+    hedger = Hedger(enabled=True)
+    fn, _, _ = attempts(5.0, 0.01)
+    asyncio.run(hedger.call(fn))
+    # The primary had been upstream past the hedge delay, not just the hedge's 10 ms
+    assert hedger.histograms["default"].percentile(0.5) >= 0.1
+
+
+def test_deadline_exceeded():
+    hedger = Hedger(enabled=False)
+    fn, _, cancelled = attempts(5.0)
+
+    async def run():
+        with deadline_scope("/rank-products", 0.05):
+            with pytest.raises(DeadlineExceeded):
+                await hedger.call(fn)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert hedger.deadline_exceeded == 1 and cancelled == [0]
+
+
+def test_histogram_percentile_and_decay():
+    histogram = LatencyHistogram(half_life=4)
+    for seconds in (0.1, 0.1, 0.1, 2.0):
+        histogram.record(seconds)
+    assert histogram.percentile(0.5) < 0.15 < 2.0 <= histogram.percentile(1.0)
+    assert sum(histogram.counts) == 2
@@ -0,0 +1,103 @@
+import time
+import asyncio
+
+import pytest
+
+from jobs import JobManager, JobNotFound, JobQueueFull, SUCCEEDED, FAILED, CANCELLED, QUEUED, RUNNING
+from hedging import remaining_budget
+
+
+def sleeper(seconds: float, result="done"):
+    async def fn():
+        await asyncio.sleep(seconds)
+        return result
+
+    return lambda: fn()
+
+
+def test_job_runs_under_its_own_deadline_and_keeps_its_result():
+    async def run():
+        manager = JobManager(workers=1, deadline=240)
+
+        async def fn():
+            return remaining_budget()
+
+        job = manager.submit("rank-products", "/rank-products", fn)
+        finished = await manager.wait(job.id, 1)
+        manager.close()
+        return finished
+
+    job = asyncio.run(run())
+    assert job.status == SUCCEEDED and 239 < job.result <= 240
+    assert job.to_dict()["result"] == job.result
+
+
+def test_failed_job_reports_the_error_and_status_code():
+    async def fn():
+        raise ValueError("Failed to rank products")
+
+    async def run():
+        manager = JobManager(workers=1)
+        job = manager.submit("rank-products", "/rank-products", fn)
+        await manager.wait(job.id, 1)
+        return job.to_dict()
+
+    job = asyncio.run(run())
+    assert (job["status"], job["error"], job["status_code"]) == (FAILED, "Failed to rank products", 500)
+
+
+def test_cancel_queued_and_running_jobs():
+    async def run():
+        manager = JobManager(workers=1)
+        running = manager.submit("rank-products", "/rank-products", sleeper(5))
+        queued = manager.submit("rank-products", "/rank-products", sleeper(5))
+        await asyncio.sleep(0.01)
+        assert (running.status, queued.status) == (RUNNING, QUEUED)
+        await manager.cancel(queued.id)
+        await manager.cancel(running.id)
+        return running, queued, manager
+
+    running, queued, manager = asyncio.run(run())
+    assert running.status == queued.status == CANCELLED
+    assert manager.stats()["cancelled"] == 2 and manager.stats()["running"] == 0
+
+
+def test_close_cancels_running_jobs():
+    async def run():
+        manager = JobManager(workers=1)
+        job = manager.submit("rank-products", "/rank-products", sleeper(5))
+        await asyncio.sleep(0.01)
+        manager.close()
+        await asyncio.sleep(0.01)
+        return job, manager
+
+    job, manager = asyncio.run(run())
+    assert job.status == CANCELLED and job.finished_at is not None
+    assert manager.stats()["running"] == 0
+
+
+def test_finished_jobs_expire_after_their_ttl():
+    async def run():
+        manager = JobManager(workers=1, ttl=0.05)
+        job = manager.submit("rank-products", "/rank-products", sleeper(0))
+        await manager.wait(job.id, 1)
+        time.sleep(0.1)
+        with pytest.raises(JobNotFound):
+            manager.get(job.id)
+        return manager
+
+    assert asyncio.run(run()).stats()["expired"] == 1
+
+
+def test_full_queue_rejects_new_jobs():
+    async def run():
+        manager = JobManager(workers=1, max_queued=1)
+        manager.submit("rank-products", "/rank-products", sleeper(5))
+        await asyncio.sleep(0.01)
+        manager.submit("rank-products", "/rank-products", sleeper(5))
+        with pytest.raises(JobQueueFull):
+            manager.submit("rank-products", "/rank-products", sleeper(5))
+        manager.close()
+        return manager
+
+    assert asyncio.run(run()).stats()["rejected"] == 1
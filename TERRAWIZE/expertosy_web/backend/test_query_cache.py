@@ -0,0 +1,47 @@
+import time
+
+from query_cache import QueryCache, normalize_query, is_near_duplicate
+
+
+def test_normalize_query():
+    assert normalize_query("  The Laptops!") == normalize_query("a laptop") == "laptop"
+    assert normalize_query("Gaming Chairs") == "gaming chair"
+    assert normalize_query("glass") == "glass"
+
+
+def test_near_duplicates_allow_typos_in_long_words_only():
+    assert is_near_duplicate("gaming labtop", "gaming laptop")
+    assert not is_near_duplicate("chair", "chain")
+    assert not is_near_duplicate("iphone 14", "iphone 15")
+    assert not is_near_duplicate("laptop", "laptop bag")
+
+
+def test_exact_and_near_duplicate_hits():
+    cache = QueryCache(ttl=60, enabled=True)
+    cache.set("factors", "Laptops", ["Battery"])
+    assert cache.get("factors", "a laptop") == ["Battery"]
+    assert cache.get("factors", "labtop") == ["Battery"]
+    assert cache.get("questionnaire", "laptop") is None
+    assert cache.get("factors", "laptop", extra="other factors") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["near_hits"], stats["misses"]) == (1, 1, 2)
+
+
+def test_expired_entries_are_evicted():
+    cache = QueryCache(ttl=0.05, enabled=True)
+    cache.set("factors", "laptop", ["Battery"])
+    time.sleep(0.1)
+    assert cache.get("factors", "laptop") is None
+    # The expired entry is gone from the trigram index as well, so it cannot be a near-duplicate hit either
+    assert cache.get("factors", "labtop") is None
+    assert cache.stats()["entries"] == 0 and cache.evictions == 1
+
+
+def test_least_recently_used_entry_is_evicted_when_full():
+    cache = QueryCache(max_entries=2, ttl=60, enabled=True)
+    cache.set("factors", "laptop", 1)
+    cache.set("factors", "monitor", 2)
+    cache.get("factors", "laptop")
+    cache.set("factors", "keyboard", 3)
+    assert cache.get("factors", "monitor") is None
+    assert cache.get("factors", "laptop") == 1 and cache.get("factors", "keyboard") == 3
@@ -0,0 +1,75 @@
+from question_index import (
+    QuestionIndex, QuestionIndexCache, topic_terms, category_terms, minhash, jaccard, format_questionnaire,
+    MINHASH_PERMUTATIONS
+)
+
+
+def parsed(text: str) -> dict:
+    return {"question": text, "options": ["A) Yes", "B) No"]}
+
+
+def test_topic_terms_fold_synonyms_and_drop_stop_words():
+    assert topic_terms("1. What is your budget?") == topic_terms("How much are you willing to spend?") == {"price"}
+    assert topic_terms("How important is battery life for laptops?", category_terms("laptops")) == {"battery"}
+
+
+def test_jaccard():
+    assert jaccard(frozenset("ab"), frozenset("ab")) == 1.0
+    assert jaccard(frozenset("ab"), frozenset("bc")) == 1 / 3
+    assert jaccard(frozenset(), frozenset()) == 0.0
+
+
+def test_minhash_estimates_jaccard():
+    left = frozenset(f"term{i}" for i in range(40))
+    right = frozenset(f"term{i}" for i in range(20, 60))
+    signatures = minhash(left), minhash(right)
+    assert len(signatures[0]) == MINHASH_PERMUTATIONS
+    assert minhash(left) == signatures[0]
+    estimate = sum(a == b for a, b in zip(*signatures)) / MINHASH_PERMUTATIONS
+    assert abs(estimate - jaccard(left, right)) < 0.2
+
+
+def test_duplicate_of_finds_reworded_questions():
+    index = QuestionIndex.from_questions(["1. What is your budget?", "2. How important is battery life?"], "laptop")
+    assert index.duplicate_of("How much are you willing to spend on a laptop?") == "1. What is your budget?"
+    assert index.duplicate_of("3. What is your BUDGET") == "1. What is your budget?"
+    assert index.duplicate_of("Which screen size do you prefer?") is None
+    assert len(index) == 2
+
+
+def test_filter_drops_repeats_within_a_round_and_leaves_the_index_alone():
+    index = QuestionIndex.from_questions(["What is your budget?"], "laptop")
+    kept, repeated = index.filter([
+        parsed("How much can you afford to pay?"),
+        parsed("How portable does it need to be?"),
+        parsed("How much does weight and portability matter when you travel?"),
+        parsed("Which screen size do you prefer?"),
+    ])
+    assert [question["question"] for question in kept] == ["How portable does it need to be?",
+                                                          "Which screen size do you prefer?"]
+    assert [question["duplicate_of"] for question in repeated] == ["What is your budget?",
+                                                                  "How portable does it need to be?"]
+    assert len(index) == 1
+
+
+def test_filter_respects_limit_and_accepted():
+    index = QuestionIndex("laptop")
+    kept, _ = index.filter([parsed("Which screen size do you prefer?"), parsed("What is your budget?")],
+                           accepted=[parsed("How big should the display be?")], limit=1)
+    assert [question["question"] for question in kept] == ["What is your budget?"]
+
+
+def test_index_cache_updates_and_discards_by_session():
+    cache = QuestionIndexCache(max_entries=2)
+    index = cache.get("laptop", "s1", ["What is your budget?"])
+    assert cache.get("laptop", "s1", ["What is your budget?", "Which screen size?"]) is index
+    assert len(index) == 2
+    cache.get("phone", "s2", [])
+    cache.get("tablet", "s3", [])
+    assert cache.stats() == {"indexes": 2, "hits": 1, "misses": 3}
+    cache.discard("s3")
+    assert cache.stats()["indexes"] == 1
+
+
+def test_format_questionnaire_renumbers():
+    assert format_questionnaire([parsed("Budget?"), parsed("Size?")]) == "1. Budget?\nA) Yes\nB) No\n\n2. Size?\nA) Yes\nB) No"
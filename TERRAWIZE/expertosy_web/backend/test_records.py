@@ -0,0 +1,46 @@
+from records import Product, parse_price, parse_product_line, parse_products, product_id, product_lines
+
+
+def test_product_id_ignores_numbering_case_and_spacing():
+    assert parse_product_line("1. Dell XPS 15 - $1,499", 0).id == parse_product_line("7) dell  xps-15 - $1499", 3).id
+    assert product_id("MacBook Air M1") == product_id("macbook air, m1")
+
+
+def test_product_id_keeps_plus_models_apart():
+    pairs = [
+        ("Samsung Galaxy S23", "Samsung Galaxy S23+"),
+        ("iPhone 15 Pro", "iPhone 15 Pro+"),
+        ("Galaxy Note 10", "Galaxy Note 10+"),
+        ("Google Pixel 8 Pro", "Google Pixel 8 Pro +"),
+    ]
+    for base, plus in pairs:
+        assert product_id(base) != product_id(plus), (base, plus)
+
+
+def test_parse_products_keeps_plus_models():
+    products = parse_products(["1. Samsung Galaxy S23 - $799", "2. Samsung Galaxy S23+ - $999",
+                               "3. Pixel 8 Pro - $999", "4. Pixel 8 Pro+ - $1,099"])
+    assert [product.name for product in products] == ["Samsung Galaxy S23", "Samsung Galaxy S23+",
+                                                      "Pixel 8 Pro", "Pixel 8 Pro+"]
+    assert len(product_lines(["Galaxy S23 - $799", "Galaxy S23+ - $999"])) == 2
+
+
+def test_parse_products_drops_only_repeated_names():
+    products = parse_products(["1. Dell XPS 15 - $1,499", "2. dell  xps 15 - $1,499", "", "3. Dell XPS-15 - $1,499"])
+    # The same name again is a repeat; a differently written name with the same id is kept
+    assert [product.name for product in products] == ["Dell XPS 15", "Dell XPS-15"]
+    assert [product.position for product in products] == [0, 1]
+
+
+def test_parse_products_accepts_dicts_and_records():
+    record = Product("LG Gram 17", 1599.0)
+    products = parse_products([{"name": "Acer Swift 3", "price": "$699"}, record])
+    assert products[0].price == 699.0
+    assert products[1] is record
+
+
+def test_parse_price():
+    assert parse_price("$1,299.99") == 1299.99
+    assert parse_price("1.2k") == 1200.0
+    assert parse_price(999) == 999.0
+    assert parse_price("call for price") is None
@@ -0,0 +1,79 @@
+import json
+import time
+import uuid
+import asyncio
+
+from rerank import RankingMemory, products_fingerprint, preference_diff, parse_delta, apply_delta
+from app import ExpertosyRecommendationEngine
+
+PRODUCTS = ["1. Dell XPS 15 - $1,499", "2. MacBook Air M1 - $999", "3. Acer Swift 3 - $699"]
+RANKING = [
+    {"name": "Dell XPS 15", "price": "$1,499", "explanation": "Fastest", "advantages": ["OLED"], "why_not_first": ""},
+    {"name": "MacBook Air M1", "price": "$999", "explanation": "Quiet", "advantages": ["Battery"],
+     "why_not_first": "Slower"},
+    {"name": "Acer Swift 3", "price": "$699", "explanation": "Cheap", "advantages": ["Price"],
+     "why_not_first": "Plain"},
+]
+
+
+def test_fingerprint_ignores_numbering_and_order():
+    assert products_fingerprint(PRODUCTS) == products_fingerprint(["Acer Swift 3 - $699", "Dell XPS 15 - $1,499",
+                                                                   "MacBook Air M1 - $999"])
+    assert products_fingerprint(PRODUCTS) != products_fingerprint(["Dell XPS 15 - $1,299"] + PRODUCTS[1:])
+
+
+def test_preference_diff():
+    assert preference_diff({"Budget?": "A", "Size?": "B"}, {"Budget?": "C", "Use?": "D", "Size?": "B"}) == {
+        "Budget?": ("A", "C"), "Use?": (None, "D")
+    }
+
+
+def test_parse_and_apply_delta():
+    order, updates = parse_delta(
+        '```json\n{"order": ["p3", "P1"], "updated": [{"id": "P3", "explanation": "Now best"}]}\n```'
+    )
+    assert order == ["P3", "P1"] and set(updates) == {"P3"}
+    ranked = apply_delta(RANKING, order, updates)
+    # Products the model left out keep their relative order at the end
+    assert [product["name"] for product in ranked] == ["Acer Swift 3", "Dell XPS 15", "MacBook Air M1"]
+    assert ranked[0]["explanation"] == "Now best" and ranked[0]["why_not_first"] == ""
+    assert ranked[0]["advantages"] == ["Price"]
+    assert ranked[1]["why_not_first"] == "Ranked below Acer Swift 3 given your updated answers"
+    assert parse_delta("no json here") == ([], {})
+
+
+def test_memory_expires_entries():
+    memory = RankingMemory(ttl=0.05)
+    key = memory.key("session", PRODUCTS)
+    memory.remember(key, {"Budget?": "A"}, RANKING)
+    assert memory.get(key) == ({"Budget?": "A"}, RANKING)
+    time.sleep(0.1)
+    assert memory.get(key) is None
+
+
+def test_changed_answer_reranks_from_the_previous_order():
+    engine = ExpertosyRecommendationEngine("laptop")
+    prompts = []
+
+    async def get_completion(messages, profile="default"):
+        prompts.append(profile)
+        return json.dumps({"order": ["P2", "P1", "P3"], "updated": []})
+
+    async def full_rank():
+        prompts.append("full")
+        return [dict(product) for product in RANKING]
+
+    engine._get_completion = get_completion
+    session_id = uuid.uuid4().hex
+    preferences = {"Budget?": "B) $1,000 - $1,500", "Use?": "A) Work", "Size?": "A) 13 inch"}
+
+    async def run():
+        await engine.rank_products_incremental(PRODUCTS, preferences, session_id, full_rank)
+        unchanged = await engine.rank_products_incremental(PRODUCTS, dict(preferences), session_id, full_rank)
+        changed = {**preferences, "Budget?": "A) Under $1,000"}
+        return unchanged, await engine.rank_products_incremental(PRODUCTS, changed, session_id, full_rank)
+
+    unchanged, reranked = asyncio.run(run())
+    assert [product["name"] for product in unchanged] == [product["name"] for product in RANKING]
+    assert [product["name"] for product in reranked] == ["MacBook Air M1", "Dell XPS 15", "Acer Swift 3"]
+    assert prompts == ["full", "rerank_products"]
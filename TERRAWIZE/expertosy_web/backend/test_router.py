@@ -0,0 +1,130 @@
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from profiles import get_profile
+from router import LLMRouter, LLMBackend, NoBackendAvailable, CLOSED, OPEN, HALF_OPEN
+
+REQUEST = httpx.Request("POST", "http://llm/chat/completions")
+PROFILE = get_profile("generate_factors")
+
+
+def server_error() -> openai.APIStatusError:
+    return openai.InternalServerError("boom", response=httpx.Response(500, request=REQUEST), body=None)
+
+
+class StubClient:
+    """Stands in for AsyncOpenAI: answers with the name of its backend or raises the queued errors"""
+
+    def __init__(self, name: str, errors=()):
+        self.name = name
+        self.errors = list(errors)
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **params):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.name
+
+
+def backend(name: str, errors=()) -> LLMBackend:
+    return LLMBackend(name, client=StubClient(name, errors))
+
+
+def test_breaker_opens_after_failures_in_a_row():
+    llm = backend("a")
+    for _ in range(2):
+        llm.record_failure(failures=3, error_rate=1.0)
+    assert llm.state == CLOSED
+    llm.record_failure(failures=3, error_rate=1.0)
+    assert llm.state == OPEN and llm.trips == 1
+    assert not llm.available(time.monotonic(), cooldown=30)
+
+
+def test_breaker_opens_on_error_rate():
+    llm = LLMBackend("a", error_alpha=0.5)
+    llm.record_failure(failures=100, error_rate=0.7)
+    assert llm.state == CLOSED
+    llm.record_success("p", 1.0)
+    llm.record_failure(failures=100, error_rate=0.6)
+    assert llm.state == OPEN
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker():
+    llm = backend("a")
+    for _ in range(5):
+        llm.record_failure(failures=5, error_rate=1.0)
+    llm.opened_at -= 31
+    assert llm.available(time.monotonic(), cooldown=30)
+    assert llm.state == HALF_OPEN
+    # A failed probe opens the breaker again at once
+    llm.record_failure(failures=5, error_rate=1.0)
+    assert llm.state == OPEN and llm.trips == 2
+    llm.opened_at -= 31
+    llm.available(time.monotonic(), cooldown=30)
+    llm.record_success("p", 0.5)
+    assert llm.state == CLOSED and llm.consecutive_failures == 0
+
+
+def test_only_one_probe_at_a_time_unless_nothing_else_is_healthy():
+    a, b = backend("a"), backend("b")
+    router = LLMRouter([a, b], explore=0, cooldown=30)
+    a.state, a.opened_at = OPEN, time.monotonic() - 31
+    assert router.pick("p") is a
+    a.probing = True
+    assert router.pick("p") is b
+    b.state, b.opened_at = OPEN, time.monotonic()
+    # With b out of rotation, calls join a's probe rather than being shed
+    assert router.pick("p") is a
+
+
+def test_pick_measures_new_backends_then_prefers_the_fastest():
+    a, b = backend("a"), backend("b")
+    router = LLMRouter([a, b], explore=0)
+    a.record_success("p", 2.0)
+    assert router.pick("p") is b
+    b.in_flight = 1
+    assert router.pick("p") is a
+    b.in_flight = 0
+    b.record_success("p", 0.5)
+    assert router.pick("p") is b
+    # Latencies are per profile
+    assert router.pick("other") is a
+
+
+def test_create_falls_back_to_the_next_backend():
+    a = backend("a", [openai.APIConnectionError(request=REQUEST)])
+    b = backend("b")
+    router = LLMRouter([a, b], explore=0)
+    a.record_success(PROFILE.name, 0.1)
+    b.record_success(PROFILE.name, 0.2)
+    answered, response = asyncio.run(router.create(PROFILE, [{"role": "user", "content": "hi"}]))
+    assert (answered, response) == (b, "b")
+    assert router.fallbacks == 1 and a.failures == 1
+
+
+def test_create_raises_request_errors_without_fallback():
+    error = openai.BadRequestError("bad", response=httpx.Response(400, request=REQUEST), body=None)
+    a, b = backend("a", [error]), backend("b")
+    router = LLMRouter([a, b], explore=0)
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(router.create(PROFILE, []))
+    assert b.client.calls == 0 and a.failures == 0
+
+
+def test_create_sheds_when_every_breaker_is_open():
+    a = backend("a", [server_error()] * 2)
+    router = LLMRouter([a], failures=2, cooldown=30)
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            asyncio.run(router.create(PROFILE, []))
+    with pytest.raises(NoBackendAvailable) as shed:
+        asyncio.run(router.create(PROFILE, []))
+    assert 0 < shed.value.retry_after <= 30
+    assert router.shed == 1 and a.client.calls == 2
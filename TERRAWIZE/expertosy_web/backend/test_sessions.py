@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from sessions import (
+    SessionStore, SessionNotFound, InvalidAnswers, MemorySessionBackend, RedisSessionBackend, question_id
+)
+
+# A Redis-compatible server in-process, so the redis backend is tested without running one
+fakeredis = pytest.importorskip("fakeredis")
+
+PRODUCTS = ["1. Dell XPS 15 - $1,499", "2. MacBook Air M1 - $999"]
+
+
+def backends():
+    return [MemorySessionBackend(), RedisSessionBackend(client=fakeredis.FakeAsyncRedis())]
+
+
+@pytest.mark.parametrize("backend", backends(), ids=lambda backend: backend.name)
+def test_session_round_trip(backend):
+    async def run():
+        store = SessionStore(backend, ttl=60)
+        session = await store.create("laptop", PRODUCTS)
+        ids = session.add_questions(["1. What is your budget?", "2. Which size do you prefer?"])
+        session.record_answers({ids[0]: "B) $1,000 - $1,500", "Which size do you prefer?": "A) 13 inch"})
+        await store.save(session)
+
+        loaded = await store.get(session.id)
+        assert loaded.products == PRODUCTS
+        assert loaded.rounds == 1
+        assert loaded.preferences() == {"What is your budget?": "B) $1,000 - $1,500",
+                                        "Which size do you prefer?": "A) 13 inch"}
+
+        await store.delete(session.id)
+        with pytest.raises(SessionNotFound):
+            await store.get(session.id)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", backends(), ids=lambda backend: backend.name)
+def test_session_expires_after_ttl(backend):
+    async def run():
+        store = SessionStore(backend, ttl=0.2)
+        session = await store.create("laptop", PRODUCTS)
+        await asyncio.sleep(0.5)
+        with pytest.raises(SessionNotFound):
+            await store.get(session.id)
+
+    asyncio.run(run())
+
+
+def test_reading_a_session_extends_its_expiry():
+    async def run():
+        store = SessionStore(MemorySessionBackend(), ttl=0.5)
+        session = await store.create("laptop", PRODUCTS)
+        await asyncio.sleep(0.3)
+        await store.get(session.id)
+        await asyncio.sleep(0.35)
+        assert (await store.get(session.id)).id == session.id
+
+    asyncio.run(run())
+
+
+def test_redis_backend_shares_sessions_between_stores():
+    async def run():
+        server = fakeredis.FakeServer()
+        # Two workers, each with its own client of the same server
+        first = SessionStore(RedisSessionBackend(client=fakeredis.FakeAsyncRedis(server=server)), ttl=60)
+        second = SessionStore(RedisSessionBackend(client=fakeredis.FakeAsyncRedis(server=server)), ttl=60)
+        session = await first.create("laptop", PRODUCTS)
+        assert (await second.get(session.id)).products == PRODUCTS
+        assert await first.backend.client.pttl(first.backend.prefix + session.id) > 0
+
+    asyncio.run(run())
+
+
+def test_question_id_ignores_numbering_case_and_punctuation():
+    assert question_id("1. What is your budget?") == question_id("what is your BUDGET")
+    assert question_id("What is your budget?") != question_id("What is your screen size?")
+
+
+def test_record_answers_rejects_answers_that_are_not_an_object():
+    async def run():
+        session = await SessionStore(MemorySessionBackend(), ttl=60).create("laptop", PRODUCTS)
+        with pytest.raises(InvalidAnswers):
+            session.record_answers(["B) $1,000 - $1,500"])
+        assert session.answers == {}
+
+    asyncio.run(run())
@@ -0,0 +1,88 @@
+import uuid
+import asyncio
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight, WorkerLock
+from hedging import deadline_scope
+
+
+def counting_call(result="answer", delay=0.05):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+
+    return fn, calls
+
+
+def test_concurrent_calls_with_the_same_key_share_one_execution():
+    flight = SingleFlight("test")
+    fn, calls = counting_call()
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(5)), flight.do("other", fn))
+
+    assert asyncio.run(run()) == ["answer"] * 6
+    assert len(calls) == 2
+    assert flight.stats()["leaders"] == 2 and flight.stats()["collapsed"] == 4 and flight.stats()["in_flight"] == 0
+
+
+def test_shared_call_is_cancelled_only_when_every_caller_is():
+    flight = SingleFlight("test")
+    fn, calls = counting_call(delay=0.2)
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", fn))
+        second = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "answer"
+        third = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert len(calls) == 2 and flight.abandoned == 1
+
+
+@pytest.mark.skipif(singleflight.fcntl is None, reason="cross-worker coalescing needs flock")
+def test_waits_for_another_workers_call_and_reuses_its_result():
+    flight = SingleFlight(f"test-{uuid.uuid4().hex}", cross_worker=True)
+    fn, calls = counting_call()
+    published = []
+
+    async def run():
+        # Another worker leads the call and publishes its result after a while
+        other_worker = WorkerLock((flight.name, "key"))
+        assert other_worker.try_acquire()
+        follower = asyncio.ensure_future(flight.do("key", fn, lambda: published[0] if published else None))
+        await asyncio.sleep(0.1)
+        published.append("from the other worker")
+        other_worker.release()
+        return await follower
+
+    assert asyncio.run(run()) == "from the other worker"
+    assert calls == [] and flight.collapsed_cross_worker == 1
+
+
+@pytest.mark.skipif(singleflight.fcntl is None, reason="cross-worker coalescing needs flock")
+def test_stops_waiting_for_another_worker_at_its_share_of_the_deadline():
+    flight = SingleFlight(f"test-{uuid.uuid4().hex}", cross_worker=True)
+    fn, calls = counting_call()
+
+    async def run():
+        other_worker = WorkerLock((flight.name, "key"))
+        assert other_worker.try_acquire()
+        try:
+            with deadline_scope("/rank-products", 0.2):
+                return await flight.do("key", fn, lambda: None)
+        finally:
+            other_worker.release()
+
+    assert asyncio.run(run()) == "answer"
+    assert len(calls) == 1 and flight.wait_timeouts == 1
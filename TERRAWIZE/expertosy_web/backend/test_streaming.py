@@ -0,0 +1,46 @@
+import json
+
+from streaming import RankedProductStreamParser, salvage_ranked_products
+
+PRODUCTS = [
+    {"name": "Dell XPS 15", "price": "$1,499", "explanation": "Fast, with a {great} screen", "advantages": ["OLED"]},
+    {"name": "MacBook Air M1", "price": "$999", "explanation": "Quiet \"fanless\" design", "advantages": []},
+]
+RANKING = json.dumps({"ranked_products": PRODUCTS})
+
+
+def test_salvage_takes_well_formed_json_as_is():
+    assert salvage_ranked_products(RANKING) == (PRODUCTS, True)
+    assert salvage_ranked_products(json.dumps(PRODUCTS)) == (PRODUCTS, True)
+
+
+def test_salvage_skips_fences_and_prose():
+    fenced = f"```json\n{RANKING}\n```"
+    assert salvage_ranked_products(fenced) == (PRODUCTS, True)
+    wrapped = f"Here is the ranking you asked for:\n{RANKING}\nLet me know if you need more detail."
+    assert salvage_ranked_products(wrapped) == (PRODUCTS, True)
+
+
+def test_salvage_keeps_the_complete_fields_of_a_truncated_product():
+    cut = RANKING.index('"explanation": "Quiet')
+    products, complete = salvage_ranked_products(RANKING[:cut + 15])
+    assert not complete
+    assert products == [PRODUCTS[0], {"name": "MacBook Air M1", "price": "$999"}]
+
+
+def test_salvage_drops_a_product_cut_off_in_its_name():
+    products, complete = salvage_ranked_products(RANKING[:RANKING.index("Air M1")])
+    assert (products, complete) == ([PRODUCTS[0]], False)
+
+
+def test_salvage_of_prose_without_products():
+    assert salvage_ranked_products("Sorry, I cannot rank these products.") == ([], False)
+
+
+def test_stream_parser_emits_each_product_as_it_closes():
+    parser = RankedProductStreamParser()
+    emitted = []
+    for index in range(0, len(RANKING), 7):
+        emitted.extend(parser.feed(RANKING[index:index + 7]))
+    assert emitted == PRODUCTS
+    assert parser.closed and parser.emitted == 2
@@ -0,0 +1,92 @@
+import json
+import asyncio
+
+from admission import UpstreamUnavailable
+from app import ExpertosyRecommendationEngine
+from profiles import GENERATION_PROFILES
+from tournament import (
+    chunk, run_listing, parse_merge_order, merge_runs, merge_max_tokens, tournament_deadline,
+    TOURNAMENT_CHUNK_DEADLINE, TOURNAMENT_MERGE_DEADLINE
+)
+
+
+def products(label: str, count: int) -> list:
+    return [{"id": f"{label}{i}", "name": f"{label} product {i}", "price": f"${100 * i}"} for i in range(1, count + 1)]
+
+
+def test_chunk_is_even_and_keeps_order():
+    items = list(range(20))
+    chunks = chunk(items, 8)
+    assert [len(part) for part in chunks] == [7, 7, 6]
+    assert sum(chunks, []) == items
+    assert chunk([], 8) == []
+    assert chunk([1, 2, 3], 8) == [[1, 2, 3]]
+
+
+def test_run_listing_labels_positions():
+    assert run_listing("A", products("x", 2)) == "A1. x product 1 - $100\nA2. x product 2 - $200"
+
+
+def test_parse_merge_order_tolerates_text_and_fences():
+    assert parse_merge_order('Sure:\n```json\n{"order": ["a2", "B1", "A1"]}\n```') == ["A2", "B1", "A1"]
+    assert parse_merge_order("no order here") == []
+
+
+def test_parse_merge_order_keeps_ids_of_a_truncated_answer():
+    assert parse_merge_order('{"order": ["B1", "A1", "A2", "B') == ["B1", "A1", "A2"]
+
+
+def test_merge_runs_follows_order_and_keeps_run_order():
+    left, right = products("l", 3), products("r", 2)
+    merged = merge_runs(left, right, ["B1", "A1", "A2", "B2", "A3"])
+    assert [product["id"] for product in merged] == ["r1", "l1", "l2", "r2", "l3"]
+    # An order contradicting a run's own ranking cannot reorder that run
+    merged = merge_runs(left, right, ["A3", "A1", "B1", "A2", "B2"])
+    assert [product["id"] for product in merged if product["id"].startswith("l")] == ["l1", "l2", "l3"]
+
+
+def test_merge_runs_places_dropped_ids_by_fallback_scores():
+    left, right = products("l", 2), products("r", 2)
+    merged = merge_runs(left, right, [], {"l1": 0.1, "l2": 0.0, "r1": 0.9, "r2": 0.5})
+    assert [product["id"] for product in merged] == ["r1", "r2", "l1", "l2"]
+    merged = merge_runs(left, right, ["A1"], {"r1": 0.9})
+    assert [product["id"] for product in merged][0] == "l1"
+    assert len(merged) == 4
+
+
+def test_merge_max_tokens_fits_every_id():
+    for count in (16, 100, 400):
+        answer = json.dumps({"order": [f"A{i}" for i in range(1, count + 1)]})
+        # Well above a tokenizer's count of the full answer
+        assert merge_max_tokens(count) >= len(answer) / 2
+    assert merge_max_tokens(200) > GENERATION_PROFILES["merge_rankings"].max_tokens
+
+
+def test_tournament_deadline_grows_with_waves_of_calls():
+    # 2 chunks: one wave of chunk rankings and one merge
+    assert tournament_deadline(2, 4) == TOURNAMENT_CHUNK_DEADLINE + TOURNAMENT_MERGE_DEADLINE
+    # 13 chunks at concurrency 4: 4 chunk waves; merge rounds of 6, 3, 2 and 1 merges take 2, 1, 1 and 1 waves
+    assert tournament_deadline(13, 4) == 4 * TOURNAMENT_CHUNK_DEADLINE + 5 * TOURNAMENT_MERGE_DEADLINE
+    assert tournament_deadline(1, 4) == TOURNAMENT_CHUNK_DEADLINE
+    assert tournament_deadline(50, 4) > tournament_deadline(13, 4)
+
+
+def test_failed_chunk_is_ranked_locally():
+    products_list = [f"{i}. Laptop {i} - ${500 + 50 * i}" for i in range(1, 21)]
+    engine = ExpertosyRecommendationEngine("laptop")
+    ranked_chunks = []
+
+    async def rank_products(chunk_products, ranking_preferences):
+        if not ranked_chunks:
+            ranked_chunks.append(None)
+            raise UpstreamUnavailable("shed", 1)
+        return engine.rank_products_locally(chunk_products, ranking_preferences)
+
+    async def get_completion(messages, profile="default"):
+        return '{"order": []}'
+
+    engine.rank_products = rank_products
+    engine._get_completion = get_completion
+    ranked = asyncio.run(engine.rank_products_tournament(products_list, {"Budget": "A) Under $1,000"}, chunk_size=8))
+    assert sorted(product["name"] for product in ranked) == sorted(f"Laptop {i}" for i in range(1, 21))
+    assert all("score" not in product for product in ranked if product["name"] in ("Laptop 1", "Laptop 2"))
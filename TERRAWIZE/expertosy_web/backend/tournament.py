@@ -0,0 +1,115 @@
+"""
+Helpers for chunked tournament ranking of large product lists.
+
+A single ranking prompt truncates past roughly a dozen products, so large lists
+are split into chunks that are ranked concurrently. The ranked chunks (runs)
+are then merged pairwise in rounds, like a parallel merge sort where every
+merge step is one compact LLM call answering with product ids only. Wall-clock
+time grows with the number of rounds, log2(chunks), not with the list length.
+"""
+import os
+import re
+import json
+import math
+from typing import Dict, List, Optional
+
+TOURNAMENT_CHUNK_SIZE = int(os.getenv("TOURNAMENT_CHUNK_SIZE", "8"))
+TOURNAMENT_CONCURRENCY = int(os.getenv("TOURNAMENT_CONCURRENCY", "4"))
+# Lists longer than this are ranked as a tournament unless the client picks a mode
+TOURNAMENT_THRESHOLD = int(os.getenv("TOURNAMENT_THRESHOLD", "12"))
+# Deadline budget per wave of concurrent chunk rankings and of concurrent merges
+TOURNAMENT_CHUNK_DEADLINE = float(os.getenv("TOURNAMENT_CHUNK_DEADLINE", "30"))
+TOURNAMENT_MERGE_DEADLINE = float(os.getenv("TOURNAMENT_MERGE_DEADLINE", "20"))
+
+# Completion tokens of one id in a merge answer ('"A12", '), used to size merge calls to their runs
+MERGE_TOKENS_PER_PRODUCT = int(os.getenv("MERGE_TOKENS_PER_PRODUCT", "6"))
+
+ORDER_RE = re.compile(r'\{.*\}', re.DOTALL)
+ORDER_ID_RE = re.compile(r'"([AB]\d+)"', re.IGNORECASE)
+
+
+def chunk(items: list, size: int) -> List[list]:
+    """Split items into consecutive, evenly sized chunks of at most size items"""
+    if not items:
+        return []
+    count = -(-len(items) // size)
+    base, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for index in range(count):
+        end = start + base + (1 if index < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def tournament_deadline(chunks: int, concurrency: int) -> float:
+    """
+    Deadline budget of a tournament over this many chunks.
+
+    Chunks are ranked concurrency at a time, then every merge round runs its merges concurrency at a time,
+    so the budget grows with the waves of calls rather than being one endpoint's fixed figure.
+    """
+    concurrency = max(concurrency, 1)
+    budget = TOURNAMENT_CHUNK_DEADLINE * math.ceil(chunks / concurrency)
+    runs = chunks
+    while runs > 1:
+        budget += TOURNAMENT_MERGE_DEADLINE * math.ceil((runs // 2) / concurrency)
+        runs = math.ceil(runs / 2)
+    return budget
+
+
+def run_listing(label: str, run: List[dict]) -> str:
+    return "\n".join(f"{label}{position}. {product['name']} - {product['price']}" for position, product in enumerate(run, 1))
+
+
+def merge_max_tokens(products: int) -> int:
+    """Completion tokens a merge answer listing every id of runs with this many products needs"""
+    return 40 + MERGE_TOKENS_PER_PRODUCT * products
+
+
+def parse_merge_order(response: str) -> List[str]:
+    """
+    Extract the list of ids from a merge completion, tolerating extra text around the JSON.
+
+    An answer cut off part way keeps the ids it got to, so only the tail of the order is lost.
+    """
+    text = response.replace('```json', '').replace('```', '')
+    match = ORDER_RE.search(text)
+    try:
+        order = json.loads(match.group(0)).get("order", []) if match else None
+    except (json.JSONDecodeError, AttributeError):
+        order = None
+    if not isinstance(order, list):
+        order = ORDER_ID_RE.findall(text)
+    return [str(item).strip().upper() for item in order if isinstance(item, (str, int))]
+
+
+def merge_runs(left: List[dict], right: List[dict], order: List[str],
+               fallback_scores: Optional[Dict[str, float]] = None) -> List[dict]:
+    """
+    Merge two ranked runs following the model's id order.
+
+    Each run's own order is always preserved; ids the model dropped sort after
+    the ones it placed, using fallback_scores (by product id, higher first) when available.
+    """
+    positions = {identifier: index for index, identifier in enumerate(order)}
+    fallback_scores = fallback_scores or {}
+
+    def key(label: str, position: int, product: dict) -> tuple:
+        placed = positions.get(f"{label}{position}")
+        if placed is not None:
+            return (0, placed)
+        return (1, -fallback_scores.get(product.get('id'), 0.0))
+
+    merged = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if key("A", i + 1, left[i]) <= key("B", j + 1, right[j]):
+            merged.append(left[i])
+            i += 1
+        else:
+            merged.append(right[j])
+            j += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return merged
@@ -19,6 +19,7 @@ interface SearchExample {
 
 interface ApiResponse {
   factors: string[];
+  questionnaire_token?: string;
 }
 
 const MotionDiv = motion.div;
@@ -104,7 +105,8 @@ const LandingPage: React.FC = () => {
         navigate('/questionnaire', {
           state: {
             searchQuery: searchQuery.trim(),
-            factors: response.data.factors
+            factors: response.data.factors,
+            questionnaireToken: response.data.questionnaire_token
           }
         });
       } else {
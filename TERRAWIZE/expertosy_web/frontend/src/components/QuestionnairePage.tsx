@@ -122,7 +122,7 @@ const QuestionnairePage: React.FC = () => {
   }, [navigate, location.state]);
 
   useEffect(() => {
-    const state = location.state as { searchQuery?: string, factors?: string[] };
+    const state = location.state as { searchQuery?: string, factors?: string[], questionnaireToken?: string };
     
     const generateQuestionnaire = async () => {
       if (!searchQuery || !state?.factors) return;
@@ -140,6 +140,7 @@ const QuestionnairePage: React.FC = () => {
         const response = await api.post('/create-questionnaire', { 
           search_query: searchQuery.trim(),
           factors: state.factors,
+          questionnaire_token: state.questionnaireToken,
           location: userLocation
         });
 